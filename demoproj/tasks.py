@@ -40,3 +40,33 @@ def example_rq_task(*, message: dict, topic_name: str, subscription_name: str, s
     RQ Example Task
     """
     print('Do Something')  # noqa: T201
+
+
+async def example_inline_task(*, message: dict, topic_name: str, subscription_name: str, subject: str) -> None:
+    """
+    Inline Example Task. Async handlers are awaited in the metroid process with the `inline` worker type
+    """
+    print('Do Something')  # noqa: T201
+
+
+async def async_error_task(*, message: dict, topic_name: str, subscription_name: str, subject: str) -> None:
+    """
+    Mocked async function for tests, which always fails.
+    """
+    raise ValueError('My mocked async error :)')
+
+
+@app.task(base=MetroidTask)
+def example_batch_task(*, messages: list[dict], topic_name: str, subscription_name: str, subject: str) -> None:
+    """
+    Batch Example Task. With `'batch': True`, the handler gets the messages in batches, so they can be written in bulk
+    """
+    print(f'Do Something with {len(messages)} messages')  # noqa: T201
+
+
+@app.task(base=MetroidTask)
+def batch_error_task(*, messages: list[dict], topic_name: str, subscription_name: str, subject: str) -> None:
+    """
+    Mocked batch function for tests, which always fails.
+    """
+    raise ValueError('My mocked batch error :)')
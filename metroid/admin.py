@@ -1,4 +1,5 @@
 import logging
+from collections.abc import Callable
 
 from django.contrib import admin, messages
 from django.db.models import QuerySet
@@ -6,8 +7,11 @@ from django.http import HttpRequest
 
 import requests
 
+from metroid.backends import get_backend
 from metroid.config import settings
+from metroid.dispatch import MessageTask, build_tasks
 from metroid.models import FailedMessage, FailedPublishMessage
+from metroid.routing import Router
 
 logger = logging.getLogger('metroid')
 
@@ -30,54 +34,80 @@ class FailedMessageAdmin(admin.ModelAdmin):
 
     def retry(self, request: HttpRequest, queryset: QuerySet) -> None:
         """
-        Retry a failed message.
+        Retry failed messages. The tasks are handed to the worker backend together, so backends that batch enqueue
+        all of them in one round trip.
         """
+        retried: list[tuple[FailedMessage, MessageTask]] = []
         for message in queryset:
             handler = settings.get_handler_function(
                 topic_name=message.topic_name, subscription_name=message.subscription_name, subject=message.subject
             )
             if handler:
-                try:
-                    logger.info('Attempting to retry id %s', message.id)
-
-                    if settings.worker_type == 'celery':
-                        handler.apply_async(  # type: ignore
-                            kwargs={
-                                'message': message.message,
-                                'topic_name': message.topic_name,
-                                'subscription_name': message.subscription_name,
-                                'subject': message.subject,
-                            }
-                        )
-                    elif settings.worker_type == 'rq':
-                        import django_rq
-
-                        failed_job_registry = django_rq.get_queue('metroid').failed_job_registry
-                        failed_job_registry.requeue(message.message.get('id'))
-
-                    logger.info('Deleting %s from database', message.id)
-                    message.delete()
-                    logger.info('Returning')
-                    self.message_user(
-                        request=request,
-                        message='Task has been retried.',
-                        level=messages.SUCCESS,
-                    )
-                except Exception as error:
-                    logger.exception('Unable to retry Metro message. Error: %s', error)
-                    self.message_user(
-                        request=request,
-                        message=f'Unable to retry Metro message. Error: {error}',
-                        level=messages.ERROR,
-                    )
+                logger.info('Attempting to retry id %s', message.id)
+                retried.append((message, self._get_retry_task(message=message, handler_function=handler)))
             else:
-                logger.warning('No handler found for %s', message.id)
+                self._no_handler_found(request=request, message=message)
+        if not retried:
+            return
+        backend = get_backend()
+        try:
+            errors = backend.retry_many([task for _, task in retried])
+        finally:
+            backend.close()
+        succeeded = 0
+        for (message, _), error in zip(retried, errors):
+            if error is None:
+                logger.info('Deleting %s from database', message.id)
+                message.delete()
+                succeeded += 1
+            else:
+                logger.error('Unable to retry Metro message. Error: %s', error, exc_info=error)
                 self.message_user(
                     request=request,
-                    message=f'No handler function found for id {message.id}.',
-                    level=messages.WARNING,
+                    message=f'Unable to retry Metro message. Error: {error}',
+                    level=messages.ERROR,
                 )
-        return
+        if succeeded:
+            self.message_user(
+                request=request,
+                message=f'{succeeded} task(s) have been retried.',
+                level=messages.SUCCESS,
+            )
+
+    @staticmethod
+    def _get_retry_task(message: FailedMessage, handler_function: Callable) -> MessageTask:
+        """
+        Builds the task for a failed message, with the job ID it got when it was received, so the failed job is
+        replaced. When several handlers matched the message, only the first handler's job ID is the message ID, the
+        others are suffixed with a checksum of their handler subject.
+        """
+        if isinstance(message.message, dict):
+            router = Router(
+                settings.get_handlers(topic_name=message.topic_name, subscription_name=message.subscription_name)
+            )
+            for task in build_tasks(
+                router.match(message.message.get('subject', '')),
+                message=message.message,
+                topic_name=message.topic_name,
+                subscription_name=message.subscription_name,
+            ):
+                if task.subject == message.subject:
+                    return task
+        return MessageTask(
+            handler_function=handler_function,
+            message=message.message,
+            topic_name=message.topic_name,
+            subscription_name=message.subscription_name,
+            subject=message.subject,
+        )
+
+    def _no_handler_found(self, request: HttpRequest, message: FailedMessage) -> None:
+        logger.warning('No handler found for %s', message.id)
+        self.message_user(
+            request=request,
+            message=f'No handler function found for id {message.id}.',
+            level=messages.WARNING,
+        )
 
 
 @admin.register(FailedPublishMessage)
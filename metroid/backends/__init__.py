@@ -0,0 +1,76 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from django.utils.module_loading import import_string
+
+from metroid.config import settings
+
+if TYPE_CHECKING:
+    from metroid.dispatch import MessageTask
+    from metroid.metrics import SubscriptionMetrics
+
+
+class Backend(ABC):
+    """
+    Base class of worker backends, which hand the tasks of received messages over to workers.
+
+    Every subscription creates its own backend instance, and calls it from one flush at a time, so a backend can
+    hold a connection without locking. `enqueue` and `enqueue_many` are blocking, and called from the enqueue
+    thread pool. To add a backend, subclass this class and set `METROID['backend']` to its dotted path.
+    """
+
+    # Whether the tasks of messages processed at the same time are grouped into one `enqueue_many` call
+    batched = True
+
+    @abstractmethod
+    def enqueue(self, task: 'MessageTask') -> None:
+        """
+        Enqueues one task
+        """
+
+    def enqueue_many(self, tasks: list['MessageTask']) -> None:
+        """
+        Enqueues the tasks, raising if any of them could not be enqueued.
+        Backends that can, should send all the tasks in one round trip.
+        """
+        for task in tasks:
+            self.enqueue(task)
+
+    async def aenqueue_many(self, tasks: list['MessageTask'], *, metrics: 'SubscriptionMetrics') -> None:
+        """
+        Enqueues the tasks from the event loop, running `enqueue_many` in the enqueue thread pool
+        """
+        from metroid.dispatch import run_in_enqueue_executor
+
+        await run_in_enqueue_executor(self.enqueue_many, tasks, metrics=metrics)
+
+    def retry_many(self, tasks: list['MessageTask']) -> list[Exception | None]:
+        """
+        Enqueues the tasks of failed messages again. Returns the error of every task that could not be enqueued.
+        """
+        errors: list[Exception | None] = []
+        for task in tasks:
+            try:
+                self.enqueue(task)
+                errors.append(None)
+            except Exception as error:
+                errors.append(error)
+        return errors
+
+    def queue_depth(self) -> int | None:
+        """
+        Returns how many tasks are waiting for a worker, used for backpressure. None if it isn't known.
+        """
+        return None
+
+    def close(self) -> None:  # noqa: B027, an optional hook
+        """
+        Releases the resources held by the backend
+        """
+
+
+def get_backend() -> Backend:
+    """
+    Creates an instance of the configured backend
+    """
+    return import_string(settings.backend)()
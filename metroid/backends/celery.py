@@ -0,0 +1,41 @@
+import logging
+
+from metroid.backends import Backend
+from metroid.celery import publish_tasks
+from metroid.dispatch import MessageTask
+
+logger = logging.getLogger('metroid')
+
+
+class CeleryBackend(Backend):
+    """
+    Sends the tasks to Celery. The tasks of a batch are published over one producer.
+    """
+
+    # The queue watched for backpressure. Defaults to Celery's `task_default_queue`
+    queue_name: str | None = None
+
+    def enqueue(self, task: MessageTask) -> None:
+        """
+        Sends one task with `apply_async`
+        """
+        task.handler_function.apply_async(kwargs=task.kwargs)  # type: ignore
+        logger.info('Celery task started')
+
+    def enqueue_many(self, tasks: list[MessageTask]) -> None:
+        """
+        Publishes the tasks over one producer from the pool
+        """
+        publish_tasks(tasks)
+
+    def queue_depth(self) -> int:
+        """
+        Returns the number of task messages on the queue, as reported by the broker
+        """
+        from celery import current_app
+
+        with current_app.connection_for_read() as connection:
+            queue = connection.default_channel.queue_declare(
+                queue=self.queue_name or current_app.conf.task_default_queue, passive=True
+            )
+        return queue.message_count
@@ -0,0 +1,24 @@
+from metroid.backends import Backend
+from metroid.dispatch import MessageTask
+from metroid.inline import run_task_sync, run_tasks
+from metroid.metrics import SubscriptionMetrics
+
+
+class InlineBackend(Backend):
+    """
+    Runs the handlers in the subscriber process, instead of handing them over to workers.
+    """
+
+    batched = False
+
+    def enqueue(self, task: MessageTask) -> None:
+        """
+        Runs the handler of one task right away, raising its error
+        """
+        run_task_sync(task)
+
+    async def aenqueue_many(self, tasks: list[MessageTask], *, metrics: SubscriptionMetrics) -> None:
+        """
+        Runs the handlers of the tasks on the event loop. Failed handlers are saved as failed messages.
+        """
+        await run_tasks(tasks, metrics=metrics)
@@ -0,0 +1,44 @@
+import logging
+
+import django_rq
+
+from metroid.backends import Backend
+from metroid.dispatch import MessageTask
+from metroid.rq import enqueue_many
+
+logger = logging.getLogger('metroid')
+
+
+class RQBackend(Backend):
+    """
+    Enqueues the tasks on the `metroid` RQ queue, a batch at a time with one Redis pipeline.
+    """
+
+    def enqueue(self, task: MessageTask) -> None:
+        """
+        Enqueues one task
+        """
+        self.enqueue_many([task])
+
+    def enqueue_many(self, tasks: list[MessageTask]) -> None:
+        """
+        Enqueues the tasks with one Redis pipeline
+        """
+        for job in enqueue_many(tasks):
+            logger.info('RQ task started. Job ID: %s', job.id)
+
+    def retry_many(self, tasks: list[MessageTask]) -> list[Exception | None]:
+        """
+        Enqueues the tasks with one Redis pipeline, replacing their failed jobs. Either all or none are enqueued.
+        """
+        try:
+            enqueue_many(tasks, replace_failed=True)
+        except Exception as error:
+            return [error] * len(tasks)
+        return [None] * len(tasks)
+
+    def queue_depth(self) -> int:
+        """
+        Returns the number of jobs on the `metroid` queue
+        """
+        return django_rq.get_queue('metroid').count
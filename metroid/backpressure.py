@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from asgiref.sync import sync_to_async
+
+from metroid.config import settings
+from metroid.dispatch import get_enqueue_executor
+from metroid.metrics import SubscriptionMetrics
+
+if TYPE_CHECKING:
+    from metroid.backends import Backend
+
+logger = logging.getLogger('metroid')
+
+
+class Backpressure:
+    """
+    Pauses receiving while the worker queue is deeper than `high_watermark`, until it has drained to `low_watermark`.
+    Messages that are not received wait in Service Bus, instead of piling up on the broker.
+
+    The depth of the queue is checked every `interval` seconds, from the backend's `queue_depth`. While the depth
+    is unknown, receiving is left as it is.
+    """
+
+    def __init__(
+        self,
+        *,
+        backend: 'Backend',
+        metrics: SubscriptionMetrics,
+        high_watermark: int,
+        low_watermark: int,
+        interval: float,
+    ) -> None:
+        self.backend = backend
+        self.metrics = metrics
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._paused_at = 0.0
+        self._watcher: asyncio.Task | None = None
+
+    @property
+    def paused(self) -> bool:
+        """
+        Whether receiving is paused
+        """
+        return not self._resumed.is_set()
+
+    async def wait(self) -> None:
+        """
+        Waits while receiving is paused. The queue is watched from the first call on.
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+        await self._resumed.wait()
+
+    async def check(self) -> None:
+        """
+        Pauses or resumes receiving, based on the current depth of the queue
+        """
+        try:
+            depth = await sync_to_async(
+                self.backend.queue_depth, thread_sensitive=False, executor=get_enqueue_executor()
+            )()
+        except Exception as error:
+            logger.warning(
+                '%s: Unable to get the depth of the worker queue. Error: %s', self.metrics.subscription_name, error
+            )
+            return
+        if depth is None:
+            return
+        if not self.paused and depth >= self.high_watermark:
+            self._resumed.clear()
+            self._paused_at = time.monotonic()
+            self.metrics.increment('backpressure_pauses')
+            logger.warning(
+                '%s: Worker queue holds %s tasks, pausing receiving until it is down to %s',
+                self.metrics.subscription_name,
+                depth,
+                self.low_watermark,
+            )
+        elif self.paused and depth <= self.low_watermark:
+            self._resumed.set()
+            self.metrics.observe('backpressure_pause', time.monotonic() - self._paused_at)
+            logger.info('%s: Worker queue holds %s tasks, resuming receiving', self.metrics.subscription_name, depth)
+
+    async def _watch(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        """
+        Stops watching the queue
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+
+def get_backpressure(*, backend: 'Backend', metrics: SubscriptionMetrics) -> Backpressure | None:
+    """
+    Creates the backpressure of a subscription, or returns None if backpressure is disabled
+    """
+    if settings.backpressure_high_watermark is None:
+        return None
+    return Backpressure(
+        backend=backend,
+        metrics=metrics,
+        high_watermark=settings.backpressure_high_watermark,
+        low_watermark=settings.backpressure_low_watermark,
+        interval=settings.backpressure_interval,
+    )
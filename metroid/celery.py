@@ -1,14 +1,31 @@
 import logging
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from billiard.einfo import ExceptionInfo
 from django_guid import get_guid
 
 from celery import Task
 
+if TYPE_CHECKING:
+    from metroid.dispatch import MessageTask
+
 logger = logging.getLogger('metroid')
 
 
+def publish_tasks(tasks: list['MessageTask']) -> None:
+    """
+    Publishes a task message for every task over one producer, instead of acquiring a producer from the pool for
+    every `apply_async`. The producer goes back to the pool once the tasks are published, so it is never held by an
+    idle subscription.
+    """
+    if not tasks:
+        return
+    with tasks[0].handler_function.app.producer_pool.acquire(block=True) as producer:  # type: ignore
+        for task in tasks:
+            task.handler_function.apply_async(kwargs=task.kwargs, producer=producer)  # type: ignore
+            logger.info('Celery task started')
+
+
 class MetroidTask(Task):
     def on_failure(
         self, exc: Exception, task_id: str, args: tuple, kwargs: dict[str, Any], einfo: ExceptionInfo
@@ -29,19 +46,29 @@ class MetroidTask(Task):
         subscription_name = kwargs.get('subscription_name')
         subject = kwargs.get('subject')
         message = kwargs.get('message')
+        # Batch handlers get a list of messages, each of which is saved as failed
+        messages = kwargs['messages'] if 'messages' in kwargs else [message]
         correlation_id = get_guid()
-        logger.critical('Metro task exception. Message: %s, exception: %s, traceback: %s', message, str(exc), einfo)
+        logger.critical(
+            'Metro task exception. Message: %s, exception: %s, traceback: %s',
+            kwargs.get('messages', message),
+            str(exc),
+            einfo,
+        )
         try:
             from metroid.models import FailedMessage
 
-            FailedMessage.objects.create(
-                topic_name=topic_name,
-                subscription_name=subscription_name,
-                subject=subject,
-                message=message,
-                exception_str=str(exc),
-                traceback=str(einfo),
-                correlation_id=correlation_id or '',
+            FailedMessage.objects.bulk_create(
+                FailedMessage(
+                    topic_name=topic_name,
+                    subscription_name=subscription_name,
+                    subject=subject,
+                    message=failed_message,
+                    exception_str=str(exc),
+                    traceback=str(einfo),
+                    correlation_id=correlation_id or '',
+                )
+                for failed_message in messages
             )
             logger.info('Saved failed message to database.')
         except Exception as error:  # pragma: no cover
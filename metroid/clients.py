@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from azure.servicebus import TransportType
+from azure.servicebus.aio import ServiceBusClient
+
+logger = logging.getLogger('metroid')
+
+
+class ClientPool:
+    """
+    One `ServiceBusClient` per connection string, shared by all subscriptions on the same namespace.
+
+    The receivers of a namespace are opened from the same client, so they share its configuration and
+    authentication setup, and Service Bus connection sharing applies to them when the SDK has it enabled.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[tuple[str, TransportType], ServiceBusClient] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(
+        self, connection_string: str, transport_type: TransportType = TransportType.AmqpOverWebsocket
+    ) -> ServiceBusClient:
+        """
+        Returns the client for a connection string, opening it on first use
+        """
+        key = (connection_string, transport_type)
+        async with self._lock:
+            if key not in self._clients:
+                client = ServiceBusClient.from_connection_string(
+                    conn_str=connection_string, transport_type=transport_type
+                )
+                await client.__aenter__()
+                self._clients[key] = client
+                logger.debug('Opened a Service Bus client for %s', client.fully_qualified_namespace)
+            return self._clients[key]
+
+    async def close(self) -> None:
+        """
+        Closes all clients, and the receivers opened from them
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
@@ -0,0 +1,47 @@
+import json
+from collections.abc import Callable
+from functools import lru_cache
+from typing import Any
+
+from django.core.exceptions import ImproperlyConfigured
+
+CODECS = ('json', 'orjson', 'msgspec')
+
+
+class Codec:
+    """
+    Encodes and decodes Metro messages.
+    `loads` accepts bytes, so message bodies are decoded without building a str first. `dumps` returns bytes,
+    except for the stdlib `json` codec, which keeps returning a str.
+    """
+
+    def __init__(self, *, name: str, loads: Callable[[bytes | str], Any], dumps: Callable[[Any], bytes | str]) -> None:
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+@lru_cache(maxsize=None)
+def get_codec(name: str = 'json') -> Codec:
+    """
+    Returns the codec with the given name, importing its package
+    """
+    if name == 'json':
+        return Codec(name=name, loads=json.loads, dumps=json.dumps)
+    elif name == 'orjson':
+        try:
+            import orjson
+        except ModuleNotFoundError:
+            raise ImproperlyConfigured(
+                'The package `orjson` is required when using `orjson` as codec. Please run `pip install orjson`.'
+            )
+        return Codec(name=name, loads=orjson.loads, dumps=orjson.dumps)
+    elif name == 'msgspec':
+        try:
+            import msgspec
+        except ModuleNotFoundError:
+            raise ImproperlyConfigured(
+                'The package `msgspec` is required when using `msgspec` as codec. Please run `pip install msgspec`.'
+            )
+        return Codec(name=name, loads=msgspec.json.decode, dumps=msgspec.json.encode)
+    raise ImproperlyConfigured(f"Codec must be one of {', '.join(repr(codec) for codec in CODECS)}")
@@ -1,14 +1,24 @@
+import inspect
 import logging
 from collections.abc import Callable
+from typing import Any
 
 from django.conf import settings as django_settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 
-from metroid.typing import MetroidSettings, Subscription, TopicPublishSettings
+from metroid.codec import get_codec
+from metroid.typing import Handler, MetroidSettings, Subscription, TopicPublishSettings
+from metroid.utils import validate_wildcard_subject
 
 logger = logging.getLogger('metroid')
 
+BACKENDS = {
+    'celery': 'metroid.backends.celery.CeleryBackend',
+    'rq': 'metroid.backends.rq.RQBackend',
+    'inline': 'metroid.backends.inline.InlineBackend',
+}
+
 
 class Settings:
     """
@@ -30,8 +40,38 @@ class Settings:
                         'subject': 'MetroDemo/Type/DadJokes.Created',
                         'regex': False,
                         'handler_function': another_func_to_call
+                    },
+                    {
+                        'subject': 'MetroDemo/*/Created',  # * matches one segment, ** any number of segments
+                        'regex': False,
+                        'wildcard': True,  # optional
+                        'handler_function': another_func_to_call
+                    },
+                    {
+                        'subject': 'MetroDemo/Type/Synced',
+                        'regex': False,
+                        'batch': True,  # optional, the handler gets a list of `messages` instead of one `message`
+                        'batch_size': 100,  # optional, the maximum number of messages in a batch
+                        'batch_max_delay': 1,  # optional, seconds to wait for a batch to fill up
+                        'handler_function': bulk_func_to_call
                     }
                 ],
+                'batch_receive': False,  # optional, receive up to `max_batch_size` messages at once
+                'max_batch_size': 100,  # optional
+                'max_wait_time': 5,  # optional, seconds to wait for a batch to fill up
+                'max_concurrency': 1,  # optional, messages (or batches) processed at the same time
+                'dispatch_batch_size': 100,  # optional, max tasks enqueued to the broker at once
+                'dispatch_max_delay': 0,  # optional, seconds to wait for more tasks before enqueueing
+                'receivers': 1,  # optional, competing receivers for the subscription
+                'prefetch_count': 0,  # optional, messages each receiver prefetches
+                'transport_type': 'websocket',  # optional, 'websocket' or 'amqp' for AMQP over TCP
+                'max_lock_renewal_duration': 300,  # optional, seconds to renew message locks. 0 (default) disables it
+                'sessions': False,  # default. True for session enabled subscriptions, processing each session in order
+                'max_concurrent_sessions': 8,  # optional, sessions received from at the same time
+                'session_idle_timeout': 5,  # optional, seconds without messages before a session is released
+                'ordering_key': 'data.id',  # optional, messages with the same value here are enqueued in order.
+                                            # Not with batch handlers, like sessions
+                'ordering_lanes': 16,  # optional, lanes the messages are hashed to by their ordering key
             },
         ],
         'publish_settings': [
@@ -44,7 +84,22 @@ class Settings:
                 'x_metro_key': 'my-other-metro-key',
             },
         ],
-        'worker_type': 'celery' # default
+        'worker_type': 'celery',  # default. 'rq', or 'inline' to run handlers in the metroid process
+        'backend': 'path.to.MyBackend',  # optional, a `metroid.backends.Backend` used instead of the worker type
+        'enqueue_threads': 10,  # optional, threads for broker calls. Defaults to the ThreadPoolExecutor default
+        'metrics_interval': 60,  # optional, seconds between logging subscription metrics. 0 disables it
+        'codec': 'json',  # default. 'orjson' or 'msgspec' for faster encoding and decoding of messages
+        'dedup_ttl': 600,  # optional, seconds a message ID is remembered to skip redeliveries. 0 (default) disables it
+        'dedup_max_size': 10000,  # optional, message IDs remembered in memory per subscription
+        'dedup_redis_url': 'redis://localhost:6379/0',  # optional, shares remembered message IDs through Redis
+        'backpressure_high_watermark': 10000,  # optional, queued tasks at which receiving pauses. None disables it
+        'backpressure_low_watermark': 5000,  # optional, queued tasks at which receiving resumes. Defaults to half
+        'backpressure_interval': 5,  # optional, seconds between checking the depth of the worker queue
+        'shutdown_timeout': 25,  # default, seconds to settle messages being processed on SIGTERM
+        'max_restarts': 5,  # optional, restarts of a failed subscription within `restart_window` before exiting
+        'restart_window': 300,  # optional, seconds
+        'restart_backoff': 1,  # optional, seconds before the first restart, doubling for every further restart
+        'restart_backoff_max': 60,  # optional, seconds
     }
     """
 
@@ -75,6 +130,111 @@ class Settings:
         """
         return self.settings.get('worker_type', 'celery')
 
+    @property
+    def backend(self) -> str:
+        """
+        Returns the dotted path of the worker backend. Defaults to the backend of the worker type.
+        """
+        return self.settings.get('backend', BACKENDS.get(self.worker_type, ''))
+
+    @property
+    def enqueue_threads(self) -> int | None:
+        """
+        Returns the number of threads used for broker calls
+        """
+        return self.settings.get('enqueue_threads')
+
+    @property
+    def metrics_interval(self) -> float:
+        """
+        Returns the number of seconds between logging subscription metrics
+        """
+        return self.settings.get('metrics_interval', 60)
+
+    @property
+    def codec(self) -> str:
+        """
+        Returns the name of the codec used to encode and decode messages
+        """
+        return self.settings.get('codec', 'json')
+
+    @property
+    def dedup_ttl(self) -> float:
+        """
+        Returns the number of seconds the ID of an enqueued message is remembered. 0 disables deduplication.
+        """
+        return self.settings.get('dedup_ttl', 0)
+
+    @property
+    def dedup_max_size(self) -> int:
+        """
+        Returns how many message IDs each subscription remembers in memory
+        """
+        return self.settings.get('dedup_max_size', 10000)
+
+    @property
+    def dedup_redis_url(self) -> str | None:
+        """
+        Returns the URL of the Redis server remembered message IDs are shared through, if any
+        """
+        return self.settings.get('dedup_redis_url')
+
+    @property
+    def backpressure_high_watermark(self) -> int | None:
+        """
+        Returns the number of queued tasks at which receiving is paused. None disables backpressure.
+        """
+        return self.settings.get('backpressure_high_watermark')
+
+    @property
+    def backpressure_low_watermark(self) -> int:
+        """
+        Returns the number of queued tasks at which receiving is resumed. Defaults to half the high watermark.
+        """
+        return self.settings.get('backpressure_low_watermark', (self.backpressure_high_watermark or 0) // 2)
+
+    @property
+    def backpressure_interval(self) -> float:
+        """
+        Returns the number of seconds between checking the depth of the worker queue
+        """
+        return self.settings.get('backpressure_interval', 5)
+
+    @property
+    def shutdown_timeout(self) -> float:
+        """
+        Returns the number of seconds messages being processed are given to be settled, when the process is stopped
+        """
+        return self.settings.get('shutdown_timeout', 25)
+
+    @property
+    def max_restarts(self) -> int:
+        """
+        Returns how many times a failed subscription is restarted within `restart_window`, before the process exits
+        """
+        return self.settings.get('max_restarts', 5)
+
+    @property
+    def restart_window(self) -> float:
+        """
+        Returns the number of seconds in which subscription restarts are counted
+        """
+        return self.settings.get('restart_window', 300)
+
+    @property
+    def restart_backoff(self) -> float:
+        """
+        Returns the number of seconds to wait before restarting a failed subscription the first time
+        """
+        return self.settings.get('restart_backoff', 1)
+
+    @property
+    def restart_backoff_max(self) -> float:
+        """
+        Returns the maximum number of seconds to wait before restarting a failed subscription
+        """
+        return self.settings.get('restart_backoff_max', 60)
+
     def get_x_metro_key(self, *, topic_name: str) -> str:
         """
         Fetches the x-metro-key based on topic
@@ -85,6 +245,25 @@ class Settings:
         logger.critical('Unable to find a x-metro-key for %s', topic_name)
         raise ImproperlyConfigured(f'No x-metro-key found for {topic_name}')
 
+    @staticmethod
+    def get_subscription_options(subscription: Subscription) -> dict[str, Any]:
+        """
+        Returns the optional settings of a subscription, which are passed on to `subscribe_to_topic`
+        """
+        return {key: value for key, value in subscription.items() if key in Subscription.__optional_keys__}
+
+    def get_handlers(self, *, topic_name: str, subscription_name: str) -> list[Handler]:
+        """
+        Returns the handlers of a subscription, or an empty list if the subscription isn't configured
+        """
+        for subscription in self.subscriptions:
+            if (
+                subscription.get('topic_name') == topic_name
+                and subscription.get('subscription_name') == subscription_name
+            ):
+                return subscription['handlers']
+        return []
+
     def get_handler_function(self, *, topic_name: str, subscription_name: str, subject: str) -> Callable | None:
         """
         Intended to be used by retry-log.
@@ -129,11 +308,30 @@ class Settings:
                             f'for {topic_name} cannot be imported. Verify that the dotted path points to a function'
                         )
 
+    def _validate_backend(self) -> None:
+        """
+        Validates that a custom backend is a dotted path to a `Backend` subclass
+        """
+        from metroid.backends import Backend
+
+        if not isinstance(self.backend, str):
+            raise ImproperlyConfigured(f'Backend {self.backend} must be a dotted path string')
+        try:
+            backend = import_string(self.backend)
+        except ImportError:
+            raise ImproperlyConfigured(f'Backend {self.backend} cannot be imported')
+        if not isinstance(backend, type) or not issubclass(backend, Backend):
+            raise ImproperlyConfigured(f'Backend {self.backend} must be a subclass of metroid.backends.Backend')
+        if inspect.isabstract(backend):
+            raise ImproperlyConfigured(f'Backend {self.backend} must implement enqueue')
+
     def validate(self) -> None:
         """
         Validates all settings
         """
-        if self.worker_type == 'celery':
+        if 'backend' in self.settings:
+            self._validate_backend()
+        elif self.worker_type == 'celery':
             try:
                 import celery  # noqa: F401
             except ModuleNotFoundError:
@@ -149,8 +347,43 @@ class Settings:
                     'The package `django-rq` is required when using `rq` as worker type. '
                     'Please run `pip install django-rq` if you with to use rq as the workers.'
                 )
-        else:
-            raise ImproperlyConfigured("Worker type must be 'celery' or 'rq'")
+        elif self.worker_type != 'inline':
+            raise ImproperlyConfigured("Worker type must be 'celery', 'rq' or 'inline'")
+        get_codec(self.codec)
+        if self.enqueue_threads is not None and (not isinstance(self.enqueue_threads, int) or self.enqueue_threads < 1):
+            raise ImproperlyConfigured('enqueue_threads must be a positive integer')
+        if not isinstance(self.metrics_interval, int | float) or self.metrics_interval < 0:
+            raise ImproperlyConfigured('metrics_interval must be a number of seconds')
+        if not isinstance(self.dedup_ttl, int | float) or self.dedup_ttl < 0:
+            raise ImproperlyConfigured('dedup_ttl must be a number of seconds')
+        if not isinstance(self.dedup_max_size, int) or self.dedup_max_size < 1:
+            raise ImproperlyConfigured('dedup_max_size must be a positive integer')
+        if self.dedup_redis_url is not None:
+            if not isinstance(self.dedup_redis_url, str):
+                raise ImproperlyConfigured('dedup_redis_url must be a string')
+            try:
+                import redis  # noqa: F401
+            except ModuleNotFoundError:
+                raise ImproperlyConfigured(
+                    'The package `redis` is required when using `dedup_redis_url`. Please run `pip install redis`.'
+                )
+        high_watermark = self.backpressure_high_watermark
+        if high_watermark is not None:
+            if not isinstance(high_watermark, int) or high_watermark < 1:
+                raise ImproperlyConfigured('backpressure_high_watermark must be a positive integer')
+            low_watermark = self.backpressure_low_watermark
+            if not isinstance(low_watermark, int) or not 0 <= low_watermark < high_watermark:
+                raise ImproperlyConfigured(
+                    'backpressure_low_watermark must be a non-negative integer below backpressure_high_watermark'
+                )
+            if not isinstance(self.backpressure_interval, int | float) or self.backpressure_interval <= 0:
+                raise ImproperlyConfigured('backpressure_interval must be a positive number of seconds')
+        if not isinstance(self.max_restarts, int) or self.max_restarts < 0:
+            raise ImproperlyConfigured('max_restarts must be a non-negative integer')
+        for name in ('restart_window', 'restart_backoff', 'restart_backoff_max', 'shutdown_timeout'):
+            value = getattr(self, name)
+            if not isinstance(value, int | float) or value < 0:
+                raise ImproperlyConfigured(f'{name} must be a number of seconds')
         if not isinstance(self.subscriptions, list):
             raise ImproperlyConfigured('Subscriptions must be a list')
         if not isinstance(self.publish_settings, list):
@@ -172,12 +405,75 @@ class Settings:
                 )
             if not isinstance(handlers, list):
                 raise ImproperlyConfigured(f'Handler function {handlers} must be a list')
+            if not isinstance(subscription.get('batch_receive', False), bool):
+                raise ImproperlyConfigured(f'batch_receive for {topic_name} must be a boolean')
+            max_batch_size = subscription.get('max_batch_size', 100)
+            if not isinstance(max_batch_size, int) or max_batch_size < 1:
+                raise ImproperlyConfigured(f'max_batch_size for {topic_name} must be a positive integer')
+            max_wait_time = subscription.get('max_wait_time', 5)
+            if not isinstance(max_wait_time, int | float) or max_wait_time <= 0:
+                raise ImproperlyConfigured(f'max_wait_time for {topic_name} must be a positive number')
+            max_concurrency = subscription.get('max_concurrency', 1)
+            if not isinstance(max_concurrency, int) or max_concurrency < 1:
+                raise ImproperlyConfigured(f'max_concurrency for {topic_name} must be a positive integer')
+            dispatch_batch_size = subscription.get('dispatch_batch_size', 100)
+            if not isinstance(dispatch_batch_size, int) or dispatch_batch_size < 1:
+                raise ImproperlyConfigured(f'dispatch_batch_size for {topic_name} must be a positive integer')
+            dispatch_max_delay = subscription.get('dispatch_max_delay', 0)
+            if not isinstance(dispatch_max_delay, int | float) or dispatch_max_delay < 0:
+                raise ImproperlyConfigured(f'dispatch_max_delay for {topic_name} must be a number of seconds')
+            receivers = subscription.get('receivers', 1)
+            if not isinstance(receivers, int) or receivers < 1:
+                raise ImproperlyConfigured(f'receivers for {topic_name} must be a positive integer')
+            prefetch_count = subscription.get('prefetch_count', 0)
+            if not isinstance(prefetch_count, int) or prefetch_count < 0:
+                raise ImproperlyConfigured(f'prefetch_count for {topic_name} must be a non-negative integer')
+            if not isinstance(subscription.get('sessions', False), bool):
+                raise ImproperlyConfigured(f'sessions for {topic_name} must be a boolean')
+            max_concurrent_sessions = subscription.get('max_concurrent_sessions', 8)
+            if not isinstance(max_concurrent_sessions, int) or max_concurrent_sessions < 1:
+                raise ImproperlyConfigured(f'max_concurrent_sessions for {topic_name} must be a positive integer')
+            session_idle_timeout = subscription.get('session_idle_timeout', 5)
+            if not isinstance(session_idle_timeout, int | float) or session_idle_timeout <= 0:
+                raise ImproperlyConfigured(f'session_idle_timeout for {topic_name} must be a positive number')
+            max_lock_renewal_duration = subscription.get('max_lock_renewal_duration', 0)
+            if not isinstance(max_lock_renewal_duration, int | float) or max_lock_renewal_duration < 0:
+                raise ImproperlyConfigured(f'max_lock_renewal_duration for {topic_name} must be a number of seconds')
+            ordering_key = subscription.get('ordering_key')
+            if ordering_key is not None and (not isinstance(ordering_key, str) or not all(ordering_key.split('.'))):
+                raise ImproperlyConfigured(f"ordering_key for {topic_name} must be a dotted path, such as 'data.id'")
+            ordering_lanes = subscription.get('ordering_lanes', 16)
+            if not isinstance(ordering_lanes, int) or ordering_lanes < 1:
+                raise ImproperlyConfigured(f'ordering_lanes for {topic_name} must be a positive integer')
+            if subscription.get('transport_type', 'websocket') not in ('amqp', 'websocket'):
+                raise ImproperlyConfigured(f"transport_type for {topic_name} must be 'amqp' or 'websocket'")
             for handler in handlers:
                 if not isinstance(handler, dict):
                     raise ImproperlyConfigured(f'{handlers} must contain dict values, got: {handler}')
                 subject = handler['subject']
                 if not isinstance(subject, str):
                     raise ImproperlyConfigured(f'Handler subject {subject} for {topic_name} must be a string')
+                if not isinstance(handler.get('wildcard', False), bool):
+                    raise ImproperlyConfigured(f'wildcard for handler subject {subject} must be a boolean')
+                if handler.get('wildcard', False) and handler.get('regex', False):
+                    raise ImproperlyConfigured(f'Handler subject {subject} can not be both a regex and a wildcard')
+                if handler.get('wildcard', False):
+                    validate_wildcard_subject(subject)
+                if not isinstance(handler.get('batch', False), bool):
+                    raise ImproperlyConfigured(f'batch for handler subject {subject} must be a boolean')
+                if handler.get('batch', False) and (subscription.get('sessions', False) or ordering_key is not None):
+                    # Ordered messages are enqueued one at a time, so each batch would wait out batch_max_delay
+                    raise ImproperlyConfigured(
+                        f'Handler subject {subject} can not be a batch handler, as {topic_name} enqueues in order'
+                    )
+                batch_size = handler.get('batch_size', 100)
+                if not isinstance(batch_size, int) or batch_size < 1:
+                    raise ImproperlyConfigured(f'batch_size for handler subject {subject} must be a positive integer')
+                batch_max_delay = handler.get('batch_max_delay', 1)
+                if not isinstance(batch_max_delay, int | float) or batch_max_delay < 0:
+                    raise ImproperlyConfigured(
+                        f'batch_max_delay for handler subject {subject} must be a number of seconds'
+                    )
 
         for topic in self.publish_settings:
             if not isinstance(topic['topic_name'], str):
@@ -0,0 +1,174 @@
+import enum
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured
+
+from metroid.config import settings
+
+logger = logging.getLogger('metroid')
+
+
+class Claim(enum.Enum):
+    """
+    What a claim found for a message
+    """
+
+    CLAIMED = 'claimed'  # The message is not being enqueued, and is now claimed for this enqueue
+    IN_FLIGHT = 'in_flight'  # The message is being enqueued by another receiver
+    DONE = 'done'  # The tasks of the message were enqueued
+
+
+class DedupCache:
+    """
+    Remembers the messages whose tasks were enqueued for `ttl` seconds, so a redelivered message is not enqueued again.
+
+    A message is claimed before its tasks are enqueued, and only marked as done once they are. Claims that are still
+    in flight expire after `in_flight_ttl` seconds, so a claim left by a crashed process doesn't hold up its message
+    for longer than that. Keys are kept in memory, and the least recently used keys are forgotten once there are more
+    than `max_size`.
+    """
+
+    def __init__(self, *, ttl: float, max_size: int = 10000, in_flight_ttl: float = 60) -> None:
+        self.ttl = ttl
+        self.in_flight_ttl = min(in_flight_ttl, ttl)
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, Claim]] = OrderedDict()
+
+    def _seen(self, key: str) -> Claim | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, state = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return state
+
+    def _remember(self, key: str, state: Claim) -> None:
+        ttl = self.ttl if state is Claim.DONE else self.in_flight_ttl
+        self._entries[key] = (time.monotonic() + ttl, state)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def claim(self, key: str) -> Claim:
+        """
+        Claims a key before the tasks of its message are enqueued. Returns `Claim.CLAIMED` if the key was free, or
+        what the existing claim found.
+        """
+        state = self._seen(key)
+        if state is not None:
+            return Claim.DONE if state is Claim.DONE else Claim.IN_FLIGHT
+        self._remember(key, Claim.IN_FLIGHT)
+        return Claim.CLAIMED
+
+    async def complete(self, key: str) -> None:
+        """
+        Marks a claimed key as done, once the tasks of its message are enqueued
+        """
+        self._remember(key, Claim.DONE)
+
+    async def release(self, key: str) -> None:
+        """
+        Releases a claimed key, when the tasks of its message could not be enqueued
+        """
+        self._entries.pop(key, None)
+
+    async def close(self) -> None:
+        """
+        Releases the resources held by the cache
+        """
+
+
+class RedisDedupCache(DedupCache):
+    """
+    Shares claimed keys through Redis with `SET NX EX`, so they survive restarts and apply to every process.
+    Keys claimed by this process are still found in memory without a round trip. If Redis can't be reached, the
+    cache falls back to memory instead of holding up messages.
+    """
+
+    def __init__(
+        self,
+        *,
+        url: str,
+        ttl: float,
+        max_size: int = 10000,
+        in_flight_ttl: float = 60,
+        prefix: str = 'metroid:dedup:',
+    ) -> None:
+        super().__init__(ttl=ttl, max_size=max_size, in_flight_ttl=in_flight_ttl)
+        try:
+            from redis.asyncio import Redis
+        except ModuleNotFoundError:
+            raise ImproperlyConfigured(
+                'The package `redis` is required when using `dedup_redis_url`. Please run `pip install redis`.'
+            )
+        self.redis = Redis.from_url(url)
+        self.prefix = prefix
+
+    async def claim(self, key: str) -> Claim:
+        """
+        Claims a key in Redis, unless this process already claimed it. Returns `Claim.CLAIMED` if the key was free, or
+        what the existing claim found.
+        """
+        state = self._seen(key)
+        if state is not None:
+            return Claim.DONE if state is Claim.DONE else Claim.IN_FLIGHT
+        try:
+            name = self.prefix + key
+            if await self.redis.set(name, Claim.IN_FLIGHT.value, nx=True, ex=max(1, math.ceil(self.in_flight_ttl))):
+                state = Claim.CLAIMED
+            else:
+                state = Claim.DONE if await self.redis.get(name) == Claim.DONE.value.encode() else Claim.IN_FLIGHT
+        except Exception as error:
+            logger.warning('Unable to claim %s in Redis, deduplicating in memory only. Error: %s', key, error)
+            state = Claim.CLAIMED
+        if state is not Claim.IN_FLIGHT:
+            self._remember(key, Claim.IN_FLIGHT if state is Claim.CLAIMED else Claim.DONE)
+        return state
+
+    async def complete(self, key: str) -> None:
+        """
+        Marks a claimed key as done, in Redis too
+        """
+        await super().complete(key)
+        try:
+            await self.redis.set(self.prefix + key, Claim.DONE.value, ex=max(1, math.ceil(self.ttl)))
+        except Exception as error:
+            logger.warning('Unable to mark %s as done in Redis. Error: %s', key, error)
+
+    async def release(self, key: str) -> None:
+        """
+        Releases a claimed key, in Redis too
+        """
+        await super().release(key)
+        try:
+            await self.redis.delete(self.prefix + key)
+        except Exception as error:
+            logger.warning('Unable to release %s in Redis. Error: %s', key, error)
+
+    async def close(self) -> None:
+        """
+        Closes the connections to Redis
+        """
+        await self.redis.connection_pool.disconnect()
+
+
+def get_dedup_cache(*, in_flight_ttl: float = 60) -> DedupCache | None:
+    """
+    Creates the configured deduplication cache, or returns None if deduplication is disabled
+    """
+    if not settings.dedup_ttl:
+        return None
+    if settings.dedup_redis_url:
+        return RedisDedupCache(
+            url=settings.dedup_redis_url,
+            ttl=settings.dedup_ttl,
+            max_size=settings.dedup_max_size,
+            in_flight_ttl=in_flight_ttl,
+        )
+    return DedupCache(ttl=settings.dedup_ttl, max_size=settings.dedup_max_size, in_flight_ttl=in_flight_ttl)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from asgiref.sync import sync_to_async
+
+from metroid.config import settings
+from metroid.metrics import SubscriptionMetrics
+
+if TYPE_CHECKING:
+    from metroid.backends import Backend
+    from metroid.routing import Route
+
+logger = logging.getLogger('metroid')
+
+T = TypeVar('T')
+
+
+class MessageTask:
+    """
+    A handler function to be enqueued for a received message.
+    The message is normally a dict, but failed messages retried from the admin can hold any JSON value.
+    For a batch handler, the message is the list of messages in the batch.
+    """
+
+    __slots__ = ('handler_function', 'message', 'topic_name', 'subscription_name', 'subject', 'job_id', 'batch')
+
+    def __init__(
+        self,
+        *,
+        handler_function: Callable,
+        message: dict,
+        topic_name: str,
+        subscription_name: str,
+        subject: str,
+        job_id: str | None = None,
+        batch: bool = False,
+    ) -> None:
+        self.handler_function = handler_function
+        self.message = message
+        self.topic_name = topic_name
+        self.subscription_name = subscription_name
+        self.subject = subject
+        self.batch = batch
+        # Deterministic job ID, so a redelivered message does not create a second job
+        self.job_id = job_id or (message.get('id') if isinstance(message, dict) else None)
+
+    @property
+    def messages(self) -> list:
+        """
+        The messages of the task, one unless it is a batch
+        """
+        return self.message if self.batch else [self.message]  # type: ignore[return-value]
+
+    @property
+    def kwargs(self) -> dict[str, Any]:
+        """
+        Keyword arguments the handler function is called with. Batch handlers get `messages` instead of `message`.
+        """
+        return {
+            'messages' if self.batch else 'message': self.message,
+            'topic_name': self.topic_name,
+            'subscription_name': self.subscription_name,
+            'subject': self.subject,
+        }
+
+
+def build_tasks(routes: list['Route'], *, message: dict, topic_name: str, subscription_name: str) -> list[MessageTask]:
+    """
+    Builds a task for every route matching a message.
+    The first task gets the message ID as job ID. When more handlers match, the others get the message ID suffixed
+    with a checksum of their handler subject, so the jobs don't overwrite each other. A checksum rather than the
+    subject itself, as RQ only accepts letters, digits, `_` and `-` in job IDs.
+    Batch handlers get a batch of just this message, as when a failed message is retried.
+    """
+    message_id = message.get('id')
+    return [
+        MessageTask(
+            handler_function=route.handler_function,
+            message=[message] if route.batch else message,  # type: ignore[arg-type]
+            topic_name=topic_name,
+            subscription_name=subscription_name,
+            subject=route.subject,
+            job_id=f'{message_id}-{zlib.crc32(route.subject.encode()):08x}' if position and message_id else message_id,
+            batch=route.batch,
+        )
+        for position, route in enumerate(routes)
+    ]
+
+
+_enqueue_executor: ThreadPoolExecutor | None = None
+
+
+def get_enqueue_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool used for broker calls, shared by all subscriptions in the process.
+    Unlike the default `sync_to_async`, which runs everything on one shared thread, enqueues from different
+    subscriptions don't wait behind each other.
+    """
+    global _enqueue_executor
+    if _enqueue_executor is None:
+        _enqueue_executor = ThreadPoolExecutor(
+            max_workers=settings.enqueue_threads, thread_name_prefix='metroid-enqueue'
+        )
+    return _enqueue_executor
+
+
+async def run_in_enqueue_executor(function: Callable[..., T], *args, metrics: SubscriptionMetrics, **kwargs) -> T:
+    """
+    Runs a blocking broker call in the enqueue thread pool.
+    Records how long the call waited for a free thread, and how long the call itself took.
+    """
+    submitted = time.monotonic()
+    started = None
+
+    def call() -> T:
+        nonlocal started
+        started = time.monotonic()
+        return function(*args, **kwargs)
+
+    try:
+        return await sync_to_async(call, thread_sensitive=False, executor=get_enqueue_executor())()
+    finally:
+        if started is not None:
+            metrics.observe('enqueue_queue_wait', started - submitted)
+            metrics.observe('enqueue_time', time.monotonic() - started)
+
+
+class Dispatcher:
+    """
+    Enqueues the tasks of one subscription, grouping tasks from messages that are processed at the same time.
+
+    The first tasks are flushed to the broker right away. Tasks dispatched while a flush is running are buffered,
+    and flushed together as soon as it is done, in batches of up to `batch_size` tasks. With `max_delay`, the
+    buffer instead waits up to that many seconds to fill up to `batch_size` before it is flushed.
+    `dispatch` returns once the flush holding its tasks is done, so messages are only settled after their tasks are
+    on the broker. With Celery, each flush is published over one producer.
+    """
+
+    def __init__(
+        self,
+        *,
+        metrics: SubscriptionMetrics,
+        batch_size: int = 100,
+        max_delay: float = 0,
+        backend: 'Backend | None' = None,
+    ) -> None:
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._buffer: list[tuple[list[MessageTask], asyncio.Future]] = []
+        self._buffered_at = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+        if backend is None:
+            from metroid.backends import get_backend
+
+            backend = get_backend()
+        self.backend = backend
+
+    async def dispatch(self, tasks: list[MessageTask]) -> None:
+        """
+        Enqueues the tasks, returning once they are on the broker.
+        Tasks are handed to backends that don't batch, such as the inline backend, right away.
+        """
+        if not self.backend.batched:
+            await self.backend.aenqueue_many(tasks, metrics=self.metrics)
+            return
+        if not self._buffer:
+            self._buffered_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((tasks, future))
+        self._schedule_flush()
+        await future
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None or not self._buffer:
+            return
+        waited = time.monotonic() - self._buffered_at
+        if sum(len(tasks) for tasks, _ in self._buffer) >= self.batch_size or waited >= self.max_delay:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay - waited, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # Messages that stopped waiting, for example on shutdown, are not settled, so their tasks are skipped
+        self._buffer = [(tasks, future) for tasks, future in self._buffer if not future.done()]
+        batch: list[tuple[list[MessageTask], asyncio.Future]] = []
+        batch_tasks: list[MessageTask] = []
+        while self._buffer and (not batch or len(batch_tasks) + len(self._buffer[0][0]) <= self.batch_size):
+            tasks, future = self._buffer.pop(0)
+            batch.append((tasks, future))
+            batch_tasks.extend(tasks)
+        self._buffered_at = time.monotonic()
+        try:
+            if batch_tasks:
+                await self.backend.aenqueue_many(batch_tasks, metrics=self.metrics)
+                self.metrics.increment('dispatch_flushes')
+                self.metrics.increment('tasks_enqueued', len(batch_tasks))
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+        finally:
+            self._flush_task = None
+            self._schedule_flush()
+
+    async def close(self) -> None:
+        """
+        Waits for a running flush, then closes the backend
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._flush_task is not None:
+            await asyncio.wait([self._flush_task])
+        self.backend.close()
+
+
+class MessageBatch:
+    """
+    Groups the messages matching a batch handler into one task, of up to `batch_size` messages of the route, waiting
+    at most `batch_max_delay` seconds for a batch to fill up. The task is enqueued through the dispatcher.
+    The future returned by `add` is done once the task holding the message is on the broker, so messages are only
+    settled after that.
+    """
+
+    def __init__(self, *, route: 'Route', dispatcher: Dispatcher, topic_name: str, subscription_name: str) -> None:
+        self.route = route
+        self.dispatcher = dispatcher
+        self.topic_name = topic_name
+        self.subscription_name = subscription_name
+        self._buffer: list[tuple[dict, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    @property
+    def waiting(self) -> list[dict]:
+        """
+        The messages waiting for the batch to fill up
+        """
+        return [message for message, future in self._buffer if not future.done()]
+
+    def add(self, message: dict) -> asyncio.Future:
+        """
+        Adds a message to the batch. Returns a future that is done once the batch is on the broker.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append((message, future))
+        if len(self._buffer) >= self.route.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.route.batch_max_delay, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """
+        Enqueues the messages waiting for the batch to fill up, without waiting for more
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Messages that stopped waiting, for example on shutdown, are not settled, so they are left out
+        batch = [(message, future) for message, future in self._buffer if not future.done()]
+        self._buffer = []
+        if batch:
+            flush = asyncio.create_task(self._enqueue(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _enqueue(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        task = MessageTask(
+            handler_function=self.route.handler_function,
+            message=[message for message, _ in batch],  # type: ignore[arg-type]
+            topic_name=self.topic_name,
+            subscription_name=self.subscription_name,
+            subject=self.route.subject,
+            batch=True,
+        )
+        try:
+            await self.dispatcher.dispatch([task])
+            self.dispatcher.metrics.increment('batches_enqueued')
+            self.dispatcher.metrics.increment('batched_messages', len(batch))
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def close(self) -> None:
+        """
+        Enqueues the messages still waiting for their batch to fill up, and waits for the batches being enqueued
+        """
+        self.flush()
+        if self._flushes:
+            await asyncio.wait(self._flushes)
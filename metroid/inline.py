@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import traceback
+from typing import TYPE_CHECKING
+
+from django.db import close_old_connections
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django_guid import get_guid, set_guid
+from django_guid.utils import generate_guid
+
+if TYPE_CHECKING:
+    from metroid.dispatch import MessageTask
+    from metroid.metrics import SubscriptionMetrics
+
+logger = logging.getLogger('metroid')
+
+
+def save_failed_message(task: 'MessageTask', error: Exception) -> None:
+    """
+    Saves a message whose handler failed, so it can be retried from the admin.
+    Every message of a failed batch is saved on its own.
+    """
+    formatted_traceback = ''.join(traceback.format_exception(error))
+    logger.critical(
+        'Metro task exception. Message: %s, exception: %s, traceback: %s', task.message, str(error), formatted_traceback
+    )
+    try:
+        from metroid.models import FailedMessage
+
+        FailedMessage.objects.bulk_create(
+            FailedMessage(
+                topic_name=task.topic_name,
+                subscription_name=task.subscription_name,
+                subject=task.subject,
+                message=message,
+                exception_str=str(error),
+                traceback=formatted_traceback,
+                correlation_id=get_guid() or '',
+            )
+            for message in task.messages
+        )
+        logger.info('Saved failed message to database.')
+    except Exception as save_error:  # pragma: no cover
+        logger.exception('Unable to save Metro message. Error: %s', save_error)
+
+
+def _run_sync_handler(task: 'MessageTask') -> None:
+    # Handlers run outside of a request, so stale database connections have to be closed like a worker does
+    close_old_connections()
+    try:
+        task.handler_function(**task.kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_task(task: 'MessageTask') -> None:
+    """
+    Runs the handler of a task in the subscriber process, with a new correlation ID.
+    Async handlers are awaited on the event loop, and sync handlers run in the enqueue thread pool.
+    A failed handler is saved as a `FailedMessage`, the same way as with Celery and RQ workers.
+    """
+    from metroid.dispatch import get_enqueue_executor
+
+    set_guid(generate_guid())
+    logger.info('Running %s inline', getattr(task.handler_function, '__name__', task.handler_function))
+    try:
+        if asyncio.iscoroutinefunction(task.handler_function):
+            await task.handler_function(**task.kwargs)
+        else:
+            await sync_to_async(_run_sync_handler, thread_sensitive=False, executor=get_enqueue_executor())(task)
+    except Exception as error:
+        await sync_to_async(save_failed_message, thread_sensitive=False, executor=get_enqueue_executor())(task, error)
+        raise
+
+
+async def run_tasks(tasks: list['MessageTask'], *, metrics: 'SubscriptionMetrics') -> None:
+    """
+    Runs the handlers of the tasks at the same time. Failed handlers are saved, and do not fail the message.
+    """
+    results = await asyncio.gather(*(run_task(task) for task in tasks), return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    metrics.increment('tasks_run', len(tasks) - failed)
+    if failed:
+        metrics.increment('tasks_failed', failed)
+
+
+def run_task_sync(task: 'MessageTask') -> None:
+    """
+    Runs the handler of a task right away, raising its error. Used when retrying failed messages from the admin.
+    """
+    if asyncio.iscoroutinefunction(task.handler_function):
+        async_to_sync(task.handler_function)(**task.kwargs)
+    else:
+        task.handler_function(**task.kwargs)
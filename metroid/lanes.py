@@ -0,0 +1,80 @@
+import asyncio
+import zlib
+from types import TracebackType
+
+
+class Lane:
+    """
+    Lets the messages of a lane enqueue one at a time, in the order they entered it.
+
+    Once a message fails to enqueue, the lane is broken until the messages waiting behind it have left, so they can
+    be abandoned instead of overtaking it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self.broken = False
+
+    async def __aenter__(self) -> 'Lane':
+        """
+        Waits for the messages that entered the lane before this one
+        """
+        self._waiting += 1
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            self._leave()
+            raise
+        return self
+
+    async def __aexit__(
+        self, exc_type: type[BaseException] | None, exc: BaseException | None, traceback: TracebackType | None
+    ) -> None:
+        """
+        Lets the next message in, breaking the lane if this one failed
+        """
+        if exc_type is not None:
+            self.broken = True
+        self._lock.release()
+        self._leave()
+
+    def _leave(self) -> None:
+        self._waiting -= 1
+        if not self._waiting:
+            self.broken = False
+
+
+class KeyedLanes:
+    """
+    Spreads messages over `lanes` lanes by their ordering key, the value at `ordering_key` in the loaded message.
+    `ordering_key` is a dotted path, such as 'data.id'.
+
+    Messages with the same ordering key always share a lane, so they are enqueued in the order they were received,
+    while the lanes enqueue in parallel. Messages without an ordering key don't wait in any lane.
+    """
+
+    def __init__(self, *, ordering_key: str, lanes: int) -> None:
+        self.path = ordering_key.split('.')
+        self.lanes = [Lane() for _ in range(lanes)]
+
+    def get_key(self, message: dict) -> str | None:
+        """
+        Returns the ordering key of a loaded message, or None if it has none
+        """
+        value: object = message
+        for part in self.path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return None if value is None else str(value)
+
+    def get(self, message: dict) -> Lane | None:
+        """
+        Returns the lane of a loaded message, or None if it has no ordering key
+        """
+        key = self.get_key(message)
+        if key is None:
+            return None
+        # crc32 rather than hash(), so a key is in the same lane in every process
+        return self.lanes[zlib.crc32(key.encode()) % len(self.lanes)]
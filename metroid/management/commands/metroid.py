@@ -1,16 +1,25 @@
 import asyncio
 import logging
+import signal
 import sys
 import time
 from asyncio.tasks import Task
+from collections.abc import Callable
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError, CommandParser
 
+from metroid.clients import ClientPool
 from metroid.config import settings
+from metroid.metrics import get_metrics, log_metrics
 from metroid.subscribe import subscribe_to_topic
+from metroid.typing import Subscription
+from metroid.utils import backoff_delay
 
 logger = logging.getLogger('metroid')
 
+# Seconds given to subscriptions to close their receivers and clients, on top of `shutdown_timeout`
+SHUTDOWN_GRACE = 5
+
 
 class Command(BaseCommand):
     help = (
@@ -19,48 +28,217 @@ class Command(BaseCommand):
         'The message will be marked as deferred, and the Celery task must then complete the message.'
     )
 
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the command line options of the command
+        """
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Number of worker processes to spread the subscriptions across. '
+            'With more processes than subscriptions, subscriptions get competing receivers in several processes.',
+        )
+
+    @staticmethod
+    async def report_metrics(interval: float, report: Callable[[], None] = log_metrics) -> None:
+        """
+        Reports the metrics of every subscription every `interval` seconds
+        """
+        while True:
+            await asyncio.sleep(interval)
+            report()
+
     @staticmethod
-    async def start_tasks() -> None:
+    async def start_tasks(
+        subscriptions: list[Subscription] | None = None, report: Callable[[], None] = log_metrics
+    ) -> None:
         """
-        Creates background tasks to subscribe to events
+        Creates background tasks to subscribe to events.
+        Runs all configured subscriptions, unless `subscriptions` is given.
         """
-        if not settings.subscriptions:  # pragma: no cover
+        if subscriptions is None:
+            subscriptions = settings.subscriptions
+        if not subscriptions:  # pragma: no cover
             logger.info('No subscriptions found. Sleeping forever to avoid crash loops.')
             while True:
                 time.sleep(60 * 10)  # Keeps CPU usage to a minimum
 
-        tasks: list[Task] = [
-            asyncio.create_task(
-                subscribe_to_topic(
-                    connection_string=subscription['connection_string'],
-                    topic_name=subscription['topic_name'],
-                    subscription_name=subscription['subscription_name'],
-                    handlers=subscription['handlers'],
-                )
-            )
-            for subscription in settings.subscriptions
-        ]
-        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)  # Also covers FIRST_EXCEPTION
-
-        # Log why the task ended
-        for task in done:
-            try:
-                raise task.exception()  # type: ignore # We do this to use `logger.exception` which enables trace nicely
-            except TypeError:
-                logger.critical('Task %s ended early without an exception', task)
-            except Exception as error:
-                logger.exception('Exception in subscription task %s. Exception: %s', task, error)
-
-        for task in pending:
+        stopping = asyncio.Event()
+        Command.handle_signals(stopping)
+        # Subscriptions on the same namespace share one client
+        client_pool = ClientPool()
+        tasks: dict[Task, int] = {
+            Command.start_subscription(subscription, client_pool, stopping=stopping): index
+            for index, subscription in enumerate(subscriptions)
+        }
+        failures: dict[int, list[float]] = {}  # Times each subscription failed, to detect crash loops
+        if settings.metrics_interval:
+            pending_metrics = asyncio.create_task(Command.report_metrics(settings.metrics_interval, report))
+        stopped = asyncio.create_task(stopping.wait())
+        while True:
+            # Also covers FIRST_EXCEPTION
+            done, _ = await asyncio.wait([*tasks, stopped], return_when=asyncio.FIRST_COMPLETED)
+            if stopping.is_set():
+                break
+
+            # Log why the task ended
+            for task in done:
+                try:
+                    raise task.exception()  # type: ignore # We do this to use `logger.exception` which enables trace
+                except TypeError:
+                    logger.critical('Task %s ended early without an exception', task)
+                except Exception as error:
+                    logger.exception('Exception in subscription task %s. Exception: %s', task, error)
+
+            # Restart the subscriptions that ended, unless one of them is crash looping
+            crash_looping = False
+            for task in done:
+                index = tasks.pop(task)
+                subscription = subscriptions[index]
+                delay = Command.restart_delay(failures.setdefault(index, []))
+                if delay is None:
+                    logger.critical(
+                        'Subscription %s failed more than %s times in %s seconds, giving up',
+                        subscription['subscription_name'],
+                        settings.max_restarts,
+                        settings.restart_window,
+                    )
+                    crash_looping = True
+                    continue
+                get_metrics(
+                    topic_name=subscription['topic_name'], subscription_name=subscription['subscription_name']
+                ).increment('restarts')
+                logger.warning('Restarting subscription %s in %.1f seconds', subscription['subscription_name'], delay)
+                tasks[Command.start_subscription(subscription, client_pool, delay=delay, stopping=stopping)] = index
+            if crash_looping:
+                break
+
+        if stopping.is_set():
+            # The subscriptions stop receiving, and settle the messages they are processing
+            done, pending = await asyncio.wait(tasks, timeout=settings.shutdown_timeout + SHUTDOWN_GRACE)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.error(
+                        'Exception in subscription task %s while stopping. Exception: %s',
+                        task,
+                        task.exception(),
+                        exc_info=task.exception(),
+                    )
+            tasks = {task: tasks[task] for task in pending}
+        stopped.cancel()
+        for task in tasks:
             # Cancel all remaining running tasks. This kills the service (and container)
             logger.info('Cancelling pending task %s', task)
             task.cancel()
+        if settings.metrics_interval:
+            pending_metrics.cancel()
+        await client_pool.close()
+        report()
+        if stopping.is_set():
+            logger.info('All subscriptions stopped')
+            return
         logger.info('All tasks cancelled')
         sys.exit('Exiting process')
 
+    @staticmethod
+    def handle_signals(stopping: asyncio.Event) -> None:
+        """
+        Sets `stopping` on SIGTERM or SIGINT, so the subscriptions stop gracefully. A second signal is handled as usual,
+        stopping the process right away. An ignored SIGINT, as in worker processes, stays ignored.
+        """
+        loop = asyncio.get_running_loop()
+        signal_numbers = [
+            signal_number
+            for signal_number in (signal.SIGTERM, signal.SIGINT)
+            if signal.getsignal(signal_number) is not signal.SIG_IGN
+        ]
+
+        def stop(signal_number: int) -> None:
+            logger.info(
+                'Received signal %s, stopping subscriptions within %s seconds',
+                signal_number,
+                settings.shutdown_timeout,
+            )
+            for handled in signal_numbers:
+                loop.remove_signal_handler(handled)
+            stopping.set()
+
+        try:
+            for signal_number in signal_numbers:
+                loop.add_signal_handler(signal_number, stop, signal_number)
+        except RuntimeError:  # pragma: no cover
+            # Signal handlers can only be added on Unix, in the main thread
+            logger.debug('Unable to handle signals, subscriptions will not stop gracefully')
+
+    @staticmethod
+    def restart_delay(failures: list[float]) -> float | None:
+        """
+        Records a failure of a subscription, and returns the seconds to wait before restarting it.
+        Returns None when the subscription has failed more than `max_restarts` times within `restart_window` seconds.
+        """
+        now = time.monotonic()
+        failures[:] = [failed for failed in failures if now - failed < settings.restart_window]
+        failures.append(now)
+        restarts = len(failures) - 1
+        if restarts >= settings.max_restarts:
+            return None
+        return backoff_delay(restarts, base=settings.restart_backoff, maximum=settings.restart_backoff_max, jitter=True)
+
+    @staticmethod
+    def start_subscription(
+        subscription: Subscription,
+        client_pool: ClientPool,
+        delay: float = 0,
+        stopping: asyncio.Event | None = None,
+    ) -> Task:
+        """
+        Starts a task running the subscription, after `delay` seconds. The subscription stops once `stopping` is set.
+        """
+        stopping = stopping or asyncio.Event()
+
+        async def run() -> None:
+            if delay:
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout=delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            await subscribe_to_topic(
+                connection_string=subscription['connection_string'],
+                topic_name=subscription['topic_name'],
+                subscription_name=subscription['subscription_name'],
+                handlers=subscription['handlers'],
+                client_pool=client_pool,
+                stopping=stopping,
+                shutdown_timeout=settings.shutdown_timeout,
+                **settings.get_subscription_options(subscription),
+            )
+
+        return asyncio.create_task(run())
+
+    @staticmethod
+    def run(subscriptions: list[Subscription] | None = None, report: Callable[[], None] = log_metrics) -> None:
+        """
+        Runs the subscriptions in this process
+        """
+        asyncio.run(Command.start_tasks(subscriptions, report))
+
     def handle(self, *args: None, **options) -> None:
         """
         This function is called when `manage.py metroid` is run from the terminal.
         """
+        if options['processes'] < 1:
+            raise CommandError('--processes must be a positive integer')
         logger.info('Starting Metro subscriptions')
-        asyncio.run(self.start_tasks())
+        if options['processes'] > 1:
+            from metroid.supervisor import ProcessSupervisor
+
+            ProcessSupervisor(
+                subscriptions=settings.subscriptions,
+                processes=options['processes'],
+                metrics_interval=settings.metrics_interval,
+                shutdown_timeout=settings.shutdown_timeout + SHUTDOWN_GRACE,
+            ).run()
+        else:
+            self.run()
@@ -0,0 +1,53 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from azure.servicebus.management import ServiceBusAdministrationClient
+
+from metroid.config import settings
+from metroid.rules import get_rule_filters, sync_rules
+
+logger = logging.getLogger('metroid')
+
+
+class Command(BaseCommand):
+    help = (
+        'Turns the handler subjects of each subscription configured in your settings into Service Bus rules, '
+        'so messages no handler matches are never delivered. The connection strings need the Manage claim.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the command line options of the command
+        """
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the rules that would be created and deleted, without changing them.',
+        )
+
+    def handle(self, *args: None, **options) -> None:
+        """
+        This function is called when `manage.py metroid_rules` is run from the terminal.
+        """
+        dry_run = options['dry_run']
+        for subscription in settings.subscriptions:
+            topic_name, subscription_name = subscription['topic_name'], subscription['subscription_name']
+            filters = get_rule_filters(subscription['handlers'])
+            try:
+                with ServiceBusAdministrationClient.from_connection_string(subscription['connection_string']) as client:
+                    changes = sync_rules(
+                        client,
+                        topic_name=topic_name,
+                        subscription_name=subscription_name,
+                        filters=filters,
+                        dry_run=dry_run,
+                    )
+            except Exception as error:
+                raise CommandError(f'Unable to sync the rules of {topic_name}/{subscription_name}: {error}')
+            if not changes:
+                self.stdout.write(f'{topic_name}/{subscription_name}: Rules are up to date')
+            for change in changes:
+                action = f'Would {change.action}' if dry_run else f'{change.action.capitalize()}d'
+                description = f': {change.description}' if change.description else ''
+                self.stdout.write(f'{topic_name}/{subscription_name}: {action} rule {change.rule_name}{description}')
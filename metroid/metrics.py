@@ -0,0 +1,121 @@
+import logging
+from typing import Any
+
+logger = logging.getLogger('metroid')
+
+
+class Timing:
+    """
+    Count, total and max of an observed duration, in seconds.
+    """
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Adds one observation
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict[str, float]:
+        """
+        Returns the timing as a dict, with the average instead of the total
+        """
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+
+class SubscriptionMetrics:
+    """
+    Counters and timings for one subscription.
+    Only updated from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, *, topic_name: str, subscription_name: str) -> None:
+        self.topic_name = topic_name
+        self.subscription_name = subscription_name
+        self.counters: dict[str, int] = {}
+        self.timings: dict[str, Timing] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """
+        Increments a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Records a duration
+        """
+        if name not in self.timings:
+            self.timings[name] = Timing()
+        self.timings[name].observe(seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Returns all counters and timings
+        """
+        return {**self.counters, **{name: timing.as_dict() for name, timing in self.timings.items()}}
+
+
+_registry: dict[tuple[str, str], SubscriptionMetrics] = {}
+
+
+def get_metrics(*, topic_name: str, subscription_name: str) -> SubscriptionMetrics:
+    """
+    Returns the metrics of a subscription, creating them on first use
+    """
+    key = (topic_name, subscription_name)
+    if key not in _registry:
+        _registry[key] = SubscriptionMetrics(topic_name=topic_name, subscription_name=subscription_name)
+    return _registry[key]
+
+
+def snapshot() -> dict[str, dict[str, Any]]:
+    """
+    Returns the metrics of all subscriptions, keyed on `topic_name/subscription_name`
+    """
+    return {
+        f'{topic_name}/{subscription_name}': metrics.snapshot()
+        for (topic_name, subscription_name), metrics in _registry.items()
+    }
+
+
+def merge_snapshots(snapshots: list[dict[str, dict[str, Any]]]) -> dict[str, dict[str, Any]]:
+    """
+    Combines snapshots of several processes. Counters are added up, and timings are combined into one.
+    """
+    merged: dict[str, dict[str, Any]] = {}
+    for process_snapshot in snapshots:
+        for name, metrics in process_snapshot.items():
+            combined = merged.setdefault(name, {})
+            for key, value in metrics.items():
+                if not isinstance(value, dict):
+                    combined[key] = combined.get(key, 0) + value
+                    continue
+                timing = combined.get(key, {'count': 0, 'avg': 0.0, 'max': 0.0})
+                count = timing['count'] + value['count']
+                combined[key] = {
+                    'count': count,
+                    'avg': (timing['avg'] * timing['count'] + value['avg'] * value['count']) / count if count else 0.0,
+                    'max': max(timing['max'], value['max']),
+                }
+    return merged
+
+
+def log_metrics() -> None:
+    """
+    Logs the metrics of every subscription
+    """
+    for name, metrics in snapshot().items():
+        logger.info('Metrics for %s: %s', name, metrics)
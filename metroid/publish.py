@@ -1,10 +1,10 @@
-import json
 import logging
 
 from django.utils import timezone
 
 import requests
 
+from metroid.codec import get_codec
 from metroid.config import settings
 
 logger = logging.getLogger('metroid')
@@ -58,7 +58,7 @@ def publish_event(
                 'content-type': 'application/json',
                 'x-metro-key': settings.get_x_metro_key(topic_name=topic_name),
             },
-            data=json.dumps(formatted_data),
+            data=get_codec(settings.codec).dumps(formatted_data),
         )
         metro_response.raise_for_status()
         logger.info('Posted to metro')
@@ -1,10 +1,10 @@
-import json
 import logging
 
 from django.utils import timezone
 
 import requests
 
+from metroid.codec import get_codec
 from metroid.config import settings
 from metroid.models import FailedPublishMessage
 
@@ -37,7 +37,7 @@ def retry_failed_published_events() -> None:
                     'content-type': 'application/json',
                     'x-metro-key': settings.get_x_metro_key(topic_name=message.topic_name),
                 },
-                data=json.dumps(formatted_data),
+                data=get_codec(settings.codec).dumps(formatted_data),
             )
             logger.info('Posted to metro')
             metro_response.raise_for_status()
@@ -0,0 +1,191 @@
+import logging
+import re
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+from django.utils.module_loading import import_string
+
+from metroid.typing import Handler
+from metroid.utils import compile_subject_pattern, validate_wildcard_subject
+
+logger = logging.getLogger('metroid')
+
+# Numbered or named back references change meaning once patterns are joined into one alternation
+_BACK_REFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+T = TypeVar('T')
+
+
+class _TrieNode(Generic[T]):
+    __slots__ = ('children', 'any_segment', 'any_segments', 'repeats', 'values')
+
+    def __init__(self, *, repeats: bool = False) -> None:
+        self.children: dict[str, _TrieNode[T]] = {}
+        self.any_segment: _TrieNode[T] | None = None  # *
+        self.any_segments: _TrieNode[T] | None = None  # **
+        self.repeats = repeats  # The node of a **, which keeps matching segments
+        self.values: list[T] = []
+
+
+class SubjectTrie(Generic[T]):
+    """
+    Matches subjects against wildcard subjects, such as `MetroDemo/*/Created` or `MetroDemo/**`.
+
+    Subjects are split into segments on `/`. `*` matches any one segment, and `**` any number of segments, none
+    included. The wildcard subjects are stored in a trie of their segments, so matching a subject costs the same
+    however many wildcard subjects there are.
+    """
+
+    def __init__(self) -> None:
+        self.root: _TrieNode[T] = _TrieNode()
+
+    def add(self, subject: str, value: T) -> None:
+        """
+        Adds a wildcard subject, with the value returned when it matches
+        """
+        validate_wildcard_subject(subject)
+        node = self.root
+        for segment in subject.split('/'):
+            if segment == '*':
+                node.any_segment = node.any_segment or _TrieNode()
+                node = node.any_segment
+            elif segment == '**':
+                node.any_segments = node.any_segments or _TrieNode(repeats=True)
+                node = node.any_segments
+            else:
+                node = node.children.setdefault(segment, _TrieNode())
+        node.values.append(value)
+
+    def match(self, subject: str) -> list[T]:
+        """
+        Returns the values of every wildcard subject matching the subject
+        """
+        nodes = self._skip_empty([self.root])
+        for segment in subject.split('/'):
+            found = []
+            for node in nodes:
+                child = node.children.get(segment)
+                if child is not None:
+                    found.append(child)
+                if node.any_segment is not None:
+                    found.append(node.any_segment)
+                if node.repeats:
+                    found.append(node)
+            if not found:
+                return []
+            nodes = self._skip_empty(found)
+        return [value for node in nodes for value in node.values]
+
+    @staticmethod
+    def _skip_empty(nodes: list[_TrieNode[T]]) -> list[_TrieNode[T]]:
+        # Adds the ** nodes that match no segments at all, without adding a node twice
+        reached: dict[int, _TrieNode[T]] = {}
+        for node in nodes:
+            current: _TrieNode[T] | None = node
+            while current is not None and id(current) not in reached:
+                reached[id(current)] = current
+                current = current.any_segments
+        return list(reached.values())
+
+
+class Route:
+    """
+    A handler from the settings, with its subject compiled and its handler function imported.
+    Batch handlers get the messages matching them in batches of up to `batch_size`, waiting at most `batch_max_delay`
+    seconds for a batch to fill up.
+    """
+
+    __slots__ = ('index', 'subject', 'handler_function', 'batch', 'batch_size', 'batch_max_delay')
+
+    def __init__(
+        self,
+        *,
+        index: int,
+        subject: str,
+        handler_function: Callable,
+        batch: bool = False,
+        batch_size: int = 100,
+        batch_max_delay: float = 1,
+    ) -> None:
+        self.index = index
+        self.subject = subject
+        self.handler_function = handler_function
+        self.batch = batch
+        self.batch_size = batch_size
+        self.batch_max_delay = batch_max_delay
+
+    def __repr__(self) -> str:
+        """
+        Representation used in logs
+        """
+        return f'Route({self.subject!r})'  # pragma: no cover
+
+
+class Router:
+    """
+    Routing table for the handlers of one subscription.
+
+    Built once when a subscription starts, so matching a message does not compile regexes or import handler
+    functions. Exact subjects are looked up in a dict, wildcard subjects in a trie, and regex subjects are first
+    checked against one combined alternation, so messages no regex handler wants are rejected with a single match call.
+    """
+
+    def __init__(self, handlers: list[Handler]) -> None:
+        self.exact: dict[str, list[Route]] = {}
+        self.patterns: list[tuple[re.Pattern, Route]] = []
+        self.wildcards: SubjectTrie[Route] | None = None
+        self.routes: list[Route] = []
+        handler_functions: dict[str, Callable] = {}
+        for index, handler in enumerate(handlers):
+            dotted_path = handler['handler_function']
+            if dotted_path not in handler_functions:
+                handler_functions[dotted_path] = import_string(dotted_path)
+            route = Route(
+                index=index,
+                subject=handler['subject'],
+                handler_function=handler_functions[dotted_path],
+                batch=handler.get('batch', False),
+                batch_size=handler.get('batch_size', 100),
+                batch_max_delay=handler.get('batch_max_delay', 1),
+            )
+            self.routes.append(route)
+            if handler.get('regex', False):
+                self.patterns.append((compile_subject_pattern(route.subject), route))
+            elif handler.get('wildcard', False):
+                self.wildcards = self.wildcards or SubjectTrie()
+                self.wildcards.add(route.subject, route)
+            else:
+                self.exact.setdefault(route.subject, []).append(route)
+        self.combined_pattern = self._combine_patterns([pattern for pattern, _ in self.patterns])
+
+    @staticmethod
+    def _combine_patterns(patterns: list[re.Pattern]) -> re.Pattern | None:
+        """
+        Joins all regex subjects into one alternation. Returns None when there is nothing to gain, or when the
+        patterns can't safely be combined (back references, misplaced global flags).
+        """
+        if len(patterns) < 2 or any(_BACK_REFERENCE.search(pattern.pattern) for pattern in patterns):
+            return None
+        try:
+            return re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in patterns))
+        except re.error:
+            logger.debug('Unable to combine regex subjects, matching them one by one')
+            return None
+
+    def match(self, message_subject: str) -> list[Route]:
+        """
+        Returns every route matching the subject, in the order the handlers are configured.
+        """
+        routes = self.exact.get(message_subject, [])
+        if self.wildcards is not None:
+            wildcard_routes = sorted(self.wildcards.match(message_subject), key=lambda route: route.index)
+            routes = self._merge(routes, wildcard_routes)
+        if not self.patterns or (self.combined_pattern and not self.combined_pattern.match(message_subject)):
+            return list(routes)
+        return self._merge(routes, [route for pattern, route in self.patterns if pattern.match(message_subject)])
+
+    @staticmethod
+    def _merge(routes: list[Route], matched: list[Route]) -> list[Route]:
+        if routes and matched:
+            return sorted(routes + matched, key=lambda route: route.index)
+        return routes + matched
@@ -1,12 +1,40 @@
 import logging
+from typing import TYPE_CHECKING
 
+import django_rq
 from django_guid import get_guid
 
+from rq import Queue
 from rq.job import Job
 
+if TYPE_CHECKING:
+    from metroid.dispatch import MessageTask
+
 logger = logging.getLogger('metroid')
 
 
+def enqueue_many(tasks: list['MessageTask'], *, replace_failed: bool = False) -> list[Job]:
+    """
+    Enqueues all tasks on the `metroid` queue with one Redis pipeline, instead of one round trip per task.
+    Job IDs are kept deterministic, so a redelivered message does not create a second job.
+
+    :param tasks: The tasks to enqueue
+    :param replace_failed: Remove jobs with the same IDs from the failed job registry, used when retrying
+    """
+    queue = django_rq.get_queue('metroid')
+    with queue.connection.pipeline() as pipeline:
+        if replace_failed:
+            for task in tasks:
+                if task.job_id:
+                    queue.failed_job_registry.remove(task.job_id, pipeline=pipeline)
+        jobs = queue.enqueue_many(
+            [Queue.prepare_data(task.handler_function, kwargs=task.kwargs, job_id=task.job_id) for task in tasks],
+            pipeline=pipeline,
+        )
+        pipeline.execute()
+    return jobs
+
+
 def on_failure(job: Job, *exc_info) -> bool:
     """
     Custom exception handler for Metro RQ tasks.
@@ -20,24 +48,29 @@ def on_failure(job: Job, *exc_info) -> bool:
         subscription_name = job.kwargs.get('subscription_name')
         subject = job.kwargs.get('subject')
         message = job.kwargs.get('message')
+        # Batch handlers get a list of messages, each of which is saved as failed
+        messages = job.kwargs['messages'] if 'messages' in job.kwargs else [message]
         correlation_id = get_guid()
         logger.critical(
             'Metro task exception. Message: %s, exception: %s, traceback: %s',
-            message,
+            job.kwargs.get('messages', message),
             str(exc_info[1]),
             exc_info,
         )
         try:
             from metroid.models import FailedMessage
 
-            FailedMessage.objects.create(
-                topic_name=topic_name,
-                subscription_name=subscription_name,
-                subject=subject,
-                message=message,
-                exception_str=str(exc_info[1]),
-                traceback=str(exc_info),
-                correlation_id=correlation_id or '',
+            FailedMessage.objects.bulk_create(
+                FailedMessage(
+                    topic_name=topic_name,
+                    subscription_name=subscription_name,
+                    subject=subject,
+                    message=failed_message,
+                    exception_str=str(exc_info[1]),
+                    traceback=str(exc_info),
+                    correlation_id=correlation_id or '',
+                )
+                for failed_message in messages
             )
             logger.info('Saved failed message to database.')
         except Exception as error:  # pragma: no cover
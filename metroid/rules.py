@@ -0,0 +1,170 @@
+import logging
+import zlib
+from typing import NamedTuple
+
+from azure.servicebus.management import (
+    CorrelationRuleFilter,
+    ServiceBusAdministrationClient,
+    SqlRuleFilter,
+    TrueRuleFilter,
+)
+
+from metroid.typing import Handler
+
+logger = logging.getLogger('metroid')
+
+DEFAULT_RULE = '$Default'
+RULE_PREFIX = 'metroid-'
+
+_REGEX_SPECIAL = frozenset('.^$*+?{}[]()|\\')
+
+
+class RuleChange(NamedTuple):
+    action: str  # 'create' or 'delete'
+    rule_name: str
+    description: str
+
+
+def get_subject_prefix(pattern: str) -> tuple[str, bool] | None:
+    """
+    Returns the literal subject of a regex subject, and whether the subject must match it exactly rather than start
+    with it. Returns None for patterns that are more than a literal, such as `^Test/.*$` or `^Test/.*/Created$`.
+    """
+    exact = False
+    if pattern.endswith('.*$'):
+        pattern = pattern[:-3]
+    elif pattern.endswith('.*'):
+        pattern = pattern[:-2]
+    elif pattern.endswith('$') and not pattern.endswith('\\$'):
+        pattern, exact = pattern[:-1], True
+    pattern = pattern.removeprefix('^')
+    literal = []
+    escaped = False
+    for character in pattern:
+        if escaped:
+            if character.isalnum():
+                return None  # \d, \w and the like
+            literal.append(character)
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif character in _REGEX_SPECIAL:
+            return None
+        else:
+            literal.append(character)
+    if escaped:
+        return None
+    return ''.join(literal), exact
+
+
+def _rule_name(kind: str, value: str) -> str:
+    # Rule names are at most 50 characters, so they are named by a checksum of what they let through
+    return f'{RULE_PREFIX}{kind}-{zlib.crc32(value.encode()):08x}'
+
+
+def _escape_like(text: str) -> str:
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_').replace('[', '![').replace("'", "''")
+
+
+def _like_filter(pattern: str) -> SqlRuleFilter:
+    return SqlRuleFilter(f"sys.Label LIKE '{pattern}' ESCAPE '!'")
+
+
+def get_wildcard_pattern(subject: str) -> str | None:
+    """
+    Returns a SQL LIKE pattern for a wildcard subject. As `%` also matches `/`, the pattern can let through more
+    subjects than the wildcard subject matches, which are then completed without a handler.
+    Returns None if the pattern would let through every subject.
+    """
+    pattern = ''
+    previous = None
+    for index, segment in enumerate(subject.split('/')):
+        if segment == '**':
+            pattern += '%'  # Takes the place of the `/` around it too, as it can match no segments
+        else:
+            if index and previous != '**':
+                pattern += '/'
+            pattern += '%' if segment == '*' else _escape_like(segment)
+        previous = segment
+    return pattern if pattern.strip('%') else None
+
+
+def get_rule_filters(handlers: list[Handler]) -> dict[str, CorrelationRuleFilter | SqlRuleFilter]:
+    """
+    Returns the rules that let through the messages the handlers match, by rule name. The rules filter on the
+    Service Bus subject of a message, which must be set to the same subject as the one in the message.
+
+    Exact subjects become correlation filters. Wildcard subjects, and regex subjects that only match a literal prefix,
+    become SQL filters. If any subject can't be expressed as a filter, every message is let through with the default
+    rule instead.
+    """
+    filters: dict[str, CorrelationRuleFilter | SqlRuleFilter] = {}
+    for handler in handlers:
+        subject = handler['subject']
+        if handler.get('wildcard', False) and '*' in subject:
+            pattern = get_wildcard_pattern(subject)
+            if pattern is None:
+                logger.info('Wildcard subject %s matches every subject, letting every message through', subject)
+                return {DEFAULT_RULE: TrueRuleFilter()}
+            filters[_rule_name('wildcard', pattern)] = _like_filter(pattern)
+            continue
+        if handler.get('regex', False):
+            prefix = get_subject_prefix(subject)
+            if prefix is None or not prefix[0]:
+                logger.info('Regex subject %s can not be expressed as a rule, letting every message through', subject)
+                return {DEFAULT_RULE: TrueRuleFilter()}
+            subject, exact = prefix
+            if not exact:
+                filters[_rule_name('prefix', subject)] = _like_filter(f'{_escape_like(subject)}%')
+                continue
+        if not subject:
+            logger.info('Messages without a subject can not be matched by a rule, letting every message through')
+            return {DEFAULT_RULE: TrueRuleFilter()}
+        filters[_rule_name('subject', subject)] = CorrelationRuleFilter(label=subject)
+    return filters
+
+
+def describe_filter(rule_filter: CorrelationRuleFilter | SqlRuleFilter) -> str:
+    """
+    Describes what a rule lets through, for logs and command output
+    """
+    if isinstance(rule_filter, CorrelationRuleFilter):
+        return f'subject = {rule_filter.label!r}'
+    return rule_filter.sql_expression or ''
+
+
+def sync_rules(
+    client: ServiceBusAdministrationClient,
+    *,
+    topic_name: str,
+    subscription_name: str,
+    filters: dict[str, CorrelationRuleFilter | SqlRuleFilter],
+    dry_run: bool = False,
+) -> list[RuleChange]:
+    """
+    Brings the rules of a subscription in line with `filters`, and returns the changes.
+
+    Missing rules are created before the default rule and the metroid rules that are no longer wanted are deleted,
+    so the subscription never goes without rules, dropping messages. Rules created by others are left alone.
+    With `dry_run`, the changes are returned without being made.
+    """
+    existing = {rule.name for rule in client.list_rules(topic_name, subscription_name)}
+    changes = [
+        RuleChange('create', rule_name, describe_filter(rule_filter))
+        for rule_name, rule_filter in filters.items()
+        if rule_name not in existing
+    ]
+    changes += [
+        RuleChange('delete', rule_name, '')
+        for rule_name in sorted(existing - filters.keys())
+        if rule_name == DEFAULT_RULE or rule_name.startswith(RULE_PREFIX)
+    ]
+    if dry_run:
+        return changes
+    for change in changes:
+        if change.action == 'create':
+            client.create_rule(topic_name, subscription_name, change.rule_name, filter=filters[change.rule_name])
+        else:
+            client.delete_rule(topic_name, subscription_name, change.rule_name)
+        logger.info('%sd rule %s on %s/%s', change.action.capitalize(), change.rule_name, topic_name, subscription_name)
+    return changes
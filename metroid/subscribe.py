@@ -1,104 +1,590 @@
+import asyncio
 import json
 import logging
+import re
+from collections.abc import Awaitable
+from contextlib import AsyncExitStack
+from typing import Any
 
-from django.utils.module_loading import import_string
-
-from asgiref.sync import sync_to_async
-from azure.servicebus import ServiceBusReceivedMessage, TransportType
-from azure.servicebus.aio import ServiceBusClient, ServiceBusReceiver
+from azure.servicebus import NEXT_AVAILABLE_SESSION, ServiceBusReceivedMessage, TransportType
+from azure.servicebus.aio import AutoLockRenewer, ServiceBusClient, ServiceBusReceiver, ServiceBusSession
+from azure.servicebus.amqp import AmqpMessageBodyType
+from azure.servicebus.exceptions import OperationTimeoutError
 
+from metroid.backpressure import get_backpressure
+from metroid.clients import ClientPool
+from metroid.codec import get_codec
 from metroid.config import settings
+from metroid.dedup import Claim, get_dedup_cache
+from metroid.dispatch import Dispatcher, MessageBatch, build_tasks
+from metroid.lanes import KeyedLanes
+from metroid.metrics import get_metrics
+from metroid.routing import Route, Router
 from metroid.typing import Handler
-from metroid.utils import match_handler_subject
+from metroid.utils import BoundedTaskGroup, run_all
 
 logger = logging.getLogger('metroid')
 
+TRANSPORT_TYPES = {'amqp': TransportType.Amqp, 'websocket': TransportType.AmqpOverWebsocket}
+
+
+def get_message_body(message: ServiceBusReceivedMessage) -> bytes | str:
+    """
+    Returns the body of a message as bytes, without copying it when it is a single data section.
+    Messages without a data body are returned as a str.
+    """
+    if message.body_type != AmqpMessageBodyType.DATA:
+        return str(message)
+    body = message.body
+    if isinstance(body, bytes):
+        return body
+    sections = list(body)
+    return sections[0] if len(sections) == 1 else b''.join(sections)
+
+
+_SUBJECT_PATTERN = re.compile(rb'"subject"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def peek_subjects(body: bytes | str) -> list[str] | None:
+    """
+    Finds the subject of a message by scanning its body, without decoding it.
+    Every string value of a `subject` key is returned, as nested objects can have one too. Returns None if the body
+    has no such value, isn't bytes or has a subject that isn't valid JSON, in which case the message has to be
+    decoded to learn its subject.
+    """
+    if not isinstance(body, bytes):
+        return None
+    subjects = []
+    for match in _SUBJECT_PATTERN.finditer(body):
+        value = match.group(1)
+        try:
+            subjects.append(json.loads(b'"' + value + b'"') if b'\\' in value else value.decode())
+        except ValueError:  # UnicodeDecodeError is a ValueError too
+            return None
+    return subjects or None
+
+
+def decode_message(message: ServiceBusReceivedMessage, body: bytes | str | None = None) -> dict:
+    """
+    Decodes the body of a message with the configured codec. Returns an empty dict if the body can't be decoded.
+    """
+    try:
+        return get_codec(settings.codec).loads(get_message_body(message) if body is None else body)
+    except Exception as error:
+        # We defer messages with a faulty body, we do not crash.
+        logger.exception(
+            'Unable to decode message %s. Sequence number %s. Error: %s',
+            message,
+            message.sequence_number,
+            error,
+        )
+        return {}
+
+
+class MessageProcessor:
+    """
+    Routes, enqueues and settles the messages of one subscription.
+
+    With `max_lock_renewal_duration`, the `lock_renewer` keeps the locks of received messages for up to that many
+    seconds, so a slow enqueue does not lose the lock before the message is completed.
+    With `ordered`, messages received together are processed one at a time, in the order they were received.
+    With an `ordering_key`, messages are enqueued in `ordering_lanes` lanes instead, by the value at that dotted path
+    in the loaded message, so messages with the same value are enqueued in the order they were received.
+    """
+
+    def __init__(
+        self,
+        *,
+        topic_name: str,
+        subscription_name: str,
+        handlers: list[Handler],
+        dispatch_batch_size: int = 100,
+        dispatch_max_delay: float = 0,
+        max_lock_renewal_duration: float = 0,
+        ordered: bool = False,
+        ordering_key: str | None = None,
+        ordering_lanes: int = 16,
+    ) -> None:
+        self.topic_name = topic_name
+        self.ordered = ordered
+        self.lanes = KeyedLanes(ordering_key=ordering_key, lanes=ordering_lanes) if ordering_key else None
+        self.subscription_name = subscription_name
+        self.router = Router(handlers)
+        self._matches_missing_subject = bool(self.router.match(''))
+        self.metrics = get_metrics(topic_name=topic_name, subscription_name=subscription_name)
+        self.dispatcher = Dispatcher(metrics=self.metrics, batch_size=dispatch_batch_size, max_delay=dispatch_max_delay)
+        self.batches = {
+            route.index: MessageBatch(
+                route=route, dispatcher=self.dispatcher, topic_name=topic_name, subscription_name=subscription_name
+            )
+            for route in self.router.routes
+            if route.batch
+        }
+        self._in_flight = 0  # Messages being processed
+        # A claim is in flight while its message is enqueued, which can take as long as its lock is renewed
+        self.dedup = get_dedup_cache(in_flight_ttl=max(60, max_lock_renewal_duration))
+        self.backpressure = get_backpressure(backend=self.dispatcher.backend, metrics=self.metrics)
+        self.lock_renewer: AutoLockRenewer | None = None
+        if max_lock_renewal_duration:
+            self.lock_renewer = AutoLockRenewer(
+                max_lock_renewal_duration=max_lock_renewal_duration, on_lock_renew_failure=self._lock_lost
+            )
+
+    async def process(self, receiver: ServiceBusReceiver, messages: list[ServiceBusReceivedMessage]) -> None:
+        """
+        Decodes and routes the messages, enqueues a task for every matching handler and settles each message once.
+
+        The tasks of all matching handlers are enqueued together, and the message is completed only when all of them
+        are on the broker. If enqueueing fails, the message is abandoned instead, so Service Bus redelivers it, and
+        the error is raised once the other messages are settled.
+        Batch handlers get the message in a batch with other messages, and the message waits for the batch to be on the
+        broker too. Once every message being processed waits for a batch, the batches are enqueued without waiting
+        for them to fill up, as no other message can join them.
+        When ordered, a message that is abandoned has the messages after it abandoned too, so none of them overtake it.
+        """
+        self.metrics.increment('messages_received', len(messages))
+        self._in_flight += len(messages)
+        if self.ordered:
+            for index, message in enumerate(messages):
+                try:
+                    await self._process_in_flight(receiver, message)
+                except BaseException as error:
+                    later = messages[index + 1 :]
+                    self._in_flight -= len(later)
+                    if isinstance(error, Exception):
+                        self.metrics.increment('messages_abandoned', len(later))
+                        await asyncio.gather(
+                            *(receiver.abandon_message(message=message) for message in later), return_exceptions=True
+                        )
+                    raise
+            return
+        results = await asyncio.gather(
+            *(self._process_in_flight(receiver, message) for message in messages), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _process_in_flight(self, receiver: ServiceBusReceiver, message: ServiceBusReceivedMessage) -> None:
+        # Processes a message counted as in flight, which it stops being once it is processed
+        try:
+            await self._process_message(receiver, message)
+        finally:
+            self._in_flight -= 1
+            self._flush_idle_batches()
+
+    def _flush_idle_batches(self) -> None:
+        # Once every message in flight waits for a batch to fill up, no other message can join the batches before
+        # more messages are received, so they are enqueued right away instead of waiting out `batch_max_delay`
+        waiting = {id(message) for batch in self.batches.values() for message in batch.waiting}
+        if waiting and len(waiting) >= self._in_flight:
+            for batch in self.batches.values():
+                batch.flush()
+
+    async def _process_message(self, receiver: ServiceBusReceiver, message: ServiceBusReceivedMessage) -> None:
+        body = get_message_body(message)
+        subjects = peek_subjects(body)
+        if subjects is not None and not self._matches_any(subjects):
+            # Not wanted by any handler, so the body is never decoded
+            self.metrics.increment('messages_unmatched')
+            self.metrics.increment('messages_not_decoded')
+            logger.info(
+                '%s: Received message, sequence number %s. Subject: %s',
+                self.subscription_name,
+                message.sequence_number,
+                ', '.join(subjects),
+            )
+            logger.info('No handler found, completing message')
+            await receiver.complete_message(message=message)
+            return
+
+        loaded_message = decode_message(message, body)
+        logger.info(
+            '%s: Received message, sequence number %s. Content: %s',
+            self.subscription_name,
+            message.sequence_number,
+            loaded_message,
+        )
+        routes = self.router.match(loaded_message.get('subject', ''))
+        if not routes:
+            self.metrics.increment('messages_unmatched')
+            logger.info('No handler found, completing message')
+            await receiver.complete_message(message=message)
+            return
+
+        lane = self.lanes.get(loaded_message) if self.lanes is not None else None
+        if lane is None:
+            claim = await self._enqueue(receiver, message, loaded_message, routes)
+        else:
+            # Nothing is awaited before a message enters its lane, so messages enter it in the order they were received
+            async with lane:
+                if lane.broken:
+                    self.metrics.increment('messages_abandoned')
+                    logger.warning(
+                        'An earlier message with the same ordering key could not be enqueued, abandoning message with '
+                        'sequence number %s',
+                        message.sequence_number,
+                    )
+                    await receiver.abandon_message(message=message)
+                    return
+                claim = await self._enqueue(receiver, message, loaded_message, routes)
+        if claim is Claim.IN_FLIGHT:
+            return
+        await receiver.complete_message(message=message)
+        if claim is Claim.CLAIMED:
+            logger.info('Message with sequence number %s completed', message.sequence_number)
+
+    async def _enqueue(
+        self,
+        receiver: ServiceBusReceiver,
+        message: ServiceBusReceivedMessage,
+        loaded_message: dict,
+        routes: list[Route],
+    ) -> Claim:
+        # Enqueues the tasks of a message, and returns `Claim.CLAIMED`. Returns what the claim found instead if the
+        # message is a duplicate
+        dedup_key = self._get_dedup_key(message, loaded_message)
+        claim = Claim.CLAIMED
+        if self.dedup is not None and dedup_key is not None:
+            claim = await self.dedup.claim(dedup_key)
+        if claim is Claim.DONE:
+            self.metrics.increment('messages_duplicate')
+            logger.info('Message %s has already been enqueued, completing message', dedup_key)
+            return claim
+        if claim is Claim.IN_FLIGHT:
+            # Completing it could lose the message if that enqueue fails, so it is left to be redelivered when its
+            # lock expires, by which time the enqueue is done
+            self.metrics.increment('messages_in_flight')
+            logger.info('Message %s is being enqueued by another receiver, leaving it unsettled', dedup_key)
+            return claim
+
+        for route in routes:
+            logger.info('Subject matching: %s', route.subject)
+        tasks = build_tasks(
+            routes,
+            message=loaded_message,
+            topic_name=self.topic_name,
+            subscription_name=self.subscription_name,
+        )
+        locked_until = message.locked_until_utc if self.lock_renewer is not None else None
+        # Batch handlers get the message in a batch with other messages, enqueued as one task
+        enqueued: list[Awaitable] = [self.batches[route.index].add(loaded_message) for route in routes if route.batch]
+        if enqueued:
+            self._flush_idle_batches()
+        unbatched = [task for task in tasks if not task.batch]
+        if unbatched:
+            enqueued.append(self.dispatcher.dispatch(unbatched))
+        try:
+            await asyncio.gather(*enqueued)
+        except BaseException as error:
+            # Released on cancellation too, or the redelivered message would be completed as a duplicate.
+            # Jobs that did make it to RQ keep their ID, so they are replaced rather than duplicated on redelivery
+            if self.dedup is not None and dedup_key is not None:
+                await asyncio.shield(self.dedup.release(dedup_key))
+            if isinstance(error, Exception):
+                self.metrics.increment('messages_abandoned')
+                logger.warning(
+                    'Unable to enqueue message with sequence number %s, abandoning it', message.sequence_number
+                )
+                await receiver.abandon_message(message=message)
+            raise
+        if self.dedup is not None and dedup_key is not None:
+            await self.dedup.complete(dedup_key)
+        if locked_until is not None and message.locked_until_utc != locked_until:
+            self.metrics.increment('messages_lock_renewed')
+        return claim
+
+    async def _lock_lost(
+        self, renewable: ServiceBusReceivedMessage | ServiceBusSession, error: Exception | None
+    ) -> None:
+        # Called by the lock renewer when a lock could not be renewed, so the message will be redelivered
+        self.metrics.increment('locks_lost')
+        logger.warning(
+            '%s: Lost the lock of message with sequence number %s. Error: %s',
+            self.subscription_name,
+            getattr(renewable, 'sequence_number', None),
+            error,
+        )
+
+    async def wait_until_ready(self) -> None:
+        """
+        Waits while receiving is paused by backpressure
+        """
+        if self.backpressure is not None:
+            await self.backpressure.wait()
+
+    def _get_dedup_key(self, message: ServiceBusReceivedMessage, loaded_message: dict) -> str | None:
+        # Keyed on the Metro event ID, or the Service Bus message ID, and scoped to the subscription
+        if self.dedup is None:
+            return None
+        message_id = loaded_message.get('id') or message.message_id
+        if not message_id:
+            return None
+        return f'{self.topic_name}/{self.subscription_name}/{message_id}'
+
+    def _matches_any(self, subjects: list[str]) -> bool:
+        # A body without a top level subject is routed on an empty subject, so that has to be checked too
+        return self._matches_missing_subject or any(self.router.match(subject) for subject in subjects)
+
+    async def close(self) -> None:
+        """
+        Releases the resources held for the subscription
+        """
+        if self.backpressure is not None:
+            await self.backpressure.close()
+        for batch in self.batches.values():
+            await batch.close()
+        await self.dispatcher.close()
+        if self.lock_renewer is not None:
+            await self.lock_renewer.close()
+        if self.dedup is not None:
+            await self.dedup.close()
+
+
+async def receive(
+    receiver: ServiceBusReceiver,
+    processor: MessageProcessor,
+    *,
+    batch_receive: bool,
+    max_batch_size: int,
+    max_wait_time: float,
+    max_concurrency: int,
+    prefetch_count: int = 0,
+    stopping: asyncio.Event | None = None,
+    shutdown_timeout: float = 25,
+    until_idle: bool = False,
+) -> None:
+    """
+    Receives messages with one receiver, processing up to `max_concurrency` messages (or batches) at the same time.
+    Receiving stops while the processor is paused by backpressure.
+
+    Once `stopping` is set, receiving stops and the receiver is drained, see `drain`. With `until_idle`, receiving
+    also stops when a batch comes back empty, like the iterator does once the receiver's `max_wait_time` has passed.
+    """
+    in_flight = BoundedTaskGroup(max_concurrency)
+    received: list[ServiceBusReceivedMessage] = []  # Received, but not handed over to the processor yet
+
+    async def receive_messages() -> None:
+        nonlocal received
+        if batch_receive:
+            while True:
+                await processor.wait_until_ready()
+                received = await receiver.receive_messages(
+                    max_message_count=max_batch_size, max_wait_time=max_wait_time
+                )
+                if received:
+                    logger.debug('%s: Received a batch of %s messages', processor.subscription_name, len(received))
+                    await in_flight.spawn(processor.process, receiver, received)
+                    received = []
+                elif until_idle:
+                    return
+        else:
+            message: ServiceBusReceivedMessage
+            async for message in receiver:
+                received = [message]
+                await in_flight.spawn(processor.process, receiver, received)
+                received = []
+                # The next message is received once receiving is no longer paused
+                await processor.wait_until_ready()
+
+    receiving = asyncio.create_task(receive_messages())
+    stopped = asyncio.create_task((stopping or asyncio.Event()).wait())
+    try:
+        await asyncio.wait({receiving, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if stopped.done() and not receiving.done():
+            receiving.cancel()
+            await asyncio.gather(receiving, return_exceptions=True)
+            await drain(
+                receiver,
+                processor,
+                in_flight,
+                unprocessed=received,
+                prefetch_count=prefetch_count,
+                timeout=shutdown_timeout,
+            )
+        elif not receiving.cancelled():
+            receiving.result()  # Raises the error of the receiver, if any
+    finally:
+        receiving.cancel()
+        stopped.cancel()
+        # Let messages that are being processed be settled before the receiver is closed
+        await in_flight.wait()
+
+
+async def drain(
+    receiver: ServiceBusReceiver,
+    processor: MessageProcessor,
+    in_flight: BoundedTaskGroup,
+    *,
+    unprocessed: list[ServiceBusReceivedMessage],
+    prefetch_count: int,
+    timeout: float,
+) -> None:
+    """
+    Settles the messages of a receiver that has stopped receiving.
+
+    Messages that were received but not processed, including those prefetched by the receiver, are abandoned right
+    away, so Service Bus redelivers them to another receiver instead of waiting for their locks to expire. Messages
+    being processed are given `timeout` seconds to be enqueued and settled, and are cancelled after that.
+    """
+    unprocessed = list(unprocessed)
+    if prefetch_count:
+        try:
+            unprocessed += await receiver.receive_messages(max_message_count=prefetch_count, max_wait_time=1)
+        except Exception as error:
+            logger.warning('%s: Unable to receive prefetched messages. Error: %s', processor.subscription_name, error)
+    if unprocessed:
+        logger.info('%s: Abandoning %s unprocessed messages', processor.subscription_name, len(unprocessed))
+        processor.metrics.increment('messages_released', len(unprocessed))
+        await asyncio.gather(
+            *(receiver.abandon_message(message=message) for message in unprocessed), return_exceptions=True
+        )
+    try:
+        await asyncio.wait_for(in_flight.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(
+            '%s: Messages were not settled within %s seconds, cancelling them', processor.subscription_name, timeout
+        )
+        in_flight.cancel()
+
 
 async def subscribe_to_topic(
     connection_string: str,
     topic_name: str,
     subscription_name: str,
     handlers: list[Handler],
+    batch_receive: bool = False,
+    max_batch_size: int = 100,
+    max_wait_time: float = 5,
+    max_concurrency: int = 1,
+    dispatch_batch_size: int = 100,
+    dispatch_max_delay: float = 0,
+    receivers: int = 1,
+    prefetch_count: int = 0,
+    client_pool: ClientPool | None = None,
+    transport_type: str = 'websocket',
+    stopping: asyncio.Event | None = None,
+    shutdown_timeout: float = 25,
+    max_lock_renewal_duration: float = 0,
+    sessions: bool = False,
+    max_concurrent_sessions: int = 8,
+    session_idle_timeout: float = 5,
+    ordering_key: str | None = None,
+    ordering_lanes: int = 16,
 ) -> None:
     """
     Subscribe to a topic, with a connection string
+
+    With `batch_receive`, up to `max_batch_size` messages are received at once, waiting at most `max_wait_time`
+    seconds for a batch to fill up, and the whole batch is enqueued and completed together.
+    `receivers` receivers compete for the messages of the subscription, each prefetching up to `prefetch_count`
+    messages, and each processing up to `max_concurrency` messages (or batches) at the same time. Their tasks are
+    enqueued together, in groups of up to `dispatch_batch_size`, waiting at most `dispatch_max_delay` seconds for a
+    group to fill up.
+    `transport_type` is 'websocket' for AMQP over websockets, or 'amqp' for AMQP over TCP.
+    With a `client_pool`, the subscription uses the pool's client for its namespace instead of opening its own.
+    With `max_lock_renewal_duration`, the locks of received messages are renewed for up to that many seconds.
+    Once `stopping` is set, the receivers stop receiving, and messages being processed are given `shutdown_timeout`
+    seconds to be settled before the subscription returns.
+
+    With `sessions`, the subscription must be session enabled. Up to `max_concurrent_sessions` sessions are received
+    from at the same time, instead of `receivers` receivers. The messages of a session are processed one at a time,
+    in order, and a session is released once it has had no messages for `session_idle_timeout` seconds.
+
+    With an `ordering_key`, a dotted path into the loaded message such as 'data.id', messages are hashed by the value
+    at that path to one of `ordering_lanes` lanes. The lanes enqueue in parallel, up to `max_concurrency` messages at
+    once, and each lane enqueues its messages in the order they were received.
     """
-    # Create a connection to Metro
-    metro_client: ServiceBusClient
-    async with ServiceBusClient.from_connection_string(
-        conn_str=connection_string, transport_type=TransportType.AmqpOverWebsocket
-    ) as metro_client:
-        # Subscribe to a topic with through our subscription name
-        receiver: ServiceBusReceiver
-        async with metro_client.get_subscription_receiver(
-            topic_name=topic_name,
-            subscription_name=subscription_name,
-        ) as receiver:
-            logger.info('Started subscription for topic %s and subscription %s', topic_name, subscription_name)
-            # We now have a receiver, we can use this to talk with Metro
-            message: ServiceBusReceivedMessage
-            async for message in receiver:
-                sequence_number: int = message.sequence_number
-                loaded_message: dict = {}
+    processor = MessageProcessor(
+        topic_name=topic_name,
+        subscription_name=subscription_name,
+        handlers=handlers,
+        dispatch_batch_size=dispatch_batch_size,
+        dispatch_max_delay=dispatch_max_delay,
+        max_lock_renewal_duration=max_lock_renewal_duration,
+        ordered=sessions,
+        ordering_key=ordering_key,
+        ordering_lanes=ordering_lanes,
+    )
+    stopping = stopping or asyncio.Event()
+    # Messages are registered with the lock renewer as they are received, prefetched ones included
+    # The SDK annotates the option with the sync lock renewer, but the aio receiver takes the aio one
+    receiver_options: dict[str, Any] = {}
+    if processor.lock_renewer is not None:
+        receiver_options['auto_lock_renewer'] = processor.lock_renewer
+    async with AsyncExitStack() as stack:
+        # Create a connection to Metro, unless the namespace already has one in the pool
+        metro_client: ServiceBusClient
+        if client_pool is None:
+            metro_client = await stack.enter_async_context(
+                ServiceBusClient.from_connection_string(
+                    conn_str=connection_string, transport_type=TRANSPORT_TYPES[transport_type]
+                )
+            )
+        else:
+            metro_client = await client_pool.get(connection_string, TRANSPORT_TYPES[transport_type])
+
+        async def run_receiver() -> None:
+            # Subscribe to a topic with through our subscription name
+            receiver: ServiceBusReceiver
+            async with metro_client.get_subscription_receiver(
+                topic_name=topic_name,
+                subscription_name=subscription_name,
+                prefetch_count=prefetch_count,
+                **receiver_options,
+            ) as receiver:
+                logger.info('Started subscription for topic %s and subscription %s', topic_name, subscription_name)
+                # We now have a receiver, we can use this to talk with Metro
+                await receive(
+                    receiver,
+                    processor,
+                    batch_receive=batch_receive,
+                    max_batch_size=max_batch_size,
+                    max_wait_time=max_wait_time,
+                    max_concurrency=max_concurrency,
+                    prefetch_count=prefetch_count,
+                    stopping=stopping,
+                    shutdown_timeout=shutdown_timeout,
+                )
+
+        async def run_session_receiver() -> None:
+            # Receives from one session at a time, accepting the next available session when it is released
+            while not stopping.is_set():
                 try:
-                    loaded_message = json.loads(str(message))
-                except Exception as error:
-                    # We defer messages with a faulty body, we do not crash.
-                    logger.exception(
-                        'Unable to decode message %s. Sequence number %s. Error: %s',
-                        message,
-                        sequence_number,
-                        error,
-                    )
-                # Check how to handle this message
+                    receiver: ServiceBusReceiver
+                    async with metro_client.get_subscription_receiver(
+                        topic_name=topic_name,
+                        subscription_name=subscription_name,
+                        session_id=NEXT_AVAILABLE_SESSION,
+                        max_wait_time=session_idle_timeout,
+                        prefetch_count=prefetch_count,
+                        **receiver_options,
+                    ) as receiver:
+                        processor.metrics.increment('sessions_accepted')
+                        logger.debug('%s: Accepted session %s', subscription_name, receiver.session.session_id)
+                        # One message (or batch) at a time, so the order of the session is kept
+                        await receive(
+                            receiver,
+                            processor,
+                            batch_receive=batch_receive,
+                            max_batch_size=max_batch_size,
+                            max_wait_time=min(max_wait_time, session_idle_timeout),
+                            max_concurrency=1,
+                            prefetch_count=prefetch_count,
+                            stopping=stopping,
+                            shutdown_timeout=shutdown_timeout,
+                            until_idle=True,
+                        )
+                except OperationTimeoutError:
+                    logger.debug('%s: No session available', subscription_name)
+
+        try:
+            if sessions:
                 logger.info(
-                    '%s: Received message, sequence number %s. Content: %s',
-                    subscription_name,
-                    sequence_number,
-                    loaded_message,
+                    'Started session subscription for topic %s and subscription %s', topic_name, subscription_name
                 )
-                handled_message = False
-                for handler in handlers:
-                    subject = handler['subject']
-                    subject_is_regex = handler['regex']
-                    message_subject = loaded_message.get('subject', '')
-
-                    if match_handler_subject(
-                        subject=subject, message_subject=message_subject, is_regex=subject_is_regex
-                    ):
-                        logger.info('Subject matching: %s', handler.get('subject'))
-                        handler_function = import_string(handler.get('handler_function'))
-
-                        if settings.worker_type == 'celery':
-                            await sync_to_async(handler_function.apply_async)(  # type: ignore
-                                kwargs={
-                                    'message': loaded_message,
-                                    'topic_name': topic_name,
-                                    'subscription_name': subscription_name,
-                                    'subject': subject,
-                                }
-                            )
-                            logger.info('Celery task started')
-
-                        elif settings.worker_type == 'rq':
-                            import django_rq
-
-                            queue = django_rq.get_queue('metroid')
-                            await sync_to_async(queue.enqueue)(
-                                handler_function,
-                                job_id=loaded_message.get('id'),
-                                kwargs={
-                                    'message': loaded_message,
-                                    'topic_name': topic_name,
-                                    'subscription_name': subscription_name,
-                                    'subject': subject,
-                                },
-                            )
-                            logger.info('RQ task started')
-
-                        await receiver.complete_message(message=message)
-                        handled_message = True
-                        logger.info('Message with sequence number %s completed', sequence_number)
-                if not handled_message:
-                    logger.info('No handler found, completing message')
-                    await receiver.complete_message(message=message)
+                await run_all([run_session_receiver() for _ in range(max_concurrent_sessions)])
+            else:
+                await run_all([run_receiver() for _ in range(receivers)])
+        finally:
+            await processor.close()
@@ -0,0 +1,242 @@
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from types import FrameType
+from typing import Any
+
+from django_guid.context import guid
+
+from metroid.metrics import merge_snapshots
+from metroid.typing import Subscription
+from metroid.utils import backoff_delay
+
+logger = logging.getLogger('metroid')
+
+# A worker that has run this long is considered healthy, and its next restart is not delayed
+STABLE_AFTER = 60
+
+
+def assign_subscriptions(subscriptions: list[Subscription], processes: int) -> list[list[Subscription]]:
+    """
+    Spreads the subscriptions across `processes` workers, round robin.
+    With fewer subscriptions than processes, subscriptions are repeated, so several workers receive from the
+    same subscription as competing consumers.
+    """
+    assigned: list[list[Subscription]] = [[] for _ in range(processes)]
+    if not subscriptions:
+        return assigned
+    for slot in range(max(processes, len(subscriptions))):
+        assigned[slot % processes].append(subscriptions[slot % len(subscriptions)])
+    return assigned
+
+
+class _CorrelationIdFilter(logging.Filter):
+    """
+    Stores the correlation ID on log records, so it survives the trip to the supervisor
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = guid.get()
+        return True
+
+
+def run_worker(subscriptions: list[Subscription], events: Queue) -> None:
+    """
+    Entrypoint of a worker process. Runs the subscriptions, sending logs and metrics to the supervisor.
+    """
+    import django
+
+    django.setup()
+
+    # Ctrl+C reaches the workers too. They are stopped by the supervisor instead, with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Every record is sent to the supervisor once, and handled there with its logging configuration
+    for name in list(logging.root.manager.loggerDict):
+        configured = logging.root.manager.loggerDict[name]
+        if isinstance(configured, logging.Logger):
+            configured.handlers.clear()
+            configured.propagate = True
+    queue_handler = logging.handlers.QueueHandler(events)
+    queue_handler.addFilter(_CorrelationIdFilter())
+    logging.root.handlers = [queue_handler]
+
+    from metroid.management.commands.metroid import Command
+    from metroid.metrics import snapshot
+
+    def report() -> None:
+        events.put(('metrics', os.getpid(), snapshot()))
+
+    Command.run(subscriptions=subscriptions, report=report)
+
+
+class Worker:
+    """
+    A worker process and the subscriptions it runs
+    """
+
+    def __init__(self, index: int, subscriptions: list[Subscription]) -> None:
+        self.index = index
+        self.subscriptions = subscriptions
+        self.process: BaseProcess | None = None
+        self.started_at = 0.0
+        self.restart_at: float | None = None
+        self.failures = 0
+
+
+class ProcessSupervisor:
+    """
+    Runs the subscriptions in `processes` worker processes.
+
+    Workers that exit are restarted, with an exponential backoff while they keep failing. Log records of the workers
+    are handled by the supervisor's logging configuration, and their metrics are combined and logged every
+    `metrics_interval` seconds. When stopped, workers get `shutdown_timeout` seconds to drain before they are killed.
+    """
+
+    def __init__(
+        self,
+        *,
+        subscriptions: list[Subscription],
+        processes: int,
+        metrics_interval: float,
+        shutdown_timeout: float = 30,
+    ) -> None:
+        self.context = multiprocessing.get_context('spawn')
+        self.events: Queue = self.context.Queue()
+        self.metrics_interval = metrics_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.workers = [
+            Worker(index, assigned)
+            for index, assigned in enumerate(assign_subscriptions(subscriptions, processes))
+            if assigned
+        ]
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._metrics: dict[int | None, dict[str, dict[str, Any]]] = {}  # Latest snapshot per worker pid
+        self._retired_metrics: dict[str, dict[str, Any]] = {}
+
+    def run(self) -> None:
+        """
+        Starts the workers, and supervises them until the supervisor is asked to stop
+        """
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, self._handle_signal)
+        listener = threading.Thread(target=self._listen, name='metroid-supervisor', daemon=True)
+        listener.start()
+        for worker in self.workers:
+            self._start_worker(worker)
+        next_report = time.monotonic() + self.metrics_interval
+        try:
+            while not self._stopping.wait(0.5):
+                self._check_workers()
+                if self.metrics_interval and time.monotonic() >= next_report:
+                    self.log_metrics()
+                    next_report = time.monotonic() + self.metrics_interval
+        finally:
+            self._stop_workers()
+            self.log_metrics()
+            self.events.put(None)
+            listener.join(timeout=5)
+        logger.info('All worker processes stopped')
+
+    def _handle_signal(self, signal_number: int, frame: FrameType | None) -> None:
+        logger.info('Received signal %s, stopping worker processes', signal_number)
+        self._stopping.set()
+
+    def _start_worker(self, worker: Worker) -> None:
+        if worker.process is not None:
+            # The final metrics of the previous run have arrived by now, as restarts are delayed
+            self._retire_metrics(worker.process.pid)
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(worker.subscriptions, self.events),
+            name=f'metroid-worker-{worker.index}',
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logger.info(
+            'Started worker process %s (pid %s) for %s',
+            worker.index,
+            worker.process.pid,
+            ', '.join(f"{sub['topic_name']}/{sub['subscription_name']}" for sub in worker.subscriptions),
+        )
+
+    def _check_workers(self) -> None:
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self._start_worker(worker)
+                continue
+            if worker.process is None or worker.process.is_alive():
+                continue
+            worker.failures = 1 if now - worker.started_at >= STABLE_AFTER else worker.failures + 1
+            delay = backoff_delay(worker.failures - 1)
+            logger.error(
+                'Worker process %s exited with code %s, restarting it in %.1f seconds',
+                worker.index,
+                worker.process.exitcode,
+                delay,
+            )
+            worker.restart_at = now + delay
+
+    def _stop_workers(self) -> None:
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():  # pragma: no cover
+                    logger.warning('Worker process %s did not stop in time, killing it', worker.index)
+                    worker.process.kill()
+
+    def _listen(self) -> None:
+        """
+        Handles the log records and metrics sent by the workers
+        """
+        while True:
+            try:
+                event = self.events.get()
+            except (EOFError, OSError):  # pragma: no cover
+                return
+            if event is None:
+                return
+            if isinstance(event, logging.LogRecord):
+                token = guid.set(getattr(event, 'correlation_id', None))
+                try:
+                    logging.getLogger(event.name).handle(event)
+                finally:
+                    guid.reset(token)
+            else:
+                _, pid, metrics = event
+                with self._lock:
+                    self._metrics[pid] = metrics
+
+    def _retire_metrics(self, pid: int | None) -> None:
+        # A restarted worker counts from zero, so the counts of its previous run are kept aside
+        with self._lock:
+            if pid in self._metrics:
+                self._retired_metrics = merge_snapshots([self._retired_metrics, self._metrics.pop(pid)])
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """
+        Returns the metrics of all workers combined, keyed on `topic_name/subscription_name`
+        """
+        with self._lock:
+            return merge_snapshots([self._retired_metrics, *self._metrics.values()])
+
+    def log_metrics(self) -> None:
+        """
+        Logs the combined metrics of every subscription
+        """
+        for name, metrics in self.snapshot().items():
+            logger.info('Metrics for %s: %s', name, metrics)
@@ -1,26 +1,68 @@
-from collections.abc import Callable
 from typing import Literal, TypedDict
 
 
-class Handler(TypedDict):
+class _Handler(TypedDict):
     subject: str
     regex: bool
-    handler_function: Callable
+    handler_function: str
 
 
-class Subscription(TypedDict):
+class Handler(_Handler, total=False):
+    wildcard: bool
+    batch: bool
+    batch_size: int
+    batch_max_delay: float
+
+
+class _Subscription(TypedDict):
     topic_name: str
     subscription_name: str
     connection_string: str
     handlers: list[Handler]
 
 
+class Subscription(_Subscription, total=False):
+    batch_receive: bool
+    max_batch_size: int
+    max_wait_time: float
+    max_concurrency: int
+    dispatch_batch_size: int
+    dispatch_max_delay: float
+    receivers: int
+    prefetch_count: int
+    transport_type: str
+    max_lock_renewal_duration: float
+    sessions: bool
+    max_concurrent_sessions: int
+    session_idle_timeout: float
+    ordering_key: str
+    ordering_lanes: int
+
+
 class TopicPublishSettings(TypedDict):
     topic_name: str
     x_metro_key: str
 
 
-class MetroidSettings(TypedDict):
+class _MetroidSettings(TypedDict):
     subscriptions: list[Subscription]
     publish_settings: list[TopicPublishSettings]
-    worker_type: Literal['rq', 'celery']
+    worker_type: Literal['rq', 'celery', 'inline']
+
+
+class MetroidSettings(_MetroidSettings, total=False):
+    backend: str
+    enqueue_threads: int
+    metrics_interval: float
+    codec: str
+    dedup_ttl: float
+    dedup_max_size: int
+    dedup_redis_url: str
+    backpressure_high_watermark: int
+    backpressure_low_watermark: int
+    backpressure_interval: float
+    shutdown_timeout: float
+    max_restarts: int
+    restart_window: float
+    restart_backoff: float
+    restart_backoff_max: float
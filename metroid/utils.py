@@ -1,11 +1,34 @@
+import asyncio
 import logging
+import random
 import re
+from collections.abc import Callable, Coroutine
+from functools import lru_cache
 
 from django.core.exceptions import ImproperlyConfigured
 
 logger = logging.getLogger('metroid')
 
 
+@lru_cache(maxsize=None)
+def compile_subject_pattern(subject: str) -> re.Pattern:
+    """
+    Compiles a regex handler subject, caching the compiled pattern.
+    """
+    try:
+        return re.compile(subject)
+    except re.error:
+        raise ImproperlyConfigured(f'Provided regex pattern: {subject} is invalid.')
+
+
+def validate_wildcard_subject(subject: str) -> None:
+    """
+    Checks that `*` and `**` are whole segments of a wildcard handler subject.
+    """
+    if any('*' in segment and segment not in ('*', '**') for segment in subject.split('/')):
+        raise ImproperlyConfigured(f'Provided wildcard subject: {subject} is invalid. * and ** must be whole segments.')
+
+
 def match_handler_subject(
     subject: str,
     message_subject: str,
@@ -17,10 +40,86 @@ def match_handler_subject(
 
     """
     if is_regex:
-        try:
-            pattern = re.compile(subject)
-            return bool(re.match(pattern=pattern, string=message_subject))
-        except re.error:
-            raise ImproperlyConfigured(f'Provided regex pattern: {subject} is invalid.')
+        return bool(compile_subject_pattern(subject).match(message_subject))
     else:
         return subject == message_subject
+
+
+def backoff_delay(attempt: int, *, base: float = 1, maximum: float = 60, jitter: bool = False) -> float:
+    """
+    Returns the seconds to wait before retry number `attempt`, counting from 0. The delay doubles for every
+    attempt, up to `maximum`. With `jitter`, a random delay between half and all of that is returned, so
+    retries that fail together don't retry together.
+    """
+    delay = min(maximum, base * 2 ** min(attempt, 32))
+    if jitter:
+        return random.uniform(delay / 2, delay)
+    return delay
+
+
+class BoundedTaskGroup:
+    """
+    Runs up to `limit` coroutines at once.
+
+    The task spawning work is cancelled when one of the coroutines fails, and `wait` then raises that error once
+    every running coroutine has finished, so no message is left half settled.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._semaphore = asyncio.Semaphore(limit)
+        self._tasks: set[asyncio.Task] = set()
+        self._errors: list[BaseException] = []
+        self._owner: asyncio.Task | None = None
+        self._waiting = False
+
+    async def spawn(self, function: Callable[..., Coroutine], *args, **kwargs) -> None:
+        """
+        Waits for a free slot, then runs the coroutine function in the background.
+        """
+        self._owner = asyncio.current_task()
+        await self._semaphore.acquire()
+        task = asyncio.create_task(function(*args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._semaphore.release()
+        if task.cancelled() or task.exception() is None:
+            return
+        self._errors.append(task.exception())  # type: ignore[arg-type]
+        if len(self._errors) == 1 and self._owner is not None and not self._waiting:
+            self._owner.cancel()
+
+    def cancel(self) -> None:
+        """
+        Cancels the running coroutines
+        """
+        for task in self._tasks:
+            task.cancel()
+
+    async def wait(self) -> None:
+        """
+        Waits for all running coroutines, then raises the first error, if any.
+        """
+        self._waiting = True
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+        if self._errors:
+            raise self._errors[0]
+
+
+async def run_all(coroutines: list[Coroutine]) -> None:
+    """
+    Runs the coroutines at the same time. When one of them fails, the others are cancelled and the error is raised.
+    """
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()  # type: ignore[misc]
@@ -54,6 +54,8 @@ def mock_subscriptions(monkeypatch):
                     'x_metro_key': 'my-metro-key',
                 }
             ],
+            # Exit on the first failed subscription. Tests that restart subscriptions set their own limit
+            'max_restarts': 0,
         },
     ):
         settings = Settings()
@@ -61,3 +63,4 @@ def mock_subscriptions(monkeypatch):
         monkeypatch.setattr('metroid.publish.settings', settings)
         monkeypatch.setattr('metroid.republish.settings', settings)
         monkeypatch.setattr('metroid.admin.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
@@ -2,6 +2,8 @@ import asyncio
 import json
 from unittest.mock import AsyncMock, MagicMock
 
+from azure.servicebus.amqp import AmqpMessageBodyType
+
 
 class Message:
     def __init__(self, i, **kwargs):
@@ -36,6 +38,14 @@ class Message:
     def sequence_number(self):
         return self.i
 
+    @property
+    def body_type(self):
+        return AmqpMessageBodyType.DATA
+
+    @property
+    def body(self):
+        return (section for section in [str(self).encode()])
+
     def __str__(self):
         if not self.error:
             return json.dumps(self.message)
@@ -70,9 +80,23 @@ class ReceiverMock:
     def __aiter__(self):
         return self
 
+    async def receive_messages(self, max_message_count=None, max_wait_time=None):
+        """
+        Returns the same messages as the iterator, up to `max_message_count` at a time
+        """
+        messages = []
+        while self.i < 5 and len(messages) < (max_message_count or 1):
+            messages.append(await self.__anext__())
+        if not messages:
+            await asyncio.sleep(max_wait_time or 0)
+        return messages
+
     async def complete_message(self, message):
         return True
 
+    async def abandon_message(self, message):
+        return True
+
 
 class ServiceBusMock:
     def __init__(self, *args, **kwargs):
@@ -88,7 +112,7 @@ class ServiceBusMock:
     def from_connection_string(cls, conn_str, transport_type):
         return cls(conn_str, transport_type)
 
-    def get_subscription_receiver(self, topic_name, subscription_name):
+    def get_subscription_receiver(self, topic_name, subscription_name, **kwargs):
         if topic_name == 'error':
             return AsyncMock(ReceiverMock(error=True))
         return AsyncMock(ReceiverMock())
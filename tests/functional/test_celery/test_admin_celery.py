@@ -36,6 +36,7 @@ def mock_subscriptions_admin(monkeypatch):
     ):
         settings = Settings()
         monkeypatch.setattr('metroid.admin.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
 
 
 @pytest.fixture
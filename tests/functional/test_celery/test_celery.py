@@ -20,3 +20,84 @@ def test_faulty_metro_data():
             }
         )
     assert FailedMessage.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_faulty_metro_batch():
+    """
+    Tests that every message of a failed batch is saved, so each can be retried
+    """
+    with override_settings(CELERY_TASK_ALWAYS_EAGER=True):
+        batch_error_task = import_string('demoproj.tasks.batch_error_task')
+        batch_error_task.apply_async(
+            kwargs={
+                'messages': [{'id': 'a'}, {'id': 'b'}],
+                'topic_name': 'mocked_topic',
+                'subscription_name': 'mocked_subscription',
+                'subject': 'mocked_subject',
+            }
+        )
+    assert sorted(message.message['id'] for message in FailedMessage.objects.all()) == ['a', 'b']
+
+
+def test_celery_publishes_each_flush_over_one_producer(mocker):
+    from demoproj.tasks import my_task
+
+    from metroid.celery import publish_tasks
+    from metroid.dispatch import MessageTask
+
+    producer_pool = mocker.patch.object(type(my_task.app), 'producer_pool', new_callable=mocker.PropertyMock)
+    apply_async = mocker.patch.object(my_task, 'apply_async')
+    tasks = [
+        MessageTask(
+            handler_function=my_task,
+            message={'id': str(i)},
+            topic_name='test',
+            subscription_name='sub-test',
+            subject='Test/Django/Module',
+        )
+        for i in range(3)
+    ]
+    publish_tasks(tasks[:2])
+    publish_tasks(tasks[2:])
+    publish_tasks([])
+    acquire = producer_pool.return_value.acquire
+    producer = acquire.return_value.__enter__.return_value
+    assert acquire.call_count == 2
+    assert [call.kwargs['producer'] for call in apply_async.call_args_list] == [producer] * 3
+    assert apply_async.call_args_list[0].kwargs['kwargs'] == tasks[0].kwargs
+    # The producer goes back to the pool after each flush
+    assert acquire.return_value.__exit__.call_count == 2
+
+
+def test_celery_backends_share_the_producer_pool():
+    """
+    Tests that more backends than the pool has producers can all publish, as none of them holds on to a producer
+    """
+    from celery import Celery
+    from metroid.backends.celery import CeleryBackend
+    from metroid.dispatch import MessageTask
+
+    app = Celery('test_pool', broker='memory://', set_as_current=False)
+    app.conf.broker_pool_limit = 2
+
+    @app.task(name='test_pool.task')
+    def task(**kwargs):
+        pass
+
+    backends = [CeleryBackend() for _ in range(app.conf.broker_pool_limit + 1)]
+    for i, backend in enumerate(backends):
+        backend.enqueue_many(
+            [
+                MessageTask(
+                    handler_function=task,
+                    message={'id': str(i)},
+                    topic_name='test',
+                    subscription_name='sub-test',
+                    subject='Test/Django/Module',
+                )
+            ]
+        )
+    with app.connection_for_read() as connection:
+        queue = connection.default_channel.queue_declare(queue=app.conf.task_default_queue, passive=True)
+    assert queue.message_count == len(backends)
@@ -0,0 +1,69 @@
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+
+import pytest
+
+from metroid.config import Settings
+from metroid.models import FailedMessage
+
+
+@pytest.fixture
+def create_and_sign_in_user(client):
+    User.objects.create_superuser('testuser', 'test@test.com', 'testpw')
+    client.login(username='testuser', password='testpw')
+
+
+@pytest.fixture
+def mock_subscriptions_admin(monkeypatch):
+    with override_settings(
+        METROID={
+            'subscriptions': [
+                {
+                    'topic_name': 'test',
+                    'subscription_name': 'sub-test-djangomoduletest',
+                    'connection_string': 'my long connection string',
+                    'handlers': [
+                        {'subject': 'InlineTask', 'handler_function': 'demoproj.tasks.example_inline_task'},
+                        {'subject': 'ErrorTask', 'handler_function': 'demoproj.tasks.async_error_task'},
+                    ],
+                },
+            ],
+            'worker_type': 'inline',
+        }
+    ):
+        settings = Settings()
+        monkeypatch.setattr('metroid.admin.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
+
+
+def create_failed_message(subject: str) -> FailedMessage:
+    return FailedMessage.objects.create(
+        topic_name='test',
+        subscription_name='sub-test-djangomoduletest',
+        subject=subject,
+        message={'id': 'abc', 'subject': subject},
+        exception_str='exc',
+        traceback='long trace',
+        correlation_id='',
+    )
+
+
+@pytest.mark.django_db
+def test_admin_action_runs_handler_inline(client, caplog, create_and_sign_in_user, mock_subscriptions_admin):
+    content = create_failed_message('InlineTask')
+    change_url = reverse('admin:metroid_failedmessage_changelist')
+    response = client.post(change_url, {'action': 'retry', '_selected_action': [content.id]}, follow=True)
+    assert response.status_code == 200
+    assert f'Deleting {content.id} from database' in [x.message for x in caplog.records]
+    assert not FailedMessage.objects.exists()
+
+
+@pytest.mark.django_db
+def test_admin_action_failing_handler_inline(client, caplog, create_and_sign_in_user, mock_subscriptions_admin):
+    content = create_failed_message('ErrorTask')
+    change_url = reverse('admin:metroid_failedmessage_changelist')
+    response = client.post(change_url, {'action': 'retry', '_selected_action': [content.id]}, follow=True)
+    assert response.status_code == 200
+    assert [x for x in caplog.records if 'Unable to retry Metro message' in x.message]
+    assert FailedMessage.objects.filter(id=content.id).exists()
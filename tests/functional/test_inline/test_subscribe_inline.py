@@ -0,0 +1,57 @@
+import logging
+
+from django.test import override_settings
+
+import pytest
+
+from metroid.config import Settings
+from metroid.models import FailedMessage
+from metroid.subscribe import subscribe_to_topic
+
+
+@pytest.fixture(autouse=True)
+def mock_inline_worker(monkeypatch):
+    with override_settings(METROID={'worker_type': 'inline'}):
+        settings = Settings()
+        monkeypatch.setattr('metroid.dispatch.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_subscription_inline(caplog, mock_service_bus_client_ok):
+    caplog.set_level(logging.INFO)
+    await subscribe_to_topic(
+        **{
+            'topic_name': 'test',
+            'subscription_name': 'sub-test-mocktest',
+            'connection_string': 'my long connection string',
+            'handlers': [
+                {
+                    'subject': 'Test/Django/Module',
+                    'regex': False,
+                    'handler_function': 'demoproj.tasks.example_inline_task',
+                },
+                {
+                    'subject': 'Exception/Django/Module',
+                    'regex': False,
+                    'handler_function': 'demoproj.tasks.async_error_task',
+                },
+                {
+                    'subject': 'Exception/Django/Module',
+                    'regex': False,
+                    'handler_function': 'demoproj.tasks.a_random_task',
+                },
+            ],
+        }
+    )
+    log_messages = [x.message for x in caplog.records]
+    assert 'Running example_inline_task inline' in log_messages
+    assert 'Running async_error_task inline' in log_messages
+    # Failed handlers are saved, and their messages are still completed
+    assert len([message for message in log_messages if message == 'Saved failed message to database.']) == 2
+    assert len([message for message in log_messages if 'completed' in message]) == 2
+    failed = [failed async for failed in FailedMessage.objects.order_by('exception_str')]
+    assert [message.exception_str for message in failed] == ['My mocked async error :)', 'My mocked error :)']
+    assert all(message.subject == 'Exception/Django/Module' for message in failed)
+    assert failed[0].correlation_id != failed[1].correlation_id
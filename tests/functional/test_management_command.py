@@ -1,4 +1,7 @@
 import asyncio
+import os
+import signal
+import threading
 
 from django.core.management import call_command
 
@@ -21,6 +24,11 @@ async def mock_subscription_exception(**kwargs):
         await asyncio.sleep(20)
 
 
+async def mock_subscription_stopping(**kwargs):
+    await kwargs['stopping'].wait()
+    await asyncio.sleep(0.1)  # Settling messages
+
+
 @pytest.fixture
 def subscriptions_return(mocker):
     """
@@ -55,3 +63,35 @@ def test_command_exception(subscriptions_exception, caplog):
     assert [x for x in caplog.records if 'Cancelling pending task' in x.message]
     assert not [x for x in caplog.records if 'ended early without an exception' in x.message]
     assert [x for x in caplog.records if 'All tasks cancelled' in x.message]
+
+
+@pytest.fixture
+def restarts_enabled(monkeypatch):
+    from metroid.management.commands.metroid import settings
+
+    monkeypatch.setitem(settings.settings, 'max_restarts', 2)
+    monkeypatch.setitem(settings.settings, 'restart_backoff', 0.01)
+
+
+def test_command_restarts_failed_subscription(subscriptions_exception, restarts_enabled, caplog):
+    with pytest.raises(SystemExit):
+        call_command('metroid')
+    restarts = [x for x in caplog.records if x.message.startswith('Restarting subscription sub-test-test2 in')]
+    assert len(restarts) == 2
+    assert len([x for x in caplog.records if 'Exception in subscription' in x.message]) == 3
+    assert [x for x in caplog.records if 'sub-test-test2 failed more than 2 times in 300 seconds' in x.message]
+    # The other subscription kept running until the crash loop limit was reached
+    assert len([x for x in caplog.records if 'Cancelling pending task' in x.message]) == 1
+    assert [x for x in caplog.records if "'restarts': 2" in x.message]
+
+
+def test_command_stops_gracefully_on_sigterm(mocker, caplog):
+    mocker.patch('metroid.management.commands.metroid.subscribe_to_topic', mock_subscription_stopping)
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    call_command('metroid')  # Returns instead of exiting the process
+    timer.join()
+    assert [x for x in caplog.records if x.message.startswith(f'Received signal {signal.SIGTERM}, stopping')]
+    assert not [x for x in caplog.records if 'Cancelling pending task' in x.message]
+    assert not [x for x in caplog.records if 'ended early without an exception' in x.message]
+    assert [x for x in caplog.records if 'All subscriptions stopped' in x.message]
@@ -39,6 +39,7 @@ def mock_subscriptions_admin(monkeypatch):
     ):
         settings = Settings()
         monkeypatch.setattr('metroid.admin.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
 
 
 @pytest.mark.django_db
@@ -72,3 +73,37 @@ def test_admin_action_handler_found_rq(client, caplog, create_and_sign_in_user,
     assert FailedMessage.objects.get(id=2)  # Prev message should fail
     with pytest.raises(FailedMessage.DoesNotExist):
         FailedMessage.objects.get(id=1)  # message we created above should be deleted
+
+
+@pytest.mark.django_db
+def test_admin_action_bulk_retry_rq(client, caplog, create_and_sign_in_user, mock_subscriptions_admin):
+    with override_settings(RQ_QUEUES={'metroid': {}, 'fake': {}}):
+        a_random_task = import_string('demoproj.tasks.a_random_task')
+        queue = django_rq.get_queue('metroid')
+        queue.empty()
+        job_ids = ['A1B2C3D4-0000-4A57-9A67-8586ADC2D8B6', 'A1B2C3D4-1111-4A57-9A67-8586ADC2D8B6']
+        for job_id in job_ids:
+            queue.enqueue(
+                a_random_task,
+                job_id=job_id,
+                kwargs={
+                    'message': {'id': job_id},
+                    'topic_name': 'test',
+                    'subscription_name': 'sub-test-djangomoduletest',
+                    'subject': 'MockedTask',
+                },
+            )
+        worker = SimpleWorker([queue], connection=queue.connection, exception_handlers=[on_failure])
+        worker.work(burst=True)
+        assert set(job_ids) <= set(queue.failed_job_registry.get_job_ids())
+
+        change_url = reverse('admin:metroid_failedmessage_changelist')
+        data = {'action': 'retry', '_selected_action': list(FailedMessage.objects.values_list('id', flat=True))}
+        response = client.post(change_url, data, follow=True)
+
+        assert response.status_code == 200
+        # Both jobs are back on the queue with their original IDs, and no longer in the failed job registry
+        assert sorted(queue.job_ids) == job_ids
+        assert not set(job_ids) & set(queue.failed_job_registry.get_job_ids())
+        assert FailedMessage.objects.count() == 0
+        queue.empty()
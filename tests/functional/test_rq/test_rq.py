@@ -4,8 +4,9 @@ from django.utils.module_loading import import_string
 import django_rq
 import pytest
 
+from metroid.dispatch import MessageTask
 from metroid.models import FailedMessage
-from metroid.rq import on_failure
+from metroid.rq import enqueue_many, on_failure
 from rq import SimpleWorker
 
 
@@ -31,6 +32,31 @@ def test_faulty_metro_data():
     assert FailedMessage.objects.count() == 1
 
 
+@pytest.mark.django_db
+def test_faulty_metro_batch():
+    """
+    Tests that every message of a failed batch is saved, so each can be retried
+    """
+    with override_settings(RQ_QUEUES={'metroid': {}, 'fake': {}}):
+        queue = django_rq.get_queue('metroid')
+        enqueue_many(
+            [
+                MessageTask(
+                    handler_function=import_string('demoproj.tasks.batch_error_task'),
+                    message=[{'id': 'a'}, {'id': 'b'}],
+                    topic_name='mocked_topic',
+                    subscription_name='mocked_subscription',
+                    subject='mocked_subject',
+                    batch=True,
+                )
+            ]
+        )
+        worker = SimpleWorker([queue], connection=queue.connection, exception_handlers=[on_failure])
+        worker.work(burst=True)
+
+    assert sorted(message.message['id'] for message in FailedMessage.objects.all()) == ['a', 'b']
+
+
 @pytest.mark.django_db
 def test_non_metroid_task():
     assert FailedMessage.objects.count() == 0
@@ -51,3 +77,24 @@ def test_non_metroid_task():
         worker.work(burst=True)
 
     assert FailedMessage.objects.count() == 0
+
+
+def test_enqueue_many_keeps_job_ids():
+    with override_settings(RQ_QUEUES={'metroid': {}, 'fake': {}}):
+        queue = django_rq.get_queue('metroid')
+        queue.empty()
+        tasks = [
+            MessageTask(
+                handler_function=import_string('demoproj.tasks.my_task'),
+                message={'id': f'5F9914AB-2CC1-4A57-9A67-8586ADC2D8B{i}', 'subject': 'Test/Django/Module'},
+                topic_name='test',
+                subscription_name='sub-test-mocktest',
+                subject='Test/Django/Module',
+            )
+            for i in range(3)
+        ]
+        jobs = enqueue_many(tasks)
+        assert [job.id for job in jobs] == [task.job_id for task in tasks]
+        assert queue.job_ids == [task.job_id for task in tasks]
+        assert jobs[0].kwargs == tasks[0].kwargs
+        queue.empty()
@@ -1,11 +1,17 @@
+import asyncio
 import logging
 
 from django.test import override_settings
+from django.utils.module_loading import import_string
 
+import django_rq
 import pytest
 from azure.servicebus import TransportType
+from azure.servicebus.aio import AutoLockRenewer
 
+from metroid.backends.rq import RQBackend
 from metroid.config import Settings
+from metroid.dispatch import MessageTask
 from metroid.subscribe import subscribe_to_topic
 
 
@@ -13,7 +19,8 @@ from metroid.subscribe import subscribe_to_topic
 def mock_rq_worker(monkeypatch):
     with override_settings(METROID={'worker_type': 'rq'}):
         settings = Settings()
-        monkeypatch.setattr('metroid.subscribe.settings', settings)
+        monkeypatch.setattr('metroid.dispatch.settings', settings)
+        monkeypatch.setattr('metroid.backends.settings', settings)
 
 
 @pytest.mark.asyncio
@@ -83,3 +90,210 @@ async def test_faulty_metro_data_rq(caplog, mock_service_bus_client_failure):
     )
     log_messages = [x.message for x in caplog.records]
     assert len([message for message in log_messages if 'Unable to decode message' in message]) == 1
+
+
+@pytest.mark.asyncio
+async def test_subscription_batch_receive_rq(caplog, mock_service_bus_client_ok):
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        caplog.set_level(logging.INFO)
+        with pytest.raises(asyncio.TimeoutError):
+            # Batch mode keeps asking for messages until cancelled
+            await asyncio.wait_for(
+                subscribe_to_topic(
+                    **{
+                        'topic_name': 'test',
+                        'subscription_name': 'sub-test-mocktest',
+                        'connection_string': 'my long connection string',
+                        'handlers': [
+                            {
+                                'subject': 'Test/Django/Module',
+                                'regex': False,
+                                'handler_function': 'demoproj.tasks.my_task',
+                            },
+                            {
+                                'subject': 'Exception/Django/Module',
+                                'regex': False,
+                                'handler_function': 'demoproj.tasks.my_task',
+                            },
+                        ],
+                        'batch_receive': True,
+                        'max_batch_size': 3,
+                        'max_wait_time': 0.1,
+                    }
+                ),
+                timeout=2,
+            )
+    log_messages = [x.message for x in caplog.records]
+    # The first batch holds the two matching messages, so both tasks are enqueued before any message is completed
+    assert log_messages[1:7] == [
+        'sub-test-mocktest: Received message, sequence number 0. Content: '
+        "{'eventType': 'Intility.Jonas.Testing', 'eventTime': '2021-02-02T12:50:39.611290+00:00', "
+        "'dataVersion': '1.0', 'data': 'Mocked - Yo, Metro is awesome', 'subject': 'Test/Django/Module'}",
+        'Subject matching: Test/Django/Module',
+        'sub-test-mocktest: Received message, sequence number 1. Content: '
+        "{'eventType': 'Intility.Jonas.Testing', 'eventTime': '2021-02-02T12:50:39.611290+00:00', "
+        "'dataVersion': '1.0', 'data': {'content': 'Mocked - Yo, Metro is awesome'}, 'subject': 'Exception/Django/Module'}",
+        'Subject matching: Exception/Django/Module',
+        # No handler matches the subject, so the message is not decoded
+        'sub-test-mocktest: Received message, sequence number 2. Subject: Ignore me',
+        'No handler found, completing message',
+    ]
+    assert len([message for message in log_messages if 'RQ task started' in message]) == 2
+    assert len([message for message in log_messages if 'completed' in message]) == 2
+    assert len([message for message in log_messages if message == 'No handler found, completing message']) == 3
+
+
+@pytest.mark.asyncio
+async def test_subscription_concurrent_rq(caplog, mock_service_bus_client_ok):
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        caplog.set_level(logging.INFO)
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [
+                    {
+                        'subject': 'Test/Django/Module',
+                        'regex': False,
+                        'handler_function': 'demoproj.tasks.my_task',
+                    },
+                ],
+                'max_concurrency': 3,
+            }
+        )
+    log_messages = [x.message for x in caplog.records]
+    assert len([message for message in log_messages if 'RQ task started' in message]) == 1
+    assert 'Message with sequence number 0 completed' in log_messages
+    assert len([message for message in log_messages if message == 'No handler found, completing message']) == 4
+
+
+@pytest.mark.asyncio
+async def test_subscription_enqueue_failure_rq(mocker, mock_service_bus_client_ok):
+    mocker.patch('metroid.backends.rq.RQBackend.enqueue_many', side_effect=ConnectionError('Mocked broker error'))
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [
+                    {
+                        'subject': 'Test/Django/Module',
+                        'regex': False,
+                        'handler_function': 'demoproj.tasks.my_task',
+                    },
+                ],
+                'max_concurrency': 3,
+            }
+        )
+
+
+@pytest.mark.asyncio
+async def test_subscription_competing_receivers_rq(caplog, mock_service_bus_client_ok):
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        caplog.set_level(logging.INFO)
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [
+                    {
+                        'subject': 'Test/Django/Module',
+                        'regex': False,
+                        'handler_function': 'demoproj.tasks.my_task',
+                    },
+                ],
+                'receivers': 2,
+                'prefetch_count': 10,
+            }
+        )
+    client = mock_service_bus_client_ok.from_connection_string.return_value.__aenter__.return_value
+    assert client.get_subscription_receiver.call_count == 2
+    client.get_subscription_receiver.assert_called_with(
+        topic_name='test', subscription_name='sub-test-mocktest', prefetch_count=10
+    )
+    log_messages = [x.message for x in caplog.records]
+    assert log_messages.count('Started subscription for topic test and subscription sub-test-mocktest') == 2
+    # The mocked receivers share their messages, so every message is still handled once
+    assert len([message for message in log_messages if 'RQ task started' in message]) == 1
+    assert len([message for message in log_messages if message == 'No handler found, completing message']) == 4
+
+
+@pytest.mark.asyncio
+async def test_subscription_pooled_client_rq(mocker, mock_service_bus_client_ok):
+    client = mock_service_bus_client_ok.from_connection_string.return_value.__aenter__.return_value
+    client_pool = mocker.Mock(get=mocker.AsyncMock(return_value=client))
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [],
+                'client_pool': client_pool,
+            }
+        )
+    client_pool.get.assert_awaited_once_with('my long connection string', TransportType.AmqpOverWebsocket)
+    mock_service_bus_client_ok.from_connection_string.assert_not_called()
+    client.get_subscription_receiver.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_subscription_amqp_transport_rq(mock_service_bus_client_ok):
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [],
+                'transport_type': 'amqp',
+            }
+        )
+    mock_service_bus_client_ok.from_connection_string.assert_called_with(
+        conn_str='my long connection string', transport_type=TransportType.Amqp
+    )
+
+
+@pytest.mark.asyncio
+async def test_subscription_lock_renewal_rq(mock_service_bus_client_ok):
+    with override_settings(RQ_QUEUES={'metroid': {'ASYNC': False}, 'fake': {}}):
+        await subscribe_to_topic(
+            **{
+                'topic_name': 'test',
+                'subscription_name': 'sub-test-mocktest',
+                'connection_string': 'my long connection string',
+                'handlers': [],
+                'max_lock_renewal_duration': 120,
+            }
+        )
+    client = mock_service_bus_client_ok.from_connection_string.return_value.__aenter__.return_value
+    lock_renewer = client.get_subscription_receiver.call_args.kwargs['auto_lock_renewer']
+    assert isinstance(lock_renewer, AutoLockRenewer)
+    assert lock_renewer._max_lock_renewal_duration == 120
+
+
+def test_queue_depth_rq():
+    """
+    Tests that the RQ backend reports the number of jobs waiting on the `metroid` queue, for backpressure
+    """
+    with override_settings(RQ_QUEUES={'metroid': {}, 'fake': {}}):
+        backend = RQBackend()
+        django_rq.get_queue('metroid').empty()
+        assert backend.queue_depth() == 0
+        backend.enqueue_many(
+            [
+                MessageTask(
+                    handler_function=import_string('demoproj.tasks.my_task'),
+                    message={'id': str(i)},
+                    topic_name='test',
+                    subscription_name='sub-test',
+                    subject='Test/Django/Module',
+                )
+                for i in range(3)
+            ]
+        )
+        assert backend.queue_depth() == 3
+        django_rq.get_queue('metroid').empty()
@@ -0,0 +1,88 @@
+from django.test import override_settings
+
+import pytest
+
+from metroid.backends import Backend, get_backend
+from metroid.backends.celery import CeleryBackend
+from metroid.backends.inline import InlineBackend
+from metroid.backends.rq import RQBackend
+from metroid.config import Settings
+from metroid.dispatch import Dispatcher, MessageTask
+from metroid.metrics import SubscriptionMetrics
+
+ENQUEUED: list[str] = []
+
+
+class ListBackend(Backend):
+    """
+    A custom backend, which enqueues tasks on a list
+    """
+
+    def enqueue(self, task: MessageTask) -> None:
+        if task.message['id'] == 'broken':
+            raise ConnectionError('Mocked broker error')
+        ENQUEUED.append(task.message['id'])
+
+
+def make_task(message_id: str) -> MessageTask:
+    return MessageTask(
+        handler_function=lambda **kwargs: None,
+        message={'id': message_id},
+        topic_name='test',
+        subscription_name='sub-test',
+        subject='Test/Django/Module',
+    )
+
+
+@pytest.mark.parametrize(
+    'worker_type, backend',
+    [('celery', CeleryBackend), ('rq', RQBackend), ('inline', InlineBackend)],
+)
+def test_default_backend_of_worker_type(monkeypatch, worker_type, backend):
+    """
+    Tests that the worker type picks the backend when no backend is set
+    """
+    with override_settings(METROID={'subscriptions': [], 'worker_type': worker_type}):
+        monkeypatch.setattr('metroid.backends.settings', Settings())
+        assert type(get_backend()) is backend
+
+
+@pytest.mark.asyncio
+async def test_custom_backend_by_dotted_path(monkeypatch):
+    """
+    Tests that a custom backend set by dotted path enqueues the tasks of a dispatcher
+    """
+    ENQUEUED.clear()
+    with override_settings(METROID={'subscriptions': [], 'backend': 'tests.unit.test_backends.ListBackend'}):
+        settings = Settings()
+        settings.validate()
+        monkeypatch.setattr('metroid.backends.settings', settings)
+        dispatcher = Dispatcher(metrics=SubscriptionMetrics(topic_name='test', subscription_name='sub-test'))
+        assert isinstance(dispatcher.backend, ListBackend)
+        await dispatcher.dispatch([make_task('a'), make_task('b')])
+        await dispatcher.close()
+    assert ENQUEUED == ['a', 'b']
+    assert dispatcher.metrics.counters == {'dispatch_flushes': 1, 'tasks_enqueued': 2}
+
+
+def test_retry_many_returns_errors_per_task():
+    """
+    Tests that a task that could not be retried does not stop the other tasks from being retried
+    """
+    ENQUEUED.clear()
+    errors = ListBackend().retry_many([make_task('a'), make_task('broken'), make_task('b')])
+    assert ENQUEUED == ['a', 'b']
+    assert [str(error) if error else None for error in errors] == [None, 'Mocked broker error', None]
+
+
+def test_backend_without_enqueue_can_not_be_created():
+    """
+    Tests that a backend missing `enqueue` fails when it is created, rather than on its first message
+    """
+
+    class IncompleteBackend(Backend):
+        def enqueue_many(self, tasks: list[MessageTask]) -> None:
+            pass
+
+    with pytest.raises(TypeError, match='enqueue'):
+        IncompleteBackend()
@@ -0,0 +1,81 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from metroid.backends import Backend
+from metroid.backpressure import Backpressure
+from metroid.dispatch import MessageTask
+from metroid.metrics import SubscriptionMetrics
+from metroid.subscribe import MessageProcessor, receive
+
+
+class DepthBackend(Backend):
+    """
+    Reports the queue depths it is given, one per check
+    """
+
+    def __init__(self, *depths: int | None) -> None:
+        self.depths = list(depths)
+
+    def enqueue(self, task: MessageTask) -> None:
+        pass
+
+    def queue_depth(self) -> int | None:
+        depth = self.depths.pop(0)
+        if depth == -1:
+            raise ConnectionError('Mocked broker error')
+        return depth
+
+
+def make_backpressure(backend: Backend) -> Backpressure:
+    return Backpressure(
+        backend=backend,
+        metrics=SubscriptionMetrics(topic_name='test', subscription_name='sub-test'),
+        high_watermark=100,
+        low_watermark=50,
+        interval=0.01,
+    )
+
+
+@pytest.mark.asyncio
+async def test_pauses_above_high_and_resumes_below_low_watermark():
+    """
+    Tests that receiving pauses at the high watermark, and stays paused until the low watermark is reached
+    """
+    backpressure = make_backpressure(DepthBackend(99, 100, 75, -1, None, 50))
+    paused = []
+    for _ in range(6):
+        await backpressure.check()
+        paused.append(backpressure.paused)
+    assert paused == [False, True, True, True, True, False]
+    assert backpressure.metrics.counters == {'backpressure_pauses': 1}
+    assert backpressure.metrics.timings['backpressure_pause'].count == 1
+
+
+@pytest.mark.asyncio
+async def test_paused_receiver_does_not_receive():
+    """
+    Tests that a receiver stops receiving batches while paused, and continues once the queue has drained
+    """
+    processor = MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=[])
+    processor.backpressure = make_backpressure(DepthBackend(*[100] * 20, *[0] * 1000))
+    receiver = AsyncMock()
+
+    async def receive_messages(**kwargs):
+        await asyncio.sleep(0.01)
+        return []
+
+    receiver.receive_messages.side_effect = receive_messages
+    receiving = asyncio.create_task(
+        receive(receiver, processor, batch_receive=True, max_batch_size=10, max_wait_time=1, max_concurrency=1)
+    )
+    await asyncio.sleep(0.02)
+    assert processor.backpressure.paused
+    received_while_paused = receiver.receive_messages.await_count
+    assert received_while_paused <= 1
+    await asyncio.wait_for(processor.backpressure.wait(), timeout=1)
+    await asyncio.sleep(0.05)
+    assert receiver.receive_messages.await_count > received_while_paused
+    receiving.cancel()
+    await processor.close()
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from metroid.utils import BoundedTaskGroup, run_all
+
+
+@pytest.mark.asyncio
+async def test_limits_running_coroutines() -> None:
+    """
+    Tests that no more than `limit` coroutines run at the same time, and that all of them finish.
+    """
+    running = 0
+    peak = 0
+    finished = []
+
+    async def work(i: int) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        finished.append(i)
+
+    group = BoundedTaskGroup(3)
+    for i in range(10):
+        await group.spawn(work, i)
+    await group.wait()
+    assert peak == 3
+    assert sorted(finished) == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_failure_stops_spawning_and_is_raised() -> None:
+    """
+    Tests that a failing coroutine cancels the spawning task, and that `wait` raises the error after the other
+    coroutines have finished.
+    """
+    finished = []
+
+    async def work(i: int) -> None:
+        await asyncio.sleep(0.01 if i == 0 else 0.1)
+        if i == 0:
+            raise ValueError('Mocked error')
+        finished.append(i)
+
+    async def spawn_forever() -> None:
+        group = BoundedTaskGroup(2)
+        i = 0
+        try:
+            while True:
+                await group.spawn(work, i)
+                i += 1
+        finally:
+            await group.wait()
+
+    with pytest.raises(ValueError, match='Mocked error'):
+        await asyncio.wait_for(spawn_forever(), timeout=2)
+    assert finished == [1]
+
+
+@pytest.mark.asyncio
+async def test_run_all_cancels_the_others_on_failure() -> None:
+    """
+    Tests that `run_all` cancels the other coroutines when one fails, and raises its error.
+    """
+    cancelled = []
+
+    async def forever() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fail() -> None:
+        await asyncio.sleep(0.01)
+        raise ValueError('Mocked error')
+
+    with pytest.raises(ValueError, match='Mocked error'):
+        await run_all([forever(), forever(), fail()])
+    assert cancelled == [True, True]
@@ -0,0 +1,32 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from azure.servicebus import TransportType
+
+from metroid.clients import ClientPool
+
+
+@pytest.fixture
+def service_bus_client(mocker):
+    client = mocker.patch('metroid.clients.ServiceBusClient')
+    client.from_connection_string.side_effect = lambda **kwargs: AsyncMock()
+    return client
+
+
+@pytest.mark.asyncio
+async def test_one_client_per_connection_string(service_bus_client) -> None:
+    """
+    Tests that subscriptions with the same connection string share a client, and that closing the pool closes it
+    """
+    pool = ClientPool()
+    first = await pool.get('Endpoint=sb://first')
+    assert await pool.get('Endpoint=sb://first') is first
+    second = await pool.get('Endpoint=sb://second')
+    assert second is not first
+    assert service_bus_client.from_connection_string.call_count == 2
+    service_bus_client.from_connection_string.assert_called_with(
+        conn_str='Endpoint=sb://second', transport_type=TransportType.AmqpOverWebsocket
+    )
+    await pool.close()
+    first.close.assert_awaited_once()
+    second.close.assert_awaited_once()
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from azure.servicebus import ServiceBusMessage
+from azure.servicebus.amqp import AmqpAnnotatedMessage, AmqpMessageBodyType
+
+from metroid.codec import get_codec
+from metroid.subscribe import decode_message, get_message_body
+
+CONTENT = {'subject': 'Test/Django/Module', 'data': {'content': 'Mocked - Yo, Metro is awesome æøå'}}
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgspec'])
+def test_codec_round_trip(name):
+    """
+    Tests that every codec decodes bytes, and encodes what it decodes
+    """
+    if name != 'json':
+        pytest.importorskip(name)
+    codec = get_codec(name)
+    body = json.dumps(CONTENT).encode()
+    assert codec.loads(body) == CONTENT
+    assert codec.loads(codec.dumps(CONTENT)) == CONTENT
+
+
+def test_message_body_is_not_copied_for_one_section():
+    """
+    Tests that a single data section is returned as is, and that several sections are joined
+    """
+    body = json.dumps(CONTENT).encode()
+    message = ServiceBusMessage(body)
+    assert get_message_body(message) is body  # type: ignore[arg-type]
+    message = AmqpAnnotatedMessage(data_body=[body[:10], body[10:]])
+    assert get_message_body(message) == body  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson'])
+def test_decode_message_with_codec(mocker, name):
+    """
+    Tests that messages are decoded with the configured codec
+    """
+    pytest.importorskip(name)
+    mocker.patch('metroid.subscribe.settings.settings', {'codec': name})
+    message = ServiceBusMessage(json.dumps(CONTENT).encode())
+    assert decode_message(message) == CONTENT  # type: ignore[arg-type]
+    invalid = mocker.Mock(body_type=AmqpMessageBodyType.DATA, body=[b'Not JSON'], sequence_number=1)
+    assert decode_message(invalid) == {}
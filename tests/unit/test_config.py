@@ -97,7 +97,7 @@ def test_worker_type_is_not_valid():
             invalid_settings = Settings()
             invalid_settings.validate()
 
-        assert str(e.value) == "Worker type must be 'celery' or 'rq'"
+        assert str(e.value) == "Worker type must be 'celery', 'rq' or 'inline'"
 
 
 def test_worker_type_is_celery_not_installed():
@@ -323,6 +323,64 @@ def test_subject_is_not_str_exception():
         assert str(e.value) == f'Handler subject {subject} for {topic_name} must be a string'
 
 
+@pytest.mark.parametrize(
+    'handler, error',
+    [
+        ({'wildcard': 'yes'}, 'wildcard for handler subject Test/** must be a boolean'),
+        ({'wildcard': True, 'regex': True}, 'Handler subject Test/** can not be both a regex and a wildcard'),
+        (
+            {'subject': 'Test/Type*', 'wildcard': True},
+            'Provided wildcard subject: Test/Type* is invalid. * and ** must be whole segments.',
+        ),
+        ({'batch': 1}, 'batch for handler subject Test/** must be a boolean'),
+        ({'batch_size': 0}, 'batch_size for handler subject Test/** must be a positive integer'),
+        ({'batch_max_delay': -1}, 'batch_max_delay for handler subject Test/** must be a number of seconds'),
+    ],
+)
+def test_invalid_handler_options(handler, error):
+    """
+    Provides invalid wildcard and batch handler options, and checks if the correct exception is thrown.
+    """
+    with override_settings(
+        METROID={
+            'subscriptions': [
+                {
+                    'topic_name': 'test',
+                    'subscription_name': 'coolest/sub/ever',
+                    'connection_string': 'Endpoint=sb://cool',
+                    'handlers': [{'subject': 'Test/**', **handler}],
+                }
+            ]
+        }
+    ):
+        with pytest.raises(ImproperlyConfigured) as e:
+            Settings().validate()
+        assert str(e.value) == error
+
+
+@pytest.mark.parametrize('options', [{'sessions': True}, {'ordering_key': 'data.id'}])
+def test_batch_handlers_on_ordered_subscription(options):
+    """
+    Provides a batch handler on a subscription that enqueues in order, and checks if the correct exception is thrown.
+    """
+    with override_settings(
+        METROID={
+            'subscriptions': [
+                {
+                    'topic_name': 'test',
+                    'subscription_name': 'coolest/sub/ever',
+                    'connection_string': 'Endpoint=sb://cool',
+                    'handlers': [{'subject': 'Test/**', 'batch': True}],
+                    **options,
+                }
+            ]
+        }
+    ):
+        with pytest.raises(ImproperlyConfigured) as e:
+            Settings().validate()
+        assert str(e.value) == 'Handler subject Test/** can not be a batch handler, as test enqueues in order'
+
+
 def test_handler_function_is_not_str_exception():
     """
     Provides handler_function in an invalid format, and checks if the correct exception is thrown.
@@ -456,3 +514,76 @@ def test_no_exception_is_thrown():
             mock_settings.validate()
     except Exception as e:
         pytest.fail('Settings validation should not throw an exception with correct mock data')
+
+
+@pytest.mark.parametrize(
+    'options, error',
+    [
+        ({'batch_receive': 'yes'}, 'batch_receive for test must be a boolean'),
+        ({'max_batch_size': 0}, 'max_batch_size for test must be a positive integer'),
+        ({'max_wait_time': '5'}, 'max_wait_time for test must be a positive number'),
+        ({'receivers': 0}, 'receivers for test must be a positive integer'),
+        ({'prefetch_count': -1}, 'prefetch_count for test must be a non-negative integer'),
+        ({'transport_type': 'tcp'}, "transport_type for test must be 'amqp' or 'websocket'"),
+        ({'max_lock_renewal_duration': -1}, 'max_lock_renewal_duration for test must be a number of seconds'),
+        ({'ordering_key': 'data..id'}, "ordering_key for test must be a dotted path, such as 'data.id'"),
+        ({'ordering_lanes': 0}, 'ordering_lanes for test must be a positive integer'),
+    ],
+)
+def test_invalid_batch_receive_options(options, error):
+    """
+    Provides invalid batch receive options, and checks if the correct exception is thrown.
+    """
+    with override_settings(
+        METROID={
+            'subscriptions': [
+                {
+                    'topic_name': 'test',
+                    'subscription_name': 'sub-test-djangomoduletest',
+                    'connection_string': 'Endpoint=sb://cool',
+                    'handlers': [],
+                    **options,
+                }
+            ],
+            'worker_type': 'rq',
+        },
+    ):
+        with pytest.raises(ImproperlyConfigured) as e:
+            Settings().validate()
+        assert str(e.value) == error
+
+
+@pytest.mark.parametrize(
+    'options, error',
+    [
+        ({'enqueue_threads': 0}, 'enqueue_threads must be a positive integer'),
+        ({'metrics_interval': -1}, 'metrics_interval must be a number of seconds'),
+        ({'codec': 'pickle'}, "Codec must be one of 'json', 'orjson', 'msgspec'"),
+        ({'max_restarts': -1}, 'max_restarts must be a non-negative integer'),
+        ({'dedup_ttl': '600'}, 'dedup_ttl must be a number of seconds'),
+        ({'dedup_max_size': 0}, 'dedup_max_size must be a positive integer'),
+        ({'backpressure_high_watermark': 0}, 'backpressure_high_watermark must be a positive integer'),
+        (
+            {'backpressure_high_watermark': 100, 'backpressure_low_watermark': 100},
+            'backpressure_low_watermark must be a non-negative integer below backpressure_high_watermark',
+        ),
+        ({'restart_backoff': '1'}, 'restart_backoff must be a number of seconds'),
+        (
+            {'backend': 'demoproj.backends.MissingBackend'},
+            'Backend demoproj.backends.MissingBackend cannot be imported',
+        ),
+        (
+            {'backend': 'demoproj.tasks.my_task'},
+            'Backend demoproj.tasks.my_task must be a subclass of metroid.backends.Backend',
+        ),
+        ({'backend': 'metroid.backends.Backend'}, 'Backend metroid.backends.Backend must implement enqueue'),
+    ],
+)
+def test_invalid_process_options(options, error):
+    """
+    Provides invalid process wide options, and checks if the correct exception is thrown.
+    """
+    with override_settings(METROID={'subscriptions': [], 'worker_type': 'rq', **options}):
+        with pytest.raises(ImproperlyConfigured) as e:
+            Settings().validate()
+        assert str(e.value) == error
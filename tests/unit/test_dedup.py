@@ -0,0 +1,77 @@
+import pytest
+from redislite import Redis
+
+from metroid.dedup import Claim, DedupCache, RedisDedupCache
+
+
+@pytest.mark.asyncio
+async def test_claim_release_and_expiry(mocker):
+    """
+    Tests that a key can be claimed once until it expires or is released, and is in flight until it is done
+    """
+    now = mocker.patch('metroid.dedup.time.monotonic', return_value=100)
+    cache = DedupCache(ttl=60, in_flight_ttl=10)
+    assert await cache.claim('a') is Claim.CLAIMED
+    assert await cache.claim('a') is Claim.IN_FLIGHT
+    await cache.release('a')
+    assert await cache.claim('a') is Claim.CLAIMED
+    now.return_value = 110
+    assert await cache.claim('a') is Claim.CLAIMED  # A claim left in flight expires sooner
+    await cache.complete('a')
+    assert await cache.claim('a') is Claim.DONE
+    now.return_value = 170
+    assert await cache.claim('a') is Claim.CLAIMED
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_keys_are_forgotten():
+    """
+    Tests that the cache holds at most `max_size` keys, forgetting the least recently used first
+    """
+    cache = DedupCache(ttl=60, max_size=2)
+    assert await cache.claim('a') is Claim.CLAIMED
+    assert await cache.claim('b') is Claim.CLAIMED
+    assert await cache.claim('a') is Claim.IN_FLIGHT  # Used again, so 'b' is now the least recently used
+    assert await cache.claim('c') is Claim.CLAIMED
+    assert await cache.claim('a') is Claim.IN_FLIGHT
+    assert await cache.claim('b') is Claim.CLAIMED
+
+
+@pytest.mark.asyncio
+async def test_redis_claims_are_shared():
+    """
+    Tests that a key claimed by one process is in flight in another until it is done, and free again once released
+    """
+    server = Redis('/tmp/test_dedup.rdb')
+    url = f'unix://{server.socket_file}'
+    first, second, third = (RedisDedupCache(url=url, ttl=60) for _ in range(3))
+    try:
+        await first.redis.delete('metroid:dedup:a', 'metroid:dedup:b')
+        assert await first.claim('a') is Claim.CLAIMED
+        assert await second.claim('a') is Claim.IN_FLIGHT
+        await first.release('a')
+        assert await third.claim('a') is Claim.CLAIMED
+
+        assert await first.claim('b') is Claim.CLAIMED
+        assert await second.claim('b') is Claim.IN_FLIGHT
+        await first.complete('b')
+        assert await second.claim('b') is Claim.DONE
+        assert await third.redis.ttl('metroid:dedup:b') > 30
+    finally:
+        for cache in (first, second, third):
+            await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_fall_back_to_memory(mocker, caplog):
+    """
+    Tests that messages are not held up when Redis is down
+    """
+    cache = RedisDedupCache(url='redis://localhost:1/0', ttl=60)
+    mocker.patch.object(cache.redis, 'set', side_effect=ConnectionError('Mocked Redis error'))
+    assert await cache.claim('a') is Claim.CLAIMED
+    assert await cache.claim('a') is Claim.IN_FLIGHT
+    assert 'Unable to claim a in Redis, deduplicating in memory only. Error: Mocked Redis error' in caplog.messages
+    await cache.complete('a')
+    assert await cache.claim('a') is Claim.DONE
+    assert 'Unable to mark a as done in Redis. Error: Mocked Redis error' in caplog.messages
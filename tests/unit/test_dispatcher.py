@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+
+from metroid.backends import Backend
+from metroid.dispatch import Dispatcher, MessageTask
+from metroid.metrics import SubscriptionMetrics
+
+
+def make_tasks(count: int) -> list[MessageTask]:
+    return [
+        MessageTask(
+            handler_function=lambda **kwargs: None,
+            message={'id': str(i)},
+            topic_name='test',
+            subscription_name='sub-test',
+            subject='Test/Django/Module',
+        )
+        for i in range(count)
+    ]
+
+
+class RecordingBackend(Backend):
+    """
+    Records the tasks of every flush, instead of enqueueing them
+    """
+
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+        self.closed = False
+
+    def enqueue(self, task: MessageTask) -> None:
+        self.enqueue_many([task])
+
+    def enqueue_many(self, tasks: list[MessageTask]) -> None:
+        time.sleep(0.05)
+        self.batches.append([task.message['id'] for task in tasks])
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FailingBackend(Backend):
+    def enqueue(self, task: MessageTask) -> None:
+        raise ConnectionError('Mocked broker error')
+
+
+@pytest.fixture
+def backend():
+    return RecordingBackend()
+
+
+@pytest.fixture
+def flushes(backend):
+    return backend.batches
+
+
+@pytest.fixture
+def make_dispatcher(backend):
+    def make(**kwargs) -> Dispatcher:
+        kwargs.setdefault('backend', backend)
+        return Dispatcher(metrics=SubscriptionMetrics(topic_name='test', subscription_name='sub-test'), **kwargs)
+
+    return make
+
+
+@pytest.mark.asyncio
+async def test_tasks_dispatched_during_a_flush_are_grouped(flushes, make_dispatcher, backend) -> None:
+    """
+    Tests that the first tasks are flushed right away, and that tasks dispatched meanwhile are flushed together.
+    """
+    dispatcher = make_dispatcher()
+    tasks = make_tasks(4)
+    first = asyncio.create_task(dispatcher.dispatch(tasks[:1]))
+    await asyncio.sleep(0.01)  # The first flush is running
+    await asyncio.gather(first, *(dispatcher.dispatch([task]) for task in tasks[1:]))
+    await dispatcher.close()
+    assert flushes == [['0'], ['1', '2', '3']]
+    assert dispatcher.metrics.counters == {'dispatch_flushes': 2, 'tasks_enqueued': 4}
+    assert backend.closed
+
+
+@pytest.mark.asyncio
+async def test_flushes_are_capped_at_batch_size(flushes, make_dispatcher) -> None:
+    """
+    Tests that no flush holds more than `batch_size` tasks, unless one message has more tasks than that.
+    """
+    dispatcher = make_dispatcher(batch_size=2)
+    tasks = make_tasks(6)
+    await asyncio.gather(
+        dispatcher.dispatch(tasks[:1]), dispatcher.dispatch(tasks[1:4]), dispatcher.dispatch(tasks[4:])
+    )
+    await dispatcher.close()
+    assert flushes == [['0'], ['1', '2', '3'], ['4', '5']]
+
+
+@pytest.mark.asyncio
+async def test_max_delay_waits_for_more_tasks(flushes, make_dispatcher) -> None:
+    """
+    Tests that with a max delay, tasks are buffered until the batch is full.
+    """
+    dispatcher = make_dispatcher(batch_size=3, max_delay=5)
+    tasks = make_tasks(3)
+    await asyncio.wait_for(asyncio.gather(*(dispatcher.dispatch([task]) for task in tasks)), timeout=1)
+    assert flushes == [['0', '1', '2']]
+
+    # A lone task is flushed once the delay has passed
+    dispatcher.max_delay = 0.1
+    await asyncio.wait_for(dispatcher.dispatch(make_tasks(1)), timeout=1)
+    await dispatcher.close()
+    assert flushes == [['0', '1', '2'], ['0']]
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_raises_for_every_caller(make_dispatcher) -> None:
+    """
+    Tests that every message in a failed flush gets the error, so none of them are settled.
+    """
+    dispatcher = make_dispatcher(batch_size=2, max_delay=5, backend=FailingBackend())
+    results = await asyncio.gather(*(dispatcher.dispatch([task]) for task in make_tasks(2)), return_exceptions=True)
+    await dispatcher.close()
+    assert [str(result) for result in results] == ['Mocked broker error', 'Mocked broker error']
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from unittest.mock import AsyncMock
+
+import pytest
+
+from metroid.subscribe import MessageProcessor, receive
+
+from .test_message_processor import HANDLERS, Message
+
+
+class Receiver:
+    """
+    Hands out one message, holds one prefetched message, and then waits for messages forever
+    """
+
+    def __init__(self) -> None:
+        self.complete_message = AsyncMock()
+        self.abandon_message = AsyncMock()
+        self.messages = [Message(1, {'id': 'abc', 'subject': 'Test/Django/Module'})]
+        self.prefetched = [Message(2, {'id': 'def', 'subject': 'Test/Django/Module'})]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def receive_messages(self, max_message_count, max_wait_time):
+        prefetched, self.prefetched = self.prefetched, []
+        return prefetched
+
+
+def make_processor(mocker, enqueue_time: float) -> MessageProcessor:
+    async def dispatch(tasks):
+        await asyncio.sleep(enqueue_time)
+
+    mocker.patch('metroid.subscribe.Dispatcher.dispatch', side_effect=dispatch)
+    return MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=HANDLERS)
+
+
+async def stop_receiving(receiver: Receiver, processor: MessageProcessor, *, shutdown_timeout: float) -> None:
+    stopping = asyncio.Event()
+    receiving = asyncio.create_task(
+        receive(
+            receiver,
+            processor,
+            batch_receive=False,
+            max_batch_size=1,
+            max_wait_time=1,
+            max_concurrency=1,
+            prefetch_count=1,
+            stopping=stopping,
+            shutdown_timeout=shutdown_timeout,
+        )
+    )
+    await asyncio.sleep(0.05)  # The first message is being processed
+    stopping.set()
+    await asyncio.wait_for(receiving, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_stopping_settles_in_flight_and_abandons_prefetched_messages(mocker) -> None:
+    """
+    Tests that a stopped receiver completes the message being processed, and abandons the prefetched one at once
+    """
+    receiver = Receiver()
+    processor = make_processor(mocker, enqueue_time=0.1)
+    await stop_receiving(receiver, processor, shutdown_timeout=1)
+    receiver.complete_message.assert_awaited_once()
+    assert receiver.complete_message.await_args.kwargs['message'].sequence_number == 1
+    receiver.abandon_message.assert_awaited_once()
+    assert receiver.abandon_message.await_args.kwargs['message'].sequence_number == 2
+    assert processor.metrics.counters['messages_released'] == 1
+
+
+@pytest.mark.asyncio
+async def test_stopping_cancels_messages_after_the_timeout(mocker, caplog) -> None:
+    """
+    Tests that messages that are not settled within the shutdown timeout are cancelled
+    """
+    caplog.set_level(logging.WARNING)
+    receiver = Receiver()
+    processor = make_processor(mocker, enqueue_time=10)
+    await stop_receiving(receiver, processor, shutdown_timeout=0.05)
+    receiver.complete_message.assert_not_awaited()
+    assert 'sub-test: Messages were not settled within 0.05 seconds, cancelling them' in caplog.messages
@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import json
+import re
+from unittest.mock import AsyncMock
+
+import pytest
+from azure.servicebus.amqp import AmqpMessageBodyType
+
+from metroid.dedup import DedupCache
+from metroid.dispatch import build_tasks
+from metroid.routing import Router
+from metroid.subscribe import MessageProcessor, peek_subjects
+
+HANDLERS = [
+    {'subject': 'Test/Django/Module', 'regex': False, 'handler_function': 'demoproj.tasks.my_task'},
+    {'subject': r'^Test/.*$', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+]
+
+
+class Message:
+    body_type = AmqpMessageBodyType.DATA
+
+    def __init__(self, sequence_number: int, content: dict) -> None:
+        self.sequence_number = sequence_number
+        self.message_id = f'sb-{sequence_number}'
+        self.body = [json.dumps(content).encode()]
+
+
+@pytest.fixture
+def dispatched(mocker):
+    """
+    Records the tasks of every dispatch, instead of enqueueing them
+    """
+    calls = []
+
+    async def dispatch(tasks):
+        calls.append(tasks)
+        if any(message.get('id') == 'broken' for task in tasks for message in task.messages):
+            raise ConnectionError('Mocked broker error')
+
+    mocker.patch('metroid.subscribe.Dispatcher.dispatch', side_effect=dispatch)
+    return calls
+
+
+def make_processor() -> MessageProcessor:
+    return MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=HANDLERS)
+
+
+def test_fan_out_job_ids() -> None:
+    """
+    Tests that only the first matching handler gets the message ID as job ID
+    """
+    routes = Router(HANDLERS).match('Test/Django/Module')
+    tasks = build_tasks(routes, message={'id': 'abc'}, topic_name='test', subscription_name='sub-test')
+    assert [task.job_id for task in tasks] == ['abc', 'abc-4c75d52f']
+    # RQ only accepts letters, digits, `_` and `-` in job IDs
+    assert all(re.fullmatch(r'[\w-]+', task.job_id) for task in tasks)
+    tasks = build_tasks(routes, message={}, topic_name='test', subscription_name='sub-test')
+    assert [task.job_id for task in tasks] == [None, None]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_is_dispatched_together_and_settled_once(dispatched) -> None:
+    """
+    Tests that all matching handlers are enqueued in one dispatch, and that the message is completed once
+    """
+    receiver = AsyncMock()
+    message = Message(1, {'id': 'abc', 'subject': 'Test/Django/Module'})
+    await make_processor().process(receiver, [message])
+    assert len(dispatched) == 1
+    assert [task.subject for task in dispatched[0]] == ['Test/Django/Module', r'^Test/.*$']
+    receiver.complete_message.assert_awaited_once_with(message=message)
+    receiver.abandon_message.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_failed_enqueue_abandons_only_that_message(dispatched) -> None:
+    """
+    Tests that a message whose tasks could not be enqueued is abandoned, while the other messages are completed
+    """
+    receiver = AsyncMock()
+    broken = Message(1, {'id': 'broken', 'subject': 'Test/Django/Module'})
+    working = Message(2, {'id': 'abc', 'subject': 'Test/Django/Module'})
+    unmatched = Message(3, {'id': 'def', 'subject': 'Ignore me'})
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await make_processor().process(receiver, [broken, working, unmatched])
+    receiver.abandon_message.assert_awaited_once_with(message=broken)
+    assert receiver.complete_message.await_count == 2
+    receiver.complete_message.assert_any_await(message=working)
+    receiver.complete_message.assert_any_await(message=unmatched)
+
+
+@pytest.mark.parametrize(
+    'body, subjects',
+    [
+        (b'{"id": "abc", "subject": "Test/Django/Module"}', ['Test/Django/Module']),
+        (b'{"data": {"subject": "Nested"}, "subject" : "Test/\\u00e6"}', ['Nested', 'Test/\u00e6']),
+        (b'{"data": "\\"subject\\": \\"Escaped\\""}', None),
+        (b'{"subject": null}', None),
+        ('{"subject": "Not bytes"}', None),
+        (b'{"subject": "bad\\x"}', None),
+        (b'{"subject": "\xff"}', None),
+    ],
+)
+def test_peek_subjects(body, subjects) -> None:
+    """
+    Tests that subjects are found in message bodies without decoding them
+    """
+    assert peek_subjects(body) == subjects
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('body', [b'{"subject": "bad\\x"}', b'{"subject": "\xff"}'])
+async def test_undecodable_subject_is_completed(dispatched, body, caplog) -> None:
+    """
+    Tests that a message whose subject can't be read is completed as a message that can't be decoded
+    """
+    receiver = AsyncMock()
+    message = Message(1, {})
+    message.body = [body]
+    await make_processor().process(receiver, [message])
+    receiver.complete_message.assert_awaited_once_with(message=message)
+    assert dispatched == []
+    assert any(record.startswith('Unable to decode message') for record in caplog.messages)
+
+
+@pytest.mark.asyncio
+async def test_unmatched_message_is_not_decoded(dispatched, mocker) -> None:
+    """
+    Tests that a message no handler wants is completed without being decoded
+    """
+    decode_message = mocker.patch('metroid.subscribe.decode_message')
+    receiver = AsyncMock()
+    message = Message(1, {'id': 'abc', 'data': {'subject': 'Other'}, 'subject': 'Ignore me'})
+    await make_processor().process(receiver, [message])
+    decode_message.assert_not_called()
+    receiver.complete_message.assert_awaited_once_with(message=message)
+    assert dispatched == []
+
+
+@pytest.mark.asyncio
+async def test_redelivered_message_is_enqueued_once(dispatched) -> None:
+    """
+    Tests that a redelivered message is completed without being enqueued again, unless enqueueing it failed
+    """
+    receiver = AsyncMock()
+    processor = make_processor()
+    processor.dedup = DedupCache(ttl=60)
+    await processor.process(receiver, [Message(1, {'id': 'abc', 'subject': 'Test/Django/Module'})])
+    await processor.process(receiver, [Message(2, {'id': 'abc', 'subject': 'Test/Django/Module'})])
+    assert len(dispatched) == 1
+    assert receiver.complete_message.await_count == 2
+    assert processor.metrics.counters['messages_duplicate'] == 1
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError, match='Mocked broker error'):
+            await processor.process(receiver, [Message(3, {'id': 'broken', 'subject': 'Test/Django/Module'})])
+    assert len(dispatched) == 3
+    assert receiver.abandon_message.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_enqueue_releases_the_message(slow_dispatched) -> None:
+    """
+    Tests that a message whose enqueue was cancelled, such as when a subscription is drained, is enqueued again when
+    it is redelivered, instead of being completed as a duplicate
+    """
+    receiver = AsyncMock()
+    processor = make_processor()
+    processor.dedup = DedupCache(ttl=60)
+    in_flight = asyncio.create_task(processor.process(receiver, [Message(1, {'id': 'slow', 'subject': 'Test/A'})]))
+    await asyncio.sleep(0.01)
+    in_flight.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await in_flight
+    receiver.complete_message.assert_not_awaited()
+
+    await processor.process(receiver, [Message(2, {'id': 'slow', 'subject': 'Test/A'})])
+    assert slow_dispatched == ['slow']
+    receiver.complete_message.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_redelivery_of_message_in_flight_is_left_unsettled(slow_dispatched) -> None:
+    """
+    Tests that a message redelivered while it is still being enqueued is neither completed nor abandoned, so it is
+    not lost when that enqueue fails
+    """
+    first, second = AsyncMock(), AsyncMock()
+    processor = make_processor()
+    processor.dedup = DedupCache(ttl=60)
+    in_flight = asyncio.create_task(processor.process(first, [Message(1, {'id': 'broken', 'subject': 'Test/A'})]))
+    await asyncio.sleep(0.01)
+    await processor.process(second, [Message(1, {'id': 'broken', 'subject': 'Test/A'})])
+    second.complete_message.assert_not_awaited()
+    second.abandon_message.assert_not_awaited()
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await in_flight
+    first.abandon_message.assert_awaited_once()
+
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await processor.process(second, [Message(1, {'id': 'broken', 'subject': 'Test/A'})])
+    assert slow_dispatched == ['broken', 'broken']
+
+
+@pytest.mark.asyncio
+async def test_lock_renewal_metrics(mocker, caplog) -> None:
+    """
+    Tests that messages whose lock was renewed while they were enqueued are counted, and so are lost locks
+    """
+    message = Message(1, {'id': 'abc', 'subject': 'Test/Django/Module'})
+    message.locked_until_utc = datetime.datetime(2024, 1, 1, 12, 0)
+
+    async def slow_dispatch(tasks):
+        message.locked_until_utc += datetime.timedelta(seconds=30)
+
+    mocker.patch('metroid.subscribe.Dispatcher.dispatch', side_effect=slow_dispatch)
+    processor = MessageProcessor(
+        topic_name='test', subscription_name='sub-test', handlers=HANDLERS, max_lock_renewal_duration=60
+    )
+    receiver = AsyncMock()
+    await processor.process(receiver, [message])
+    await processor._lock_lost(message, ConnectionError('Mocked lock error'))
+    await processor.close()
+    assert processor.metrics.counters['messages_lock_renewed'] == 1
+    assert processor.metrics.counters['locks_lost'] == 1
+    assert 'sub-test: Lost the lock of message with sequence number 1. Error: Mocked lock error' in caplog.messages
+
+
+@pytest.mark.asyncio
+async def test_ordered_failure_abandons_later_messages(dispatched) -> None:
+    """
+    Tests that when a message of an ordered batch can't be enqueued, the messages after it are abandoned too
+    """
+    receiver = AsyncMock()
+    messages = [
+        Message(1, {'id': 'abc', 'subject': 'Test/Django/Module'}),
+        Message(2, {'id': 'broken', 'subject': 'Test/Django/Module'}),
+        Message(3, {'id': 'def', 'subject': 'Test/Django/Module'}),
+    ]
+    processor = MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=HANDLERS, ordered=True)
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await processor.process(receiver, messages)
+    receiver.complete_message.assert_awaited_once_with(message=messages[0])
+    assert [call.kwargs['message'] for call in receiver.abandon_message.await_args_list] == messages[1:]
+    assert len(dispatched) == 2
+
+
+def keyed_message(sequence_number: int, message_id: str, key: str) -> Message:
+    return Message(sequence_number, {'id': message_id, 'subject': 'Test/Django/Module', 'data': {'id': key}})
+
+
+@pytest.fixture
+def slow_dispatched(mocker):
+    """
+    Records the IDs of the messages enqueued, in the order their dispatches finish. Messages with the ID 'slow' or
+    'broken' take a while to enqueue, and 'broken' fails.
+    """
+    enqueued = []
+
+    async def dispatch(tasks):
+        message_id = tasks[0].message['id']
+        if message_id in ('slow', 'broken'):
+            await asyncio.sleep(0.05)
+        enqueued.append(message_id)
+        if message_id == 'broken':
+            raise ConnectionError('Mocked broker error')
+
+    mocker.patch('metroid.subscribe.Dispatcher.dispatch', side_effect=dispatch)
+    return enqueued
+
+
+def make_keyed_processor() -> MessageProcessor:
+    return MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=HANDLERS, ordering_key='data.id')
+
+
+@pytest.mark.asyncio
+async def test_ordering_key_keeps_order_per_key(slow_dispatched) -> None:
+    """
+    Tests that messages with the same ordering key are enqueued in order, while other keys don't wait for them
+    """
+    receiver = AsyncMock()
+    messages = [keyed_message(1, 'slow', 'A'), keyed_message(2, 'after-slow', 'A'), keyed_message(3, 'other', 'B')]
+    await make_keyed_processor().process(receiver, messages)
+    assert slow_dispatched == ['other', 'slow', 'after-slow']
+    assert receiver.complete_message.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_ordering_key_failure_abandons_later_messages_with_that_key(slow_dispatched) -> None:
+    """
+    Tests that when a message can't be enqueued, the messages waiting behind it in its lane are abandoned
+    """
+    receiver = AsyncMock()
+    processor = make_keyed_processor()
+    abandoned = processor.metrics.counters.get('messages_abandoned', 0)
+    broken, behind, other = keyed_message(1, 'broken', 'A'), keyed_message(2, 'abc', 'A'), keyed_message(3, 'def', 'B')
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await processor.process(receiver, [broken, behind, other])
+    assert slow_dispatched == ['def', 'broken']
+    assert [call.kwargs['message'] for call in receiver.abandon_message.await_args_list] == [broken, behind]
+    receiver.complete_message.assert_awaited_once_with(message=other)
+    assert processor.metrics.counters['messages_abandoned'] - abandoned == 2
+
+    # The lane is usable again once the messages behind the failure have left it
+    await processor.process(receiver, [keyed_message(4, 'ghi', 'A')])
+    assert slow_dispatched[-1] == 'ghi'
+
+
+BATCH_HANDLERS = [
+    {
+        'subject': 'Test/Django/Module',
+        'regex': False,
+        'batch': True,
+        'batch_size': 2,
+        'batch_max_delay': 0.01,
+        'handler_function': 'demoproj.tasks.example_batch_task',
+    },
+    {'subject': r'^Test/.*$', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+]
+
+
+@pytest.mark.asyncio
+async def test_batch_handler_gets_messages_in_batches(dispatched) -> None:
+    """
+    Tests that a batch handler gets one task per batch, of up to `batch_size` messages or whatever has arrived after
+    `batch_max_delay`, while other handlers get one task per message
+    """
+    receiver = AsyncMock()
+    processor = MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=BATCH_HANDLERS)
+    messages = [Message(number, {'id': str(number), 'subject': 'Test/Django/Module'}) for number in range(3)]
+    await processor.process(receiver, messages)
+    batches = [task.kwargs['messages'] for tasks in dispatched for task in tasks if task.batch]
+    assert batches == [
+        [{'id': '0', 'subject': 'Test/Django/Module'}, {'id': '1', 'subject': 'Test/Django/Module'}],
+        [{'id': '2', 'subject': 'Test/Django/Module'}],
+    ]
+    assert sum(not task.batch for tasks in dispatched for task in tasks) == 3
+    assert receiver.complete_message.await_count == 3
+    await processor.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_is_enqueued_once_no_other_message_can_join_it(dispatched) -> None:
+    """
+    Tests that a batch is enqueued without waiting out `batch_max_delay` once every message being processed is in it,
+    such as a message received on its own
+    """
+    receiver = AsyncMock()
+    handlers = [{**BATCH_HANDLERS[0], 'batch_size': 10, 'batch_max_delay': 60}]
+    processor = MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=handlers)
+    messages = [Message(number, {'id': str(number), 'subject': 'Test/Django/Module'}) for number in range(4)]
+    await asyncio.wait_for(processor.process(receiver, messages[:1]), timeout=1)
+    await asyncio.wait_for(processor.process(receiver, messages[1:]), timeout=1)
+    batches = [[message['id'] for message in task.kwargs['messages']] for tasks in dispatched for task in tasks]
+    assert batches == [['0'], ['1', '2', '3']]
+    assert receiver.complete_message.await_count == 4
+    await processor.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_abandons_its_messages(dispatched) -> None:
+    """
+    Tests that every message of a batch that could not be enqueued is abandoned
+    """
+    receiver = AsyncMock()
+    processor = MessageProcessor(topic_name='test', subscription_name='sub-test', handlers=BATCH_HANDLERS[:1])
+    messages = [
+        Message(1, {'id': 'broken', 'subject': 'Test/Django/Module'}),
+        Message(2, {'id': 'abc', 'subject': 'Test/Django/Module'}),
+    ]
+    with pytest.raises(ConnectionError, match='Mocked broker error'):
+        await processor.process(receiver, messages)
+    assert [call.kwargs['message'] for call in receiver.abandon_message.await_args_list] == messages
+    receiver.complete_message.assert_not_awaited()
+    await processor.close()
+
+
+def test_retried_batch_message_is_a_batch_of_one() -> None:
+    """
+    Tests that a failed message of a batch handler is retried as a batch holding just that message
+    """
+    routes = Router(BATCH_HANDLERS).match('Test/Django/Module')
+    tasks = build_tasks(routes, message={'id': 'abc'}, topic_name='test', subscription_name='sub-test')
+    assert tasks[0].kwargs['messages'] == [{'id': 'abc'}]
+    assert [task.job_id for task in tasks] == ['abc', 'abc-4c75d52f']
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from metroid.dispatch import run_in_enqueue_executor
+from metroid.metrics import SubscriptionMetrics, get_metrics, merge_snapshots, snapshot
+
+
+def test_counters_and_timings() -> None:
+    """
+    Tests that counters add up, and that timings keep count, average and max.
+    """
+    metrics = SubscriptionMetrics(topic_name='test', subscription_name='sub-test')
+    metrics.increment('messages_received')
+    metrics.increment('messages_received', 2)
+    metrics.observe('enqueue_time', 1.0)
+    metrics.observe('enqueue_time', 3.0)
+    assert metrics.snapshot() == {
+        'messages_received': 3,
+        'enqueue_time': {'count': 2, 'avg': 2.0, 'max': 3.0},
+    }
+
+
+def test_registry_returns_same_metrics() -> None:
+    """
+    Tests that metrics are kept per subscription.
+    """
+    metrics = get_metrics(topic_name='registry-test', subscription_name='sub-test')
+    assert get_metrics(topic_name='registry-test', subscription_name='sub-test') is metrics
+    metrics.increment('messages_received')
+    assert snapshot()['registry-test/sub-test']['messages_received'] >= 1
+
+
+@pytest.mark.asyncio
+async def test_run_in_enqueue_executor() -> None:
+    """
+    Tests that broker calls run in the enqueue thread pool, and that the queue wait time is recorded.
+    """
+    metrics = SubscriptionMetrics(topic_name='test', subscription_name='sub-test')
+    thread_name = await run_in_enqueue_executor(lambda: threading.current_thread().name, metrics=metrics)
+    assert thread_name.startswith('metroid-enqueue')
+    assert metrics.timings['enqueue_queue_wait'].count == 1
+    assert metrics.timings['enqueue_time'].count == 1
+
+
+def test_merge_snapshots() -> None:
+    """
+    Tests that counters of several processes are added up, and timings combined.
+    """
+    merged = merge_snapshots(
+        [
+            {'test/sub': {'messages_received': 1, 'enqueue_time': {'count': 1, 'avg': 1.0, 'max': 1.0}}},
+            {'test/sub': {'messages_received': 2, 'enqueue_time': {'count': 3, 'avg': 3.0, 'max': 5.0}}},
+            {'test/other': {'messages_received': 4}},
+        ]
+    )
+    assert merged == {
+        'test/sub': {'messages_received': 3, 'enqueue_time': {'count': 4, 'avg': 2.5, 'max': 5.0}},
+        'test/other': {'messages_received': 4},
+    }
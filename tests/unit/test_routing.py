@@ -0,0 +1,152 @@
+from django.core.exceptions import ImproperlyConfigured
+
+import pytest
+from demoproj.tasks import example_rq_task, my_task
+
+from metroid.routing import Router, SubjectTrie
+
+
+def test_exact_and_regex_routes_keep_handler_order() -> None:
+    """
+    Tests that a subject matching several handlers returns them in the order they are configured.
+    """
+    router = Router(
+        [
+            {'subject': r'^MetroDemo/.*', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+            {'subject': 'MetroDemo/Type/Created', 'regex': False, 'handler_function': 'demoproj.tasks.example_rq_task'},
+            {'subject': r'^MetroDemo/Type/.*', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+        ]
+    )
+    routes = router.match('MetroDemo/Type/Created')
+    assert [route.index for route in routes] == [0, 1, 2]
+    assert [route.handler_function for route in routes] == [my_task, example_rq_task, my_task]
+
+
+def test_unmatched_subject_returns_no_routes() -> None:
+    """
+    Tests that a subject no handler wants is rejected by the combined pattern.
+    """
+    router = Router(
+        [
+            {'subject': r'^MetroDemo/Type/.*', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+            {'subject': r'^Other/.*', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+        ]
+    )
+    assert router.combined_pattern is not None
+    assert router.match('Something/Else') == []
+    assert [route.subject for route in router.match('Other/Thing')] == [r'^Other/.*']
+
+
+def test_regex_is_optional() -> None:
+    """
+    Tests that handlers without the `regex` key are matched as exact strings.
+    """
+    router = Router([{'subject': 'Test/Django/Module', 'handler_function': 'demoproj.tasks.my_task'}])
+    assert len(router.match('Test/Django/Module')) == 1
+    assert router.match('Test/Django') == []
+
+
+def test_back_references_are_not_combined() -> None:
+    """
+    Tests that patterns with back references are matched one by one, as their meaning changes when combined.
+    """
+    router = Router(
+        [
+            {'subject': r'^(a)\1$', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+            {'subject': r'^(b)\1$', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+        ]
+    )
+    assert router.combined_pattern is None
+    assert len(router.match('bb')) == 1
+
+
+def test_invalid_regex_raises() -> None:
+    """
+    Tests that an invalid regex fails when the routing table is built.
+    """
+    with pytest.raises(ImproperlyConfigured) as e:
+        Router([{'subject': 'tests/invalid[', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'}])
+    assert str(e.value) == 'Provided regex pattern: tests/invalid[ is invalid.'
+
+
+@pytest.mark.parametrize(
+    'subject, matches',
+    [
+        ('MetroDemo/Type/Created', [0, 1, 2, 3]),
+        ('MetroDemo/Joke/Created', [0, 1]),
+        ('MetroDemo/Type/Deleted', [0, 2]),
+        ('MetroDemo/Type', [0, 2]),
+        ('MetroDemo', [0]),
+        ('MetroDemo/Type/Created/Again', [0, 2]),
+        ('Other/Type/Created', []),
+        ('', []),
+    ],
+)
+def test_wildcard_routes(subject, matches) -> None:
+    """
+    Tests that `*` matches one segment and `**` any number of segments, in the order the handlers are configured.
+    """
+    router = Router(
+        [
+            {'subject': 'MetroDemo/**', 'regex': False, 'wildcard': True, 'handler_function': 'demoproj.tasks.my_task'},
+            {
+                'subject': 'MetroDemo/*/Created',
+                'regex': False,
+                'wildcard': True,
+                'handler_function': 'demoproj.tasks.my_task',
+            },
+            {
+                'subject': 'MetroDemo/Type/**',
+                'regex': False,
+                'wildcard': True,
+                'handler_function': 'demoproj.tasks.my_task',
+            },
+            {'subject': 'MetroDemo/Type/Created', 'regex': False, 'handler_function': 'demoproj.tasks.my_task'},
+        ]
+    )
+    assert [route.index for route in router.match(subject)] == matches
+
+
+def test_subject_trie_matches_whole_segments() -> None:
+    """
+    Tests that a wildcard subject matches whole segments only, and returns the values of every matching subject.
+    """
+    trie: SubjectTrie[str] = SubjectTrie()
+    trie.add('tests/*/haha/**', 'a')
+    trie.add('tests/**', 'b')
+    assert sorted(trie.match('tests/a/haha/b/c')) == ['a', 'b']
+    assert trie.match('tests/a/b/haha') == ['b']
+    assert trie.match('tests/ahaha') == ['b']
+    assert trie.match('other/a/haha') == []
+
+
+def test_wildcard_and_regex_routes_keep_handler_order() -> None:
+    """
+    Tests that exact, wildcard and regex routes are merged in the order the handlers are configured.
+    """
+    router = Router(
+        [
+            {'subject': r'^MetroDemo/.*', 'regex': True, 'handler_function': 'demoproj.tasks.my_task'},
+            {
+                'subject': 'MetroDemo/**/Created',
+                'regex': False,
+                'wildcard': True,
+                'handler_function': 'demoproj.tasks.my_task',
+            },
+            {'subject': 'MetroDemo/Type/Created', 'regex': False, 'handler_function': 'demoproj.tasks.my_task'},
+            {'subject': '**', 'regex': False, 'wildcard': True, 'handler_function': 'demoproj.tasks.my_task'},
+        ]
+    )
+    assert [route.index for route in router.match('MetroDemo/Type/Created')] == [0, 1, 2, 3]
+    assert [route.index for route in router.match('MetroDemo/Created')] == [0, 1, 3]
+
+
+def test_invalid_wildcard_raises() -> None:
+    """
+    Tests that wildcards within a segment fail when the routing table is built.
+    """
+    with pytest.raises(ImproperlyConfigured) as e:
+        Router(
+            [{'subject': 'tests/Type*', 'regex': False, 'wildcard': True, 'handler_function': 'demoproj.tasks.my_task'}]
+        )
+    assert str(e.value) == 'Provided wildcard subject: tests/Type* is invalid. * and ** must be whole segments.'
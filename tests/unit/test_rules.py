@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+
+import pytest
+from azure.servicebus.management import CorrelationRuleFilter, SqlRuleFilter, TrueRuleFilter
+
+from metroid.config import Settings
+from metroid.rules import get_rule_filters, get_subject_prefix, get_wildcard_pattern
+
+
+class FakeAdministrationClient:
+    """
+    Keeps the rules of every subscription in memory, like the Service Bus administration client
+    """
+
+    rules: dict[tuple[str, str], dict] = {}
+    calls: list[str] = []
+
+    @classmethod
+    def from_connection_string(cls, conn_str: str) -> 'FakeAdministrationClient':
+        return cls()
+
+    def __enter__(self) -> 'FakeAdministrationClient':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def list_rules(self, topic_name, subscription_name):
+        return [SimpleNamespace(name=name) for name in self.rules[topic_name, subscription_name]]
+
+    def create_rule(self, topic_name, subscription_name, rule_name, *, filter):
+        self.calls.append(f'create {rule_name}')
+        self.rules[topic_name, subscription_name][rule_name] = filter
+
+    def delete_rule(self, topic_name, subscription_name, rule_name):
+        if rule_name == 'metroid-denied':
+            raise PermissionError('Mocked missing Manage claim')
+        self.calls.append(f'delete {rule_name}')
+        del self.rules[topic_name, subscription_name][rule_name]
+
+
+@pytest.fixture
+def admin_client(mocker):
+    FakeAdministrationClient.rules = {('test', 'sub-test'): {'$Default': TrueRuleFilter(), 'custom': TrueRuleFilter()}}
+    FakeAdministrationClient.calls = []
+    mocker.patch('metroid.management.commands.metroid_rules.ServiceBusAdministrationClient', FakeAdministrationClient)
+    return FakeAdministrationClient
+
+
+def use_handlers(monkeypatch, handlers: list[dict]) -> None:
+    subscription = {
+        'topic_name': 'test',
+        'subscription_name': 'sub-test',
+        'connection_string': 'Endpoint=sb://cool',
+        'handlers': handlers,
+    }
+    with override_settings(METROID={'subscriptions': [subscription]}):
+        monkeypatch.setattr('metroid.management.commands.metroid_rules.settings', Settings())
+
+
+HANDLERS = [
+    {'subject': 'Test/Django/Module', 'regex': False, 'handler_function': 'demoproj.tasks.a_random_task'},
+    {'subject': r'^Test/Django/.*$', 'regex': True, 'handler_function': 'demoproj.tasks.a_random_task'},
+    {'subject': r'^Test/100%_sure\.$', 'regex': True, 'handler_function': 'demoproj.tasks.a_random_task'},
+]
+
+
+@pytest.mark.parametrize(
+    'subject, pattern',
+    [
+        ('Test/*/Created', 'Test/%/Created'),
+        ('Test/**', 'Test%'),
+        ('**/Created', '%Created'),
+        ('Test/**/*/Created', 'Test%%/Created'),
+        ('*/**', None),
+    ],
+)
+def test_get_wildcard_pattern(subject, pattern):
+    assert get_wildcard_pattern(subject) == pattern
+
+
+@pytest.mark.parametrize(
+    'pattern, prefix',
+    [
+        (r'^Test/.*$', ('Test/', False)),
+        (r'^Test/.*', ('Test/', False)),
+        (r'Test/', ('Test/', False)),
+        (r'^Test/Django/Module$', ('Test/Django/Module', True)),
+        (r'^Test/Version\.2\$$', ('Test/Version.2$', True)),
+        (r'^Test/.*/Created$', None),
+        (r'^Test/\d+$', None),
+        (r'^(Test|Prod)/', None),
+    ],
+)
+def test_get_subject_prefix(pattern, prefix):
+    assert get_subject_prefix(pattern) == prefix
+
+
+def test_rule_filters():
+    """
+    Tests that exact subjects become correlation filters, and literal regex prefixes SQL filters
+    """
+    filters = list(get_rule_filters(HANDLERS).values())
+    assert [type(rule_filter) for rule_filter in filters] == [
+        CorrelationRuleFilter,
+        SqlRuleFilter,
+        CorrelationRuleFilter,
+    ]
+    assert filters[0].label == 'Test/Django/Module'
+    assert filters[1].sql_expression == "sys.Label LIKE 'Test/Django/%' ESCAPE '!'"
+    assert filters[2].label == 'Test/100%_sure.'
+    (like_filter,) = get_rule_filters([{**HANDLERS[1], 'subject': r"^It's 100%_!"}]).values()
+    assert like_filter.sql_expression == "sys.Label LIKE 'It''s 100!%!_!!%' ESCAPE '!'"
+    (like_filter,) = get_rule_filters([{**HANDLERS[0], 'subject': 'Test/*/Created_', 'wildcard': True}]).values()
+    assert like_filter.sql_expression == "sys.Label LIKE 'Test/%/Created!_' ESCAPE '!'"
+    filters = get_rule_filters([*HANDLERS, {**HANDLERS[0], 'subject': ''}])
+    assert list(filters) == ['$Default']
+    assert isinstance(filters['$Default'], TrueRuleFilter)
+
+
+def test_command_syncs_rules(admin_client, monkeypatch, capsys):
+    """
+    Tests that the rules are created before the default rule is deleted, and that other rules are left alone
+    """
+    use_handlers(monkeypatch, HANDLERS[:2])
+    call_command('metroid_rules', '--dry-run')
+    assert 'Would delete rule $Default' in capsys.readouterr().out
+    assert admin_client.calls == []
+
+    call_command('metroid_rules')
+    output = capsys.readouterr().out
+    assert 'test/sub-test: Created rule metroid-subject-' in output
+    assert 'rule metroid-prefix-' in output
+    rules = admin_client.rules['test', 'sub-test']
+    assert sorted(rules) == sorted(['custom', *get_rule_filters(HANDLERS[:2])])
+    assert [call.split()[0] for call in admin_client.calls] == ['create', 'create', 'delete']
+
+    call_command('metroid_rules')
+    assert capsys.readouterr().out == 'test/sub-test: Rules are up to date\n'
+
+    # A regex that can't be a rule brings back the default rule
+    use_handlers(monkeypatch, [{**HANDLERS[0], 'subject': r'^Test/\d+$', 'regex': True}])
+    call_command('metroid_rules')
+    assert sorted(admin_client.rules['test', 'sub-test']) == ['$Default', 'custom']
+
+
+def test_command_error(admin_client, monkeypatch):
+    """
+    Tests that a failing administration client stops the command with the subscription in the error
+    """
+    admin_client.rules['test', 'sub-test']['metroid-denied'] = TrueRuleFilter()
+    use_handlers(monkeypatch, HANDLERS)
+    with pytest.raises(CommandError, match='Unable to sync the rules of test/sub-test: Mocked missing Manage claim'):
+        call_command('metroid_rules')
@@ -0,0 +1,102 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from azure.servicebus import NEXT_AVAILABLE_SESSION
+from azure.servicebus.exceptions import OperationTimeoutError
+
+from metroid.subscribe import subscribe_to_topic
+
+from .test_message_processor import HANDLERS, Message
+
+
+class SessionReceiver:
+    """
+    A receiver of one session, handing out its messages in one batch
+    """
+
+    def __init__(self, session_id: str, messages: list[Message]) -> None:
+        self.session = Mock(session_id=session_id)
+        self.messages = messages
+        self.completed: list[int] = []
+        self.abandon_message = AsyncMock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    async def receive_messages(self, max_message_count, max_wait_time):
+        messages, self.messages = self.messages, []
+        return messages
+
+    async def complete_message(self, message):
+        self.completed.append(message.sequence_number)
+
+
+class SessionClient:
+    """
+    Hands out the next available session, and times out when there are none left
+    """
+
+    def __init__(self, sessions: list[SessionReceiver], stopping: asyncio.Event) -> None:
+        self.sessions = list(sessions)
+        self.stopping = stopping
+        self.receiver_options: list[dict] = []
+
+    def get_subscription_receiver(self, **kwargs):
+        self.receiver_options.append(kwargs)
+        if self.sessions:
+            return self.sessions.pop(0)
+        return self
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.01)
+        self.stopping.set()
+        raise OperationTimeoutError(message='No session available')
+
+    async def __aexit__(self, *args):
+        return None
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_received_at_the_same_time_and_kept_in_order(mocker) -> None:
+    """
+    Tests that sessions are processed at the same time, while the messages of a session are settled in order
+    """
+
+    async def dispatch(tasks):
+        # Earlier messages take longer to enqueue, so they would be overtaken if they weren't processed in order
+        await asyncio.sleep(0.05 / int(tasks[0].message['id']))
+
+    mocker.patch('metroid.subscribe.Dispatcher.dispatch', side_effect=dispatch)
+    sessions = [
+        SessionReceiver(
+            session_id,
+            [Message(number, {'id': str(number), 'subject': 'Test/Django/Module'}) for number in range(1, 4)],
+        )
+        for session_id in ('entity-1', 'entity-2')
+    ]
+    stopping = asyncio.Event()
+    client = SessionClient(sessions, stopping)
+    await subscribe_to_topic(
+        connection_string='my long connection string',
+        topic_name='test',
+        subscription_name='sub-test',
+        handlers=HANDLERS,
+        batch_receive=True,
+        client_pool=Mock(get=AsyncMock(return_value=client)),
+        stopping=stopping,
+        sessions=True,
+        max_concurrent_sessions=2,
+        session_idle_timeout=10,
+    )
+    assert [session.completed for session in sessions] == [[1, 2, 3], [1, 2, 3]]
+    assert client.receiver_options[0] == {
+        'topic_name': 'test',
+        'subscription_name': 'sub-test',
+        'session_id': NEXT_AVAILABLE_SESSION,
+        'max_wait_time': 10,
+        'prefetch_count': 0,
+    }
@@ -2,7 +2,7 @@ from django.core.exceptions import ImproperlyConfigured
 
 import pytest
 
-from metroid.subscribe import match_handler_subject
+from metroid.utils import match_handler_subject
 
 
 def test_valid_pattern() -> None:
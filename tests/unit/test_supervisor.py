@@ -0,0 +1,110 @@
+import logging
+
+import pytest
+
+from metroid.supervisor import ProcessSupervisor, assign_subscriptions
+from metroid.utils import backoff_delay
+
+
+def make_subscriptions(count: int) -> list[dict]:
+    return [
+        {
+            'topic_name': 'test',
+            'subscription_name': f'sub-test-{i}',
+            'connection_string': 'Endpoint=sb://cool',
+            'handlers': [],
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize(
+    'subscriptions, processes, expected',
+    [
+        (5, 2, [['sub-test-0', 'sub-test-2', 'sub-test-4'], ['sub-test-1', 'sub-test-3']]),
+        (2, 2, [['sub-test-0'], ['sub-test-1']]),
+        # More processes than subscriptions gives competing receivers
+        (2, 3, [['sub-test-0'], ['sub-test-1'], ['sub-test-0']]),
+        (0, 2, [[], []]),
+    ],
+)
+def test_assign_subscriptions(subscriptions, processes, expected) -> None:
+    """
+    Tests that subscriptions are spread round robin across processes
+    """
+    assigned = assign_subscriptions(make_subscriptions(subscriptions), processes)  # type: ignore[arg-type]
+    assert [[sub['subscription_name'] for sub in worker] for worker in assigned] == expected
+
+
+def test_backoff_delay() -> None:
+    """
+    Tests that the delay doubles per attempt, up to the maximum
+    """
+    assert [backoff_delay(attempt, base=1, maximum=10) for attempt in range(6)] == [1, 2, 4, 8, 10, 10]
+    assert all(2 <= backoff_delay(2, base=1, maximum=10, jitter=True) <= 4 for _ in range(20))
+
+
+class FakeProcess:
+    pids = iter(range(1000, 2000))
+
+    def __init__(self, **kwargs) -> None:
+        self.pid = next(self.pids)
+        self.alive = False
+        self.exitcode = None
+
+    def start(self) -> None:
+        self.alive = True
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+
+@pytest.fixture
+def supervisor(mocker) -> ProcessSupervisor:
+    supervisor = ProcessSupervisor(
+        subscriptions=make_subscriptions(2), processes=2, metrics_interval=60  # type: ignore[arg-type]
+    )
+    mocker.patch.object(supervisor.context, 'Process', FakeProcess)
+    return supervisor
+
+
+def test_exited_worker_is_restarted_with_backoff(supervisor, mocker, caplog) -> None:
+    """
+    Tests that a worker that exits is restarted after a delay, which grows while it keeps failing
+    """
+    now = mocker.patch('metroid.supervisor.time.monotonic', return_value=100.0)
+    for worker in supervisor.workers:
+        supervisor._start_worker(worker)
+    worker = supervisor.workers[0]
+    first = worker.process
+    first.alive, first.exitcode = False, 1
+    supervisor._check_workers()
+    assert worker.restart_at == 101.0
+    assert 'Worker process 0 exited with code 1, restarting it in 1.0 seconds' in caplog.messages
+
+    now.return_value = 101.0
+    supervisor._check_workers()
+    assert worker.process is not first and worker.process.is_alive()
+    assert supervisor.workers[1].process.is_alive()
+
+    worker.process.alive = False
+    supervisor._check_workers()
+    assert worker.restart_at == 103.0
+
+
+def test_metrics_of_workers_are_combined(supervisor, mocker) -> None:
+    """
+    Tests that the metrics of all workers, including the previous runs of restarted workers, are added up
+    """
+    mocker.patch('metroid.supervisor.time.monotonic', return_value=100.0)
+    for worker in supervisor.workers:
+        supervisor._start_worker(worker)
+    first, second = (worker.process for worker in supervisor.workers)
+    timing = {'count': 1, 'avg': 1.0, 'max': 1.0}
+    supervisor.events.put(('metrics', first.pid, {'test/sub-test-0': {'messages_received': 2, 'enqueue_time': timing}}))
+    supervisor.events.put(('metrics', second.pid, {'test/sub-test-0': {'messages_received': 3}}))
+    supervisor.events.put(logging.makeLogRecord({'name': 'metroid', 'msg': 'From a worker', 'levelno': logging.INFO}))
+    supervisor.events.put(None)
+    supervisor._listen()
+    supervisor._start_worker(supervisor.workers[0])  # Restart, keeping the metrics of the first run
+    assert supervisor.snapshot() == {'test/sub-test-0': {'messages_received': 5, 'enqueue_time': timing}}